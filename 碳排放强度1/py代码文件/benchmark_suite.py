@@ -0,0 +1,350 @@
+"""
+估计与匹配热点路径的性能基准测试
+
+计时对象:
+- ols_regression / cluster_se          (did_baseline_regression.py, LSDV + 逐城市循环)
+- ols_regression_clustered             (did_total_dataset.py)
+- PropensityScoreMatcher.estimate_propensity_scores / perform_matching
+- 事件研究变量构建 (event_study_parallel_trends.py 中的相对年份 + 归并 + 虚拟变量)
+- Excel 读取 (pd.read_excel) 与列缓存加载 (panel_loader.LazyPanel)
+- twfe_regression (panel_regression.py 组内变换核心, 作为对照)
+
+测试面板:
+- 真实面板 (总数据集_2007-2023_最终回归版.xlsx)
+- 合成面板: 300 / 3,000 / 30,000 个城市 × 17 年
+
+每个用例记录墙钟时间 (多次取最小值与均值) 和峰值内存 (tracemalloc),
+追加写入 JSON 历史文件 (benchmark_history.json), 并与上一次运行对比,
+便于发现不同版本之间的性能退化。
+
+原回归脚本在导入时会执行整个分析流程, 因此通过 ast 只提取其中的函数定义;
+cluster_se 依赖脚本中的全局变量 df, 计时前注入。
+LSDV 设计矩阵 (N+T 列虚拟变量) 超过内存预算时, 相应用例记为 skipped。
+
+Created: 2026-10-19
+"""
+
+import ast
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from panel_regression import twfe_regression
+from synthetic_panel import SyntheticDIDGenerator
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = 'benchmark_history.json'
+DATA_FILE = '总数据集_2007-2023_最终回归版.xlsx'
+SYNTHETIC_SIZES = [300, 3000, 30000]
+N_YEARS = 17
+MAX_DESIGN_GB = 1.0
+
+CONTROL_VARS = ['ln_pgdp', 'ln_pop_density', 'tertiary_share', 'ln_fdi', 'ln_road_area']
+
+# 函数名 → 所在脚本
+LEGACY_SOURCES = {
+    'ols_regression': 'did_baseline_regression.py',
+    'cluster_se': 'did_baseline_regression.py',
+    'create_fe_dummies': 'did_baseline_regression.py',
+    'ols_regression_clustered': 'did_total_dataset.py',
+    'bin_relative_year': 'event_study_parallel_trends.py',
+}
+
+
+# ============================================================================
+# 原脚本函数提取
+# ============================================================================
+def load_legacy_functions(sources=LEGACY_SOURCES, script_dir=SCRIPT_DIR):
+    """
+    从原分析脚本中只提取函数定义 (不执行脚本的顶层代码)
+
+    Returns:
+    --------
+    dict : 函数名 → 函数对象; 键 '__namespace__' 为函数的全局命名空间
+           (用于注入 cluster_se 依赖的全局变量 df)
+    """
+    namespace = {'np': np, 'pd': pd, 'stats': stats}
+    by_file = {}
+    for name, filename in sources.items():
+        by_file.setdefault(filename, []).append(name)
+
+    for filename, names in by_file.items():
+        path = os.path.join(script_dir, filename)
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        nodes = [node for node in tree.body
+                 if isinstance(node, ast.FunctionDef) and node.name in names]
+        missing = set(names) - {node.name for node in nodes}
+        if missing:
+            raise ValueError(f'{filename} 中未找到函数: {sorted(missing)}')
+        exec(compile(ast.Module(body=nodes, type_ignores=[]), path, 'exec'), namespace)
+
+    functions = {name: namespace[name] for name in sources}
+    functions['__namespace__'] = namespace
+    return functions
+
+
+# ============================================================================
+# 测试面板
+# ============================================================================
+def synthetic_panel(n_units, n_years=N_YEARS, start_year=2007, seed=0):
+    """
+    合成多期DID面板 (synthetic_panel.SyntheticDIDGenerator, 与主数据集同名变量)
+
+    Parameters:
+    -----------
+    n_units : int
+        城市数
+    n_years : int
+        年份数
+    """
+    generator = SyntheticDIDGenerator(n_units, years=(start_year, start_year + n_years - 1))
+    return generator.generate(seed=seed)
+
+
+def real_panel(path=DATA_FILE):
+    df = pd.read_excel(path)
+    return df.dropna(subset=['ln_carbon_intensity', 'did', 'treat'] + CONTROL_VARS) \
+        .sort_values(['city_name', 'year']).reset_index(drop=True)
+
+
+# ============================================================================
+# 计时
+# ============================================================================
+def measure(func, repeat=3):
+    """
+    计时 (repeat 次取最小/均值) + 单独一次 tracemalloc 运行记录峰值内存
+
+    Returns:
+    --------
+    dict : wall_min_s, wall_mean_s, peak_mb
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'wall_min_s': min(times), 'wall_mean_s': float(np.mean(times)),
+            'peak_mb': peak / 1024 ** 2}
+
+
+def legacy_event_study_build(df, bin_relative_year):
+    """原脚本的事件研究变量构建流程 (逐行 apply + get_dummies + 设计矩阵)"""
+    df = df.copy()
+    df['relative_year'] = df.apply(
+        lambda row: (row['year'] - row['pilot_year']) if row['treat'] == 1 else 0, axis=1)
+    df['binned_relative_year'] = df.apply(
+        lambda row: bin_relative_year(row['relative_year'], row['treat']), axis=1)
+    event_dummies = pd.get_dummies(df['binned_relative_year'], prefix='event')
+    event_vars = [col for col in event_dummies.columns if col != 'event_-1']
+    return np.column_stack([event_dummies[event_vars].to_numpy(dtype=float),
+                            df[CONTROL_VARS].to_numpy()])
+
+
+def benchmark_panel(label, df, legacy, repeat=3, max_design_gb=MAX_DESIGN_GB):
+    """
+    在一个面板上运行全部用例
+
+    Returns:
+    --------
+    list of dict : 每个用例一条记录
+    """
+    from propensity_score_matching import PropensityScoreMatcher
+
+    n_units = df['city_name'].nunique()
+    n_years = df['year'].nunique()
+    n_obs = len(df)
+    design_gb = n_obs * (1 + len(CONTROL_VARS) + n_units + n_years) * 8 / 1024 ** 3
+    lsdv_ok = design_gb <= max_design_gb
+    base = {'panel': label, 'n_units': n_units, 'n_years': n_years, 'n_obs': n_obs}
+    records = []
+
+    def record(case, func, enabled=True, reason=None, n_repeat=repeat):
+        if not enabled:
+            records.append({**base, 'case': case, 'status': 'skipped', 'reason': reason})
+            print(f'[INFO] {label:>14s} | {case:<34s} | skipped ({reason})')
+            return
+        try:
+            res = measure(func, n_repeat)
+        except Exception as exc:
+            records.append({**base, 'case': case, 'status': 'error', 'reason': repr(exc)})
+            print(f'[WARNING] {label:>14s} | {case:<34s} | error: {exc!r}')
+            return
+        records.append({**base, 'case': case, 'status': 'ok', **res})
+        print(f'[OK] {label:>14s} | {case:<34s} | {res["wall_min_s"]:9.4f}s | '
+              f'{res["peak_mb"]:9.1f} MB')
+
+    y = df['ln_carbon_intensity'].to_numpy(dtype=float)
+    X_core = df[['did'] + CONTROL_VARS].to_numpy(dtype=float)
+    entity = pd.Categorical(df['city_name']).codes
+    time_codes = pd.Categorical(df['year']).codes
+    reason = f'LSDV设计矩阵 {design_gb:.1f}GB 超过预算 {max_design_gb}GB'
+    n_repeat = repeat if n_obs < 100_000 else 1
+
+    if lsdv_ok:
+        city_dummies, year_dummies = legacy['create_fe_dummies'](df, 'city_name', 'year')
+        X_lsdv = np.column_stack([X_core, city_dummies.to_numpy(dtype=float),
+                                  year_dummies.to_numpy(dtype=float)])
+        lsdv_results = legacy['ols_regression'](y, X_lsdv)
+        legacy['__namespace__']['df'] = df
+    record('ols_regression', lambda: legacy['ols_regression'](y, X_lsdv), lsdv_ok, reason,
+           n_repeat)
+    record('cluster_se',
+           lambda: legacy['cluster_se'](y, X_lsdv, lsdv_results['residuals'], 'city_name'),
+           lsdv_ok, reason, n_repeat)
+    record('ols_regression_clustered',
+           lambda: legacy['ols_regression_clustered'](y, X_lsdv, 'city_name', df),
+           lsdv_ok, reason, n_repeat)
+    record('twfe_regression',
+           lambda: twfe_regression(y, X_core, entity, time_codes, cluster_codes=entity),
+           n_repeat=n_repeat)
+
+    matcher = PropensityScoreMatcher(df, covariates=CONTROL_VARS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        matcher.handle_missing_values()
+    record('psm.estimate_propensity_scores', matcher.estimate_propensity_scores,
+           n_repeat=n_repeat)
+    record('psm.perform_matching', matcher.perform_matching, n_repeat=n_repeat)
+
+    record('event_study_build',
+           lambda: legacy_event_study_build(df, legacy['bin_relative_year']),
+           n_repeat=n_repeat)
+    return records
+
+
+def benchmark_loaders(path=DATA_FILE, repeat=3):
+    """Excel 读取与列缓存加载"""
+    from panel_loader import LazyPanel, build_column_store
+
+    records = []
+    base = {'panel': '真实面板', 'n_units': None, 'n_years': None, 'n_obs': None}
+    cases = {
+        'excel_loader.read_excel': lambda: pd.read_excel(path),
+        'excel_loader.column_cache_build': lambda: build_column_store(path),
+        'excel_loader.lazy_panel_collect': lambda: LazyPanel(path)
+            .select(['city_name', 'year', 'ln_carbon_intensity', 'did'] + CONTROL_VARS)
+            .collect(),
+    }
+    for case, func in cases.items():
+        res = measure(func, repeat)
+        records.append({**base, 'case': case, 'status': 'ok', **res})
+        print(f'[OK] {"真实面板":>14s} | {case:<34s} | {res["wall_min_s"]:9.4f}s | '
+              f'{res["peak_mb"]:9.1f} MB')
+    return records
+
+
+# ============================================================================
+# 历史记录
+# ============================================================================
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path=HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def append_history(records, path=HISTORY_FILE):
+    """追加一次运行到 JSON 历史文件"""
+    history = load_history(path)
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': records,
+    }
+    history.append(run)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2, default=float)
+    print(f'[OK] 基准测试历史已更新: {path} (共 {len(history)} 次运行)')
+    return history
+
+
+def compare_with_previous(history, threshold=1.2):
+    """
+    与上一次运行对比
+
+    Returns:
+    --------
+    pd.DataFrame : 用例、本次/上次最短时间及比值 (比值 > threshold 标记为退化)
+    """
+    if len(history) < 2:
+        return None
+    key = lambda r: (r['panel'], r['case'])
+    previous = {key(r): r for r in history[-2]['results'] if r['status'] == 'ok'}
+    rows = []
+    for r in history[-1]['results']:
+        if r['status'] != 'ok' or key(r) not in previous:
+            continue
+        before = previous[key(r)]['wall_min_s']
+        ratio = r['wall_min_s'] / before if before > 0 else np.nan
+        rows.append({'面板': r['panel'], '用例': r['case'], '上次(秒)': before,
+                     '本次(秒)': r['wall_min_s'], '比值': ratio,
+                     '状态': '退化' if ratio > threshold else 'OK'})
+    return pd.DataFrame(rows)
+
+
+def main(sizes=SYNTHETIC_SIZES, repeat=3, max_design_gb=MAX_DESIGN_GB):
+    """
+    主函数: 真实面板 + 合成面板基准测试
+    """
+    print('[OK] === 性能基准测试 ===')
+    legacy = load_legacy_functions()
+    records = []
+
+    if os.path.exists(DATA_FILE):
+        records += benchmark_loaders(DATA_FILE, repeat)
+        records += benchmark_panel('真实面板', real_panel(DATA_FILE), legacy, repeat,
+                                   max_design_gb)
+    else:
+        print(f'[WARNING] 未找到 {DATA_FILE}, 跳过真实面板')
+
+    for n_units in sizes:
+        df = synthetic_panel(n_units)
+        records += benchmark_panel(f'合成{n_units}×{N_YEARS}', df, legacy, repeat,
+                                   max_design_gb)
+
+    history = append_history(records)
+    comparison = compare_with_previous(history)
+    if comparison is not None and len(comparison) > 0:
+        print('\n[INFO] 与上一次运行对比:')
+        print(comparison.to_string(index=False))
+        n_slow = (comparison['状态'] == '退化').sum()
+        if n_slow:
+            print(f'[WARNING] {n_slow} 个用例比上一次慢 20% 以上')
+    return records
+
+
+if __name__ == '__main__':
+    records = main()
@@ -0,0 +1,298 @@
+"""
+单次分组聚合的描述性统计引擎
+
+替代 descriptive_stats_total_dataset.py、generate_descriptive_statistics.py、
+generate_final_winsorized_stats.py、generate_regression_ready_stats.py 以及
+使用CEADs数据/py代码文件/step5b_descriptive_statistics_v2.py 中
+"逐变量 × 逐分组反复筛选 DataFrame" 的循环:
+
+1. 全部分组方式 (全样本 / 处理组vs对照组 / 分年份 / 分批次 ...) 与数据版本
+   (原始 / 缩尾后) 堆叠为一个数据块, 用一个组合分组键完成一次 groupby 聚合
+2. 统计量: 观测数、缺失数、均值、标准差、最小值、分位数、最大值、偏度、峰度
+3. 缩尾前后对比与其他统计量来自同一次聚合
+4. 全部工作表由同一个内存中的结果写出
+
+用法示例:
+    from descriptive_engine import DescriptiveEngine
+    engine = DescriptiveEngine(df, variables,
+                               groupings={'全样本': None, '处理组/对照组': 'treat'},
+                               winsorize=True)
+    engine.run()
+    engine.save('描述性统计.xlsx')
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+
+from panel_winsorize import Winsorizer
+
+STAT_COLUMNS = ['观测数', '缺失数', '缺失比例(%)', '均值', '标准差', '最小值',
+                '25%分位', '中位数', '75%分位', '最大值', '偏度', '峰度']
+
+DEFAULT_GROUPINGS = {
+    '全样本': None,
+    '处理组/对照组': 'treat',
+    '年份': 'year',
+    '试点批次': 'pilot_year',
+}
+
+GROUP_LABELS = {
+    'treat': {0: '对照组', 1: '处理组'},
+}
+
+
+class DescriptiveEngine:
+    """
+    分组描述性统计 (一次聚合)
+    """
+
+    def __init__(self, df, variables, groupings=None, winsorize=False, lower=0.01,
+                 upper=0.99, var_labels=None):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            数据
+        variables : list
+            统计变量 (不存在的变量自动跳过)
+        groupings : dict, optional
+            分组名称 → 分组列 (None 表示全样本), 默认 DEFAULT_GROUPINGS
+        winsorize : bool
+            是否同时计算缩尾后统计量 (缩尾前后对比)
+        lower, upper : float
+            缩尾分位数
+        var_labels : dict, optional
+            变量名 → 中文名称
+        """
+        self.df = df
+        self.variables = [var for var in variables if var in df.columns]
+        skipped = [var for var in variables if var not in df.columns]
+        if skipped:
+            print(f'[WARNING] 以下变量不存在, 跳过: {skipped}')
+        groupings = DEFAULT_GROUPINGS if groupings is None else groupings
+        self.groupings = {label: col for label, col in groupings.items()
+                          if col is None or col in df.columns}
+        self.winsorize = winsorize
+        self.lower = lower
+        self.upper = upper
+        self.var_labels = var_labels or {}
+        self.result = None
+
+    def _versions(self):
+        """数据版本 (原始 / 缩尾后) 的数值块"""
+        raw = self.df[self.variables].to_numpy(dtype=np.float64, na_value=np.nan)
+        versions = {'原始': raw}
+        if self.winsorize:
+            winsorizer = Winsorizer(self.variables, self.lower, self.upper)
+            winsorized = winsorizer.fit_transform(self.df[self.variables])
+            versions['缩尾后'] = winsorized.to_numpy(dtype=np.float64, na_value=np.nan)
+        return versions
+
+    def _group_keys(self):
+        """
+        每种分组方式的组编码与组标签
+
+        Returns:
+        --------
+        list of (分组名称, codes, labels)
+        """
+        keys = []
+        n = len(self.df)
+        for label, col in self.groupings.items():
+            if col is None:
+                keys.append((label, np.zeros(n, dtype=np.int64), ['全部']))
+                continue
+            codes, uniques = pd.factorize(self.df[col], sort=True)
+            mapping = GROUP_LABELS.get(col, {})
+            labels = [mapping.get(value, int(value) if isinstance(value, float)
+                                  and value.is_integer() else value)
+                      for value in uniques]
+            if (codes < 0).any():
+                codes = np.where(codes < 0, len(labels), codes)
+                labels.append('未分组')
+            keys.append((label, codes.astype(np.int64), labels))
+        return keys
+
+    def run(self):
+        """
+        一次分组聚合计算全部统计量
+
+        Returns:
+        --------
+        pd.DataFrame : 长格式结果 (版本, 分组方式, 组别, 变量, 各统计量)
+        """
+        versions = self._versions()
+        group_keys = self._group_keys()
+
+        # 堆叠: (版本 × 分组方式) 份数据, 组合分组键 = 偏移量 + 组编码
+        blocks, keys, index = [], [], []
+        offset = 0
+        for version, block in versions.items():
+            for grouping, codes, labels in group_keys:
+                blocks.append(block)
+                keys.append(codes + offset)
+                index += [(version, grouping, group) for group in labels]
+                offset += len(labels)
+        stacked = pd.DataFrame(np.vstack(blocks), columns=self.variables)
+        key = np.concatenate(keys)
+
+        grouped = stacked.groupby(key, sort=True)
+        size = grouped.size()
+        count = grouped.count()
+        mean = grouped.mean()
+        quantiles = grouped.quantile([0.25, 0.5, 0.75])
+
+        # 峰度 (与 pandas kurt 相同的无偏超额峰度)
+        centered = stacked.to_numpy() - mean.to_numpy()[np.searchsorted(mean.index, key)]
+        m2 = pd.DataFrame(centered ** 2).groupby(key, sort=True).sum().to_numpy()
+        m4 = pd.DataFrame(centered ** 4).groupby(key, sort=True).sum().to_numpy()
+        n = count.to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kurt = (n * (n + 1) * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2)
+                    - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+        kurt = np.where((n > 3) & (m2 > 0), kurt, np.nan)
+
+        stats = {
+            '观测数': count.to_numpy(),
+            '缺失数': size.to_numpy()[:, None] - count.to_numpy(),
+            '缺失比例(%)': (size.to_numpy()[:, None] - count.to_numpy())
+                          / size.to_numpy()[:, None] * 100,
+            '均值': mean.to_numpy(),
+            '标准差': grouped.std().to_numpy(),
+            '最小值': grouped.min().to_numpy(),
+            '25%分位': quantiles.xs(0.25, level=1).to_numpy(),
+            '中位数': quantiles.xs(0.5, level=1).to_numpy(),
+            '75%分位': quantiles.xs(0.75, level=1).to_numpy(),
+            '最大值': grouped.max().to_numpy(),
+            '偏度': grouped.skew().to_numpy(),
+            '峰度': kurt,
+        }
+
+        # 所有组都出现在 key 中 (每份数据的组编码连续), 因此行顺序与 index 一致
+        n_groups, n_vars = len(index), len(self.variables)
+        labels = np.asarray(index, dtype=object)
+        result = pd.DataFrame({
+            '版本': np.repeat(labels[:, 0], n_vars),
+            '分组方式': np.repeat(labels[:, 1], n_vars),
+            '组别': np.repeat(labels[:, 2], n_vars),
+            '变量': np.tile(self.variables, n_groups),
+            '变量名称': np.tile([self.var_labels.get(v, v) for v in self.variables], n_groups),
+        })
+        for name in STAT_COLUMNS:
+            result[name] = np.asarray(stats[name], dtype=np.float64).ravel()
+        result['观测数'] = result['观测数'].astype(int)
+        result['缺失数'] = result['缺失数'].astype(int)
+        self.result = result
+        return result
+
+    # ------------------------------------------------------------------
+    # 由同一结果派生的各表
+    # ------------------------------------------------------------------
+    def table(self, grouping='全样本', version='原始'):
+        """某一分组方式、某一版本的统计表"""
+        mask = (self.result['分组方式'] == grouping) & (self.result['版本'] == version)
+        columns = ['变量', '变量名称'] + STAT_COLUMNS
+        if grouping != '全样本':
+            columns = ['组别'] + columns
+        return self.result.loc[mask, columns].reset_index(drop=True)
+
+    def group_means(self, grouping, version='原始', stat='均值'):
+        """宽格式: 变量 × 组别"""
+        sub = self.result[(self.result['分组方式'] == grouping) &
+                          (self.result['版本'] == version)]
+        return sub.pivot(index='变量', columns='组别', values=stat) \
+            .reindex(self.variables)
+
+    def treatment_comparison(self, version='原始'):
+        """处理组 vs 对照组均值对比"""
+        means = self.group_means('处理组/对照组', version)
+        comparison = pd.DataFrame({
+            '变量': means.index,
+            '对照组均值': means.get('对照组'),
+            '处理组均值': means.get('处理组'),
+        }).reset_index(drop=True)
+        comparison['均值差异'] = comparison['处理组均值'] - comparison['对照组均值']
+        return comparison
+
+    def winsorize_comparison(self):
+        """缩尾前后对比 (全样本, 并列展示)"""
+        if not self.winsorize:
+            return None
+        raw = self.table('全样本', '原始').set_index('变量')
+        win = self.table('全样本', '缩尾后').set_index('变量')
+        columns = ['均值', '标准差', '最小值', '最大值', '偏度', '峰度']
+        comparison = pd.concat({'缩尾前': raw[columns], '缩尾后': win[columns]}, axis=1)
+        comparison = comparison.swaplevel(axis=1)[columns]
+        comparison.columns = [f'{stat}_{version}' for stat, version in comparison.columns]
+        comparison['均值变化(%)'] = (win['均值'] - raw['均值']) / raw['均值'] * 100
+        return comparison.reset_index()
+
+    def save(self, output_file='描述性统计_分组汇总.xlsx'):
+        """由同一结果写出全部工作表"""
+        if self.result is None:
+            self.run()
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            self.table().to_excel(writer, sheet_name='总体描述性统计', index=False)
+            if '处理组/对照组' in self.groupings:
+                self.treatment_comparison().to_excel(writer, sheet_name='处理组vs对照组',
+                                                     index=False)
+            for grouping in self.groupings:
+                if grouping in ('全样本', '处理组/对照组'):
+                    continue
+                self.group_means(grouping).to_excel(writer, sheet_name=f'分{grouping}均值'[:31])
+            if self.winsorize:
+                self.winsorize_comparison().to_excel(writer, sheet_name='缩尾前后对比',
+                                                     index=False)
+            missing = self.table()[['变量', '变量名称', '观测数', '缺失数', '缺失比例(%)']]
+            missing.to_excel(writer, sheet_name='缺失值统计', index=False)
+            self.df[self.variables].corr().to_excel(writer, sheet_name='相关系数矩阵')
+            self.result.to_excel(writer, sheet_name='全部分组明细', index=False)
+        print(f'[OK] 描述性统计已保存: {output_file}')
+
+
+def main():
+    """
+    主函数: 回归变量的分组描述性统计 (含缩尾前后对比)
+    """
+    print('[OK] === 分组描述性统计 ===')
+    df = pd.read_excel('总数据集_2007-2023_完整版_无缺失FDI.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    variables = ['ln_carbon_intensity', 'did', 'treat', 'post', 'ln_pgdp', 'ln_pop_density',
+                 'ln_pop', 'ln_fdi', 'ln_road_area', 'tertiary_share', 'industrial_advanced',
+                 'fdi_openness', 'financial_development']
+    var_labels = {
+        'ln_carbon_intensity': '碳排放强度对数',
+        'did': 'DID政策变量',
+        'treat': '处理组',
+        'post': '政策时间',
+        'ln_pgdp': '人均GDP对数',
+        'ln_pop_density': '人口密度对数',
+        'ln_pop': '人口规模对数',
+        'ln_fdi': '外商直接投资对数',
+        'ln_road_area': '人均道路面积对数',
+        'tertiary_share': '第三产业比重',
+        'industrial_advanced': '产业结构高级化',
+        'fdi_openness': '外商投资水平',
+        'financial_development': '金融发展水平',
+    }
+
+    engine = DescriptiveEngine(df, variables, winsorize=True, var_labels=var_labels)
+    result = engine.run()
+    print(f'[OK] 统计完成: {len(result)} 行 '
+          f'({result["版本"].nunique()} 个版本 × {result["分组方式"].nunique()} 种分组)')
+
+    print('\n[INFO] 总体描述性统计:')
+    print(engine.table()[['变量', '观测数', '均值', '标准差', '最小值', '最大值']]
+          .to_string(index=False))
+    print('\n[INFO] 处理组 vs 对照组:')
+    print(engine.treatment_comparison().to_string(index=False))
+
+    engine.save()
+    return engine
+
+
+if __name__ == '__main__':
+    engine = main()
@@ -0,0 +1,374 @@
+"""
+异质性分析引擎: 分组DID回归 + 交互项模型 + 森林图
+
+分组维度 (城市层面, 由现有变量生成, 不随时间变化):
+- 区域: city_code 前两位 → 东部/中部/西部 (国家统计局三大地带划分);
+  缺少 city_code 的城市用 PROVINCE_FALLBACK 补齐省份
+- 试点批次: 第一批(2010)/第二批(2013)/第三批(2017), 每个批次与全部未试点城市比较
+- 城市规模: 基期 (2007-2009) 平均人口 population 三分位
+- 人口密度: 基期平均 pop_density 三分位
+- 资源依赖: 当前目录存在 资源型城市名单.xlsx (列: city_name) 时按名单划分;
+  否则以基期 industrial_upgrading 最低三分位 (第二产业主导) 作为代理
+
+计算方式:
+- 交互项模型: did×各组虚拟变量 + 控制变量 + 城市/年份固定效应; 控制变量与被解释变量
+  只在全样本上去均值一次并缓存, 每个分组维度只需对新的交互列去均值
+- 分组回归: 一个维度的全部子样本堆叠后 (共享的对照组按子样本复制),
+  以 子样本×城市、子样本×年份 为固定效应一次去均值, 等价于各子样本分别做双向固定效应;
+  之后各子样本切片做 OLS 与城市聚类标准误
+
+Created: 2026-10-19
+"""
+
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from panel_regression import TwoWayDemeaner, cluster_meat
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+CONTROL_VARS = ['ln_pgdp', 'ln_pop_density', 'tertiary_share', 'ln_fdi', 'ln_road_area']
+BASELINE_YEARS = (2007, 2009)
+
+REGIONS = {
+    '东部': [11, 12, 13, 21, 31, 32, 33, 35, 37, 44, 46],
+    '中部': [14, 22, 23, 34, 36, 41, 42, 43],
+    '西部': [15, 45, 50, 51, 52, 53, 54, 61, 62, 63, 64, 65],
+}
+
+# 数据集中缺少 city_code 的城市所属省份 (省级行政区划代码)
+PROVINCE_FALLBACK = {
+    '七台河市': 23, '丹东市': 21, '九江市': 36, '佳木斯市': 23, '信阳市': 41, '北海市': 45,
+    '南宁市': 45, '南昌市': 36, '双鸭山市': 23, '吉林市': 22, '周口市': 41, '呼伦贝尔市': 15,
+    '哈密市': 65, '哈尔滨市': 23, '商丘市': 41, '商洛市': 61, '四平市': 22, '大庆市': 23,
+    '大连市': 21, '孝感市': 42, '安康市': 61, '宝鸡市': 61, '广安市': 51, '开封市': 41,
+    '抚顺市': 21, '攀枝花市': 51, '新乡市': 41, '普洱市': 53, '朝阳市': 21, '本溪市': 21,
+    '松原市': 22, '桂林市': 45, '梧州市': 45, '汉中市': 61, '沈阳市': 21, '洛阳市': 41,
+    '淄博市': 37, '渭南市': 61, '漯河市': 41, '濮阳市': 41, '牡丹江市': 23, '玉林市': 45,
+    '白城市': 22, '白山市': 22, '百色市': 45, '盘锦市': 21, '绥化市': 23, '萍乡市': 36,
+    '营口市': 21, '葫芦岛市': 21, '蚌埠市': 34, '襄阳市': 42, '许昌市': 41, '贺州市': 45,
+    '辽源市': 22, '辽阳市': 21, '达州市': 51, '通化市': 22, '钦州市': 45, '铁岭市': 21,
+    '锦州市': 21, '长春市': 22, '长沙市': 43, '阜新市': 21, '鞍山市': 21, '驻马店市': 41,
+    '鹤岗市': 23, '鹰潭市': 36, '黄山市': 34, '黄石市': 42,
+}
+
+BATCH_LABELS = {2010: '第一批(2010)', 2013: '第二批(2013)', 2017: '第三批(2017)'}
+CONTROL_LABEL = '未试点'
+TERCILE_LABELS = ['低', '中', '高']
+LEVEL_ORDER = list(REGIONS) + list(BATCH_LABELS.values()) + TERCILE_LABELS
+
+
+def _ordered(levels):
+    """子样本排序: 区域、批次、低/中/高 按自然顺序, 其余按名称"""
+    def key(level):
+        hits = [i for i, prefix in enumerate(LEVEL_ORDER) if str(level).startswith(prefix)]
+        return (hits[0] if hits else len(LEVEL_ORDER), str(level))
+    return sorted(levels, key=key)
+
+
+# ============================================================================
+# 分组标签
+# ============================================================================
+def city_province(df):
+    """城市 → 省级代码 (city_code 前两位, 缺失时查 PROVINCE_FALLBACK)"""
+    codes = df.dropna(subset=['city_code']).drop_duplicates('city_name') \
+        .set_index('city_name')['city_code']
+    province = (codes // 10000).astype(int)
+    cities = pd.Index(df['city_name'].unique())
+    fallback = pd.Series(PROVINCE_FALLBACK)
+    return province.reindex(cities).fillna(fallback.reindex(cities))
+
+
+def baseline_terciles(df, var, years=BASELINE_YEARS, labels=TERCILE_LABELS):
+    """城市基期均值的三分位分组 (基期缺失时用全部年份均值)"""
+    base = df[df['year'].between(*years)].groupby('city_name')[var].mean()
+    overall = df.groupby('city_name')[var].mean()
+    values = base.reindex(overall.index).fillna(overall)
+    return pd.qcut(values, 3, labels=labels).astype(str).replace('nan', np.nan)
+
+
+def derive_groups(df, resource_file='资源型城市名单.xlsx'):
+    """
+    生成城市层面的分组标签
+
+    Returns:
+    --------
+    groups : pd.DataFrame
+        index 为城市, 每列一个分组维度
+    shared : dict
+        分组维度 → 在各子样本中共享的对照组标签 (无则为 None)
+    """
+    cities = pd.Index(df['city_name'].unique(), name='city_name')
+    groups = pd.DataFrame(index=cities)
+
+    province = city_province(df)
+    region = pd.Series(np.nan, index=cities, dtype=object)
+    for name, codes in REGIONS.items():
+        region[province.isin(codes)] = name
+    groups['区域'] = region
+
+    pilot = df.drop_duplicates('city_name').set_index('city_name')['pilot_year'].reindex(cities)
+    groups['试点批次'] = pilot.map(BATCH_LABELS).fillna(CONTROL_LABEL)
+    groups['城市规模'] = baseline_terciles(df, 'population').reindex(cities) \
+        .map(lambda x: f'{x}规模' if isinstance(x, str) else x)
+    groups['人口密度'] = baseline_terciles(df, 'pop_density').reindex(cities) \
+        .map(lambda x: f'{x}密度' if isinstance(x, str) else x)
+
+    if os.path.exists(resource_file):
+        resource = set(pd.read_excel(resource_file)['city_name'])
+        groups['资源依赖'] = np.where(cities.isin(resource), '资源型城市', '非资源型城市')
+    else:
+        print(f'[INFO] 未找到 {resource_file}, 资源依赖以基期第二产业主导程度代理')
+        upgrading = baseline_terciles(df, 'industrial_upgrading').reindex(cities)
+        groups['资源依赖(代理)'] = upgrading.map({'低': '第二产业主导', '中': '其他', '高': '其他'})
+
+    shared = {col: (CONTROL_LABEL if col == '试点批次' else None) for col in groups.columns}
+    return groups, shared
+
+
+# ============================================================================
+# 引擎
+# ============================================================================
+class HeterogeneityEngine:
+    """
+    异质性分析: 各分组维度的分组回归与交互项模型
+    """
+
+    def __init__(self, df, y_var='ln_carbon_intensity', treatment='did', controls=None,
+                 groups=None, shared=None, entity_var='city_name', time_var='year'):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据
+        y_var : str
+            被解释变量
+        treatment : str
+            政策变量
+        controls : list, optional
+            控制变量
+        groups : pd.DataFrame, optional
+            城市层面分组标签 (默认由 derive_groups 生成)
+        shared : dict, optional
+            分组维度 → 共享对照组标签
+        """
+        self.y_var = y_var
+        self.treatment = treatment
+        self.controls = CONTROL_VARS if controls is None else list(controls)
+        self.entity_var = entity_var
+        self.time_var = time_var
+        if groups is None:
+            groups, shared = derive_groups(df)
+        self.groups = groups
+        self.shared = shared or {}
+
+        self.sample = df.dropna(subset=[y_var, treatment] + self.controls) \
+            .reset_index(drop=True)
+        self.entity = pd.Categorical(self.sample[entity_var]).codes
+        self.time = pd.Categorical(self.sample[time_var]).codes
+        self.y = self.sample[y_var].to_numpy(dtype=np.float64)
+        self.d = self.sample[treatment].to_numpy(dtype=np.float64)
+        self.Xc = self.sample[self.controls].to_numpy(dtype=np.float64)
+
+        # 全样本去均值缓存 (交互项模型共用)
+        self.demeaner = TwoWayDemeaner(self.entity, self.time)
+        self._yd = self.demeaner.demean(self.y)
+        self._Xcd = self.demeaner.demean(self.Xc)
+        self.results = None
+
+    def _ols(self, yd, Xd, clusters, n_fe):
+        """去均值数据上的 OLS + 城市聚类标准误 (与 twfe_regression 相同的校正与自由度 G - 1)"""
+        XtX_inv = np.linalg.inv(Xd.T @ Xd)
+        beta = XtX_inv @ (Xd.T @ yd)
+        resid = yd - Xd @ beta
+        n = len(yd)
+        k = Xd.shape[1] + n_fe
+        meat, G = cluster_meat(Xd * resid[:, None], clusters)
+        vcov = (G / (G - 1)) * ((n - 1) / (n - k)) * XtX_inv @ meat @ XtX_inv
+        return beta, vcov, G - 1, G
+
+    def pooled(self):
+        """全样本基准DID"""
+        Xd = np.column_stack([self.demeaner.demean(self.d), self._Xcd])
+        beta, vcov, dof, G = self._ols(self._yd, Xd, self.entity, self.demeaner.n_fe)
+        return self._row('全样本', '全样本', '基准回归', beta[0], np.sqrt(vcov[0, 0]), dof,
+                         len(self._yd), G, int((self.sample.groupby(self.entity_var)[
+                             self.treatment].max() > 0).sum()))
+
+    @staticmethod
+    def _row(dimension, group, model, coef, se, dof, n_obs, n_cities, n_treated):
+        t = coef / se
+        margin = stats.t.ppf(0.975, dof) * se
+        return {'分组维度': dimension, '子样本': group, '模型': model, 'DID系数': coef,
+                '标准误': se, 't值': t, 'p值': 2 * (1 - stats.t.cdf(abs(t), dof)),
+                '95%CI下限': coef - margin, '95%CI上限': coef + margin,
+                '观测数': n_obs, '城市数': n_cities, '处理城市数': n_treated}
+
+    def _labels(self, dimension):
+        return self.sample[self.entity_var].map(self.groups[dimension]) \
+            .fillna('未分类').to_numpy(dtype=object)
+
+    def subgroup_models(self, dimension):
+        """
+        某一分组维度的全部子样本回归 (堆叠后一次去均值)
+
+        Returns:
+        --------
+        list of dict : 每个子样本一行
+        """
+        labels = self._labels(dimension)
+        shared = self.shared.get(dimension)
+        levels = _ordered(g for g in pd.unique(labels) if g not in (shared, '未分类'))
+
+        rows_idx, sub = [], []
+        for s, level in enumerate(levels):
+            idx = np.flatnonzero((labels == level) | (labels == shared))
+            rows_idx.append(idx)
+            sub.append(np.full(len(idx), s))
+        rows_idx, sub = np.concatenate(rows_idx), np.concatenate(sub)
+
+        n_e, n_t = self.entity.max() + 1, self.time.max() + 1
+        demeaner = TwoWayDemeaner(sub * n_e + self.entity[rows_idx], sub * n_t + self.time[rows_idx])
+        stacked = demeaner.demean(np.column_stack([self.y[rows_idx], self.d[rows_idx],
+                                                   self.Xc[rows_idx]]))
+
+        results = []
+        for s, level in enumerate(levels):
+            mask = sub == s
+            entity = self.entity[rows_idx[mask]]
+            n_fe = len(np.unique(entity)) + len(np.unique(self.time[rows_idx[mask]])) - 1
+            beta, vcov, dof, G = self._ols(stacked[mask, 0], stacked[mask, 1:], entity, n_fe)
+            treated = self.sample.iloc[rows_idx[mask]].groupby(self.entity_var)[
+                self.treatment].max()
+            results.append(self._row(dimension, level, '分组回归', beta[0],
+                                     np.sqrt(vcov[0, 0]), dof, int(mask.sum()), G,
+                                     int((treated > 0).sum())))
+        return results
+
+    def interaction_model(self, dimension):
+        """
+        交互项模型: did × 1(子样本) (复用缓存的去均值控制变量)
+
+        Returns:
+        --------
+        rows : list of dict
+            每个子样本的政策效应
+        wald : dict
+            组间系数相等的 Wald 检验
+        """
+        labels = self._labels(dimension)
+        levels = _ordered(g for g in pd.unique(labels)
+                          if g not in (self.shared.get(dimension), '未分类'))
+        D = np.column_stack([self.d * (labels == g) for g in levels])
+        keep = D.any(axis=0)
+        levels = [g for g, k in zip(levels, keep) if k]
+        Xd = np.column_stack([self.demeaner.demean(D[:, keep]), self._Xcd])
+        beta, vcov, dof, G = self._ols(self._yd, Xd, self.entity, self.demeaner.n_fe)
+
+        rows = []
+        for j, level in enumerate(levels):
+            cities = self.sample.loc[labels == level, self.entity_var].nunique()
+            treated = self.sample.loc[(labels == level) & (self.d > 0), self.entity_var].nunique()
+            rows.append(self._row(dimension, level, '交互项模型', beta[j], np.sqrt(vcov[j, j]),
+                                  dof, int((labels == level).sum()), cities, treated))
+
+        # H0: 各组 DID 效应相等
+        m = len(levels)
+        wald = {'分组维度': dimension, '组数': m}
+        if m > 1:
+            R = np.eye(m)[:-1] - np.eye(m)[1:]
+            b = R @ beta[:m]
+            stat = b @ np.linalg.solve(R @ vcov[:m, :m] @ R.T, b) / (m - 1)
+            wald.update({'F统计量': stat, '自由度': f'({m - 1}, {G - 1})',
+                         'p值': 1 - stats.f.cdf(stat, m - 1, G - 1)})
+        return rows, wald
+
+    def run(self):
+        """
+        全部分组维度的分组回归与交互项模型
+
+        Returns:
+        --------
+        pd.DataFrame : 结果表 (另存 self.wald_tests)
+        """
+        rows = [self.pooled()]
+        walds = []
+        for dimension in self.groups.columns:
+            rows.extend(self.subgroup_models(dimension))
+            inter, wald = self.interaction_model(dimension)
+            rows.extend(inter)
+            walds.append(wald)
+            print(f'[OK] {dimension}: {len(inter)} 个子样本, 组间差异 '
+                  f'p = {wald.get("p值", np.nan):.4f}')
+        self.results = pd.DataFrame(rows)
+        self.wald_tests = pd.DataFrame(walds)
+        return self.results
+
+    def plot_forest(self, output_file='异质性分析_森林图.png'):
+        """森林图: 各子样本 DID 系数与 95% 置信区间 (分组回归与交互项模型并列)"""
+        res = self.results
+        pooled = res[res['模型'] == '基准回归'].iloc[0]
+        body = res[res['模型'] != '基准回归']
+        keys = body[['分组维度', '子样本']].drop_duplicates().reset_index(drop=True)
+
+        fig, ax = plt.subplots(figsize=(9, 0.45 * len(keys) + 1.5))
+        y_pos = np.arange(len(keys))[::-1]
+        styles = {'分组回归': ('o', '#2c7bb6', -0.15), '交互项模型': ('s', '#d7191c', 0.15)}
+        for model, (marker, color, offset) in styles.items():
+            part = keys.merge(body[body['模型'] == model], on=['分组维度', '子样本'], how='left')
+            ax.errorbar(part['DID系数'], y_pos + offset,
+                        xerr=[part['DID系数'] - part['95%CI下限'],
+                              part['95%CI上限'] - part['DID系数']],
+                        fmt=marker, color=color, ecolor=color, capsize=3, markersize=5,
+                        linewidth=1, label=model)
+        ax.axvline(0, color='black', linewidth=0.8)
+        ax.axvline(pooled['DID系数'], color='gray', linestyle='--', linewidth=1,
+                   label=f'全样本 ({pooled["DID系数"]:.4f})')
+        ax.set_yticks(y_pos)
+        ax.set_yticklabels([f'{d}: {g}' for d, g in zip(keys['分组维度'], keys['子样本'])],
+                           fontsize=9)
+        ax.set_xlabel('DID 系数 (95% 置信区间)', fontsize=11)
+        ax.set_title('低碳试点政策效应的异质性', fontsize=13, fontweight='bold')
+        ax.legend(fontsize=9, loc='best')
+        ax.grid(True, axis='x', alpha=0.3)
+        plt.tight_layout()
+        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.close()
+        print(f'[OK] 森林图已保存: {output_file}')
+
+    def save(self, output_file='异质性分析结果.xlsx'):
+        """保存结果表、组间差异检验与城市分组标签"""
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            self.results.to_excel(writer, sheet_name='异质性结果', index=False)
+            self.wald_tests.to_excel(writer, sheet_name='组间差异检验', index=False)
+            self.groups.to_excel(writer, sheet_name='城市分组')
+        print(f'[OK] 异质性分析结果已保存: {output_file}')
+
+
+def main():
+    """
+    主函数: 异质性分析
+    """
+    print('[OK] === 异质性分析 ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    engine = HeterogeneityEngine(df)
+    results = engine.run()
+    print('\n[INFO] 异质性结果:')
+    print(results[['分组维度', '子样本', '模型', 'DID系数', '标准误', 'p值', '观测数']]
+          .to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+    engine.save()
+    engine.plot_forest()
+    return engine
+
+
+if __name__ == '__main__':
+    engine = main()
@@ -0,0 +1,660 @@
+"""
+允许不可观测因子结构的反事实估计量: 交互固定效应 (IFE) 与核范数矩阵补全 (MC)
+
+事件研究中政策前系数的联合检验只是勉强支持平行趋势, 因此在 城市 × 年份 结果矩阵上
+直接估计未受处理的潜在结果 Y(0), 允许共同冲击对不同城市有不同影响:
+
+    Y_it(0) = X_it'β + α_i + ξ_t + L_it + ε_it
+    IFE (Bai 2009; Xu 2017 gsynth):   L_it = λ_i'F_t, 因子个数 r
+    MC  (Athey et al. 2021):          罚函数 λ·||L||_* (核范数)
+
+处理观测 (did = 1) 的效应为 Y_it - Ŷ_it(0), ATT 为全部处理观测的平均,
+并按事件时间、试点批次汇总; 处理城市政策前观测的拟合残差用作平行趋势诊断。
+
+- IFE: 从未试点城市上估计 β、ξ_t 与因子 F (Bai 迭代), 处理城市的 α_i、λ_i 由其政策前
+  观测 OLS 得到。政策前期数少于 min_pre (默认5, 同 fect 的 min.T0) 的处理城市不进入
+  IFE (2010 年批次只有 2007-2009 三年, 因子载荷无法识别); 因子个数用政策前
+  留一期交叉验证选择 (帽子矩阵闭式解, 不需重估)
+- MC: 全部未处理观测上的 soft-impute (EM), 覆盖全部批次; 惩罚用 K 折交叉验证选择
+  (小 λ 一端 MSPE 平坦, 取 MSPE 在最小值 1% 以内的最大 λ, 避免近似无惩罚的病态解)
+
+计算方式:
+- EM 每步: 缺失/处理单元格用当前拟合值填补 → 双向均值得 α, ξ →
+  双向去均值矩阵的截断 SVD 或奇异值软阈值得 L → β = (X̃'X̃)^{-1} X̃'(Y - L)
+  (X̃ 为未处理样本上双向去均值的控制变量, 只计算一次); Nesterov 外推并在目标函数上升时重启
+- 结果矩阵只有 17 列, 精确薄 SVD 比随机化 SVD 的草图更省, 每步直接计算;
+  迭代次数靠热启动压缩: MC 沿 λ 递减路径逐个热启动, bootstrap 从全样本解出发
+- 交叉验证 (IFE 每个 r、MC 每一折各为一个任务) 与 bootstrap 在进程池中并行
+
+Created: 2026-10-19
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from panel_regression import TwoWayDemeaner
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+CONTROL_VARS = ['ln_pgdp', 'ln_pop_density', 'tertiary_share', 'ln_fdi', 'ln_road_area']
+
+METHOD_LABELS = {'ife': '交互固定效应', 'mc': '矩阵补全'}
+
+ROW_KEYS = ('Y', 'X', 'observed', 'treated', 'event_time', 'cohort')
+
+
+def panel_arrays(df, y_var='ln_carbon_intensity', controls=None, treatment='did',
+                 entity_var='city_name', time_var='year', cohort_var='pilot_year'):
+    """
+    长面板 → 城市 × 年份 矩阵
+
+    Returns:
+    --------
+    dict : Y (N, T), X (N, T, p), observed (未处理且完整), treated (处理且完整),
+           event_time (N, T), cohort (N,), cities, years, controls
+    """
+    controls = CONTROL_VARS if controls is None else list(controls)
+    wide = df.set_index([entity_var, time_var])[[y_var, treatment, cohort_var] + controls]
+    wide = wide.unstack(time_var)
+    years = wide[y_var].columns.to_numpy()
+    Y = wide[y_var].to_numpy(dtype=np.float64)
+    D = wide[treatment].to_numpy(dtype=np.float64)
+    X = np.stack([wide[c].to_numpy(dtype=np.float64) for c in controls], axis=2)
+    complete = ~np.isnan(Y) & ~np.isnan(X).any(axis=2) & ~np.isnan(D)
+
+    # 没有任何未处理完整观测的城市无法估计 α_i
+    keep = (complete & (D == 0)).any(axis=1)
+    cohort = wide[cohort_var].max(axis=1).to_numpy()[keep]
+    Y, D, X, complete = Y[keep], D[keep], X[keep], complete[keep]
+    return {
+        'Y': np.where(complete, Y, 0.0),
+        'X': np.where(complete[:, :, None], X, 0.0),
+        'observed': complete & (D == 0),
+        'treated': complete & (D == 1),
+        'event_time': years[None, :] - np.nan_to_num(cohort, nan=np.inf)[:, None],
+        'cohort': cohort,
+        'cities': wide.index[keep],
+        'years': years,
+        'controls': controls,
+    }
+
+
+def subset_rows(arrays, idx):
+    """按城市行取子样本 (bootstrap 重抽样时行可重复)"""
+    out = dict(arrays)
+    out.update({key: arrays[key][idx] for key in ROW_KEYS})
+    out['cities'] = arrays['cities'][idx]
+    return out
+
+
+def _low_rank(M, method, param):
+    """
+    双向去均值矩阵的截断 SVD (IFE, param = r) 或奇异值软阈值 (MC, param = λ)
+
+    Returns:
+    --------
+    tuple : (L, 秩, 核范数罚项 λ·||L||_*)
+    """
+    if method == 'ife' and param == 0:
+        return np.zeros_like(M), 0, 0.0
+    U, s, Vt = np.linalg.svd(M, full_matrices=False)
+    if method == 'ife':
+        s = s[:param]
+        U, Vt = U[:, :param], Vt[:param]
+        penalty = 0.0
+    else:
+        s = np.maximum(s - param, 0.0)
+        penalty = param * s.sum()
+    rank = int((s > 0).sum())
+    return (U[:, :rank] * s[:rank]) @ Vt[:rank], rank, penalty
+
+
+class ObservedDesign:
+    """
+    未处理样本 (observed 单元格) 上的双向固定效应 + 控制变量设计, 只构建一次
+
+    - projector: (X̃'X̃)^{-1} X̃', X̃ 为双向去均值后的控制变量 (给定 L 时 β 的 FWL 解)
+    - effects: 指示矩阵的伪逆, 由 observed 单元格上的固定效应拟合值求出 α_i、ξ_t
+    - residualize: 把单元格向量对 双向固定效应 + X 做回归取残差, 用于构造对偶可行点
+    """
+
+    def __init__(self, X, observed):
+        self.rows, self.cols = np.nonzero(observed)
+        self.demeaner = TwoWayDemeaner(self.rows, self.cols)
+        if X.shape[2] == 0:
+            self.Xt = np.zeros((len(self.rows), 0))
+            self.projector = np.zeros((0, len(self.rows)))
+        else:
+            self.Xt = self.demeaner.demean(X[self.rows, self.cols])
+            self.projector = np.linalg.solve(self.Xt.T @ self.Xt, self.Xt.T)
+        N, T = observed.shape
+        indicator = np.zeros((len(self.rows), N + T))
+        indicator[np.arange(len(self.rows)), self.rows] = 1.0
+        indicator[np.arange(len(self.rows)), N + self.cols] = 1.0
+        self.effects = np.linalg.pinv(indicator)
+        self.shape = (N, T)
+
+    def additive(self, values):
+        """observed 单元格上对双向固定效应回归, 返回全部单元格的 α_i + ξ_t"""
+        coef = self.effects @ values
+        N = self.shape[0]
+        return coef[:N, None] + coef[None, N:]
+
+    def residualize(self, values):
+        """observed 单元格上的向量对双向固定效应与控制变量的回归残差 (FWL)"""
+        demeaned = self.demeaner.demean(values)
+        return demeaned - self.Xt @ (self.projector @ demeaned)
+
+
+def beta_projector(X, observed):
+    """
+    未处理样本上的 (X̃'X̃)^{-1} X̃', X̃ 为双向去均值后的控制变量 (只计算一次)
+
+    Returns:
+    --------
+    np.ndarray : (p, n_obs)
+    """
+    return ObservedDesign(X, observed).projector
+
+
+def duality_gap(design, y_obs, resid, penalty, param, shape):
+    """
+    核范数问题的相对对偶间隙
+
+    原问题 P = ½||P_Ω(Y - Xβ - α - ξ - L)||² + λ||L||_*; 对偶问题
+    D(W) = <W, P_Ω Y> - ½||W||², W 支撑在 Ω 上、与固定效应和 X 正交且 ||W||_op ≤ λ。
+    W 取当前残差正交化后按算子范数缩放, (P - D) / P 给出到最优值的相对距离上界,
+    与单步变化量不同, 不会因热启动时每步移动很小而提前停止。
+    """
+    primal = 0.5 * resid @ resid + penalty
+    w = design.residualize(resid)
+    W = np.zeros(shape)
+    W[design.rows, design.cols] = w
+    op_norm = np.linalg.norm(W, 2)
+    if op_norm > param:
+        w = w * (param / op_norm)
+    dual = w @ y_obs - 0.5 * w @ w
+    return (primal - dual) / max(primal, np.finfo(float).tiny)
+
+
+def fit_factor_model(Y, X, observed, method, param, projector=None, init=None,
+                     tol=1e-6, max_iter=5000, check_every=10, design=None):
+    """
+    EM 交替估计 Y = Xβ + α_i + ξ_t + L (只用 observed 单元格)
+
+    Parameters:
+    -----------
+    Y, X, observed : np.ndarray
+        见 panel_arrays
+    method : str
+        'ife' (秩约束) 或 'mc' (核范数惩罚)
+    param : int or float
+        因子个数 r 或核范数惩罚 λ
+    projector : np.ndarray, optional
+        beta_projector(X, observed), 重复调用时传入 (未传 design 时使用)
+    init : dict, optional
+        热启动 (上一次估计的 fit 与 L)
+    tol : float
+        MC: 相对对偶间隙; IFE: check_every 步内目标函数的相对下降
+    check_every : int
+        每隔多少步检查一次收敛
+    design : ObservedDesign, optional
+        ObservedDesign(X, observed), 重复调用时传入
+
+    Returns:
+    --------
+    dict : beta, fit (α_i + ξ_t + L), L, rank, n_iter, converged, gap (MC 的相对对偶间隙)
+    """
+    if design is None:
+        design = ObservedDesign(X, observed)
+    if projector is None:
+        projector = design.projector
+    rows, cols = np.nonzero(observed)
+    y_obs = Y[rows, cols]
+    X_obs = X[rows, cols]
+
+    if init is None:
+        L = np.zeros_like(Y)
+        fit = np.broadcast_to(np.nanmean(np.where(observed, Y, np.nan), axis=0), Y.shape).copy()
+    else:
+        L, fit = init['L'].copy(), init['fit'].copy()
+    beta = projector @ (y_obs - L[rows, cols])
+
+    def residual(fit, beta):
+        return y_obs - X_obs @ beta - fit[rows, cols]
+
+    # EM 步加 Nesterov 外推 (加速的 soft-impute), 两种情况重启 (动量清零):
+    # 1. 目标函数上升 (放弃该步);
+    # 2. 全部单元格 (含填补的单元格) 上新一步与外推方向相反 <Z_k - fit_new, fit_new - fit> > 0
+    #    (O'Donoghue-Candès 梯度重启): 目标函数只含 observed 单元格, 仅按目标函数重启时
+    #    填补的单元格可以沿动量方向漂移, 小 λ 时留出样本 MSPE 因此发散
+    resid = residual(fit, beta)
+    obj, penalty, fit_prev, k = np.inf, 0.0, fit, 1
+    obj_checked = np.inf
+    rank, n_iter, converged, gap = 0, 0, False, np.nan
+    for n_iter in range(1, max_iter + 1):
+        momentum = (k - 1) / (k + 2)
+        extrapolated = fit + momentum * (fit - fit_prev)
+        Z = extrapolated.copy()
+        Z[rows, cols] = y_obs - X_obs @ beta
+        additive = Z.mean(axis=1, keepdims=True) + Z.mean(axis=0, keepdims=True) - Z.mean()
+        L_new, rank_new, penalty_new = _low_rank(Z - additive, method, param)
+        fit_new = additive + L_new
+        # 给定 L 时 (β, α_i, ξ_t) 在 observed 单元格上的精确最小二乘解 (FWL), 与上面的
+        # EM 步构成块坐标下降, 目标函数单调下降; 固定效应必须随 β 一起更新, 否则两者不一致
+        partial_y = y_obs - L_new[rows, cols]
+        beta_new = projector @ partial_y
+        fit_new = design.additive(partial_y - X_obs @ beta_new) + L_new
+        resid_new = residual(fit_new, beta_new)
+        obj_new = 0.5 * resid_new @ resid_new + penalty_new
+        if k > 1 and obj_new > obj:
+            fit_prev, k = fit, 1
+            continue
+        if k > 1 and np.vdot(extrapolated - fit_new, fit_new - fit) > 0:
+            k = 0
+        fit_prev, fit, L, beta, rank = fit, fit_new, L_new, beta_new, rank_new
+        obj, penalty, resid = obj_new, penalty_new, resid_new
+        k += 1
+        if n_iter % check_every:
+            continue
+        if method == 'mc':
+            gap = duality_gap(design, y_obs, resid, penalty, param, Y.shape)
+            converged = gap < tol
+        else:
+            converged = obj_checked - obj <= tol * obj
+            obj_checked = obj
+        if converged:
+            break
+    return {'beta': beta, 'fit': fit, 'L': L, 'rank': rank, 'n_iter': n_iter,
+            'converged': converged, 'gap': gap}
+
+
+def fit_gsynth(arrays, rank, init=None):
+    """
+    两步 IFE: 从未试点城市估计 β、ξ_t、F, 处理城市的 α_i、λ_i 由政策前观测 OLS 得到
+
+    Parameters:
+    -----------
+    arrays : dict
+        panel_arrays 的结果 (处理城市须已满足最少政策前期数)
+    rank : int
+        因子个数
+    init : dict, optional
+        热启动 (全样本各行的 fit 与 L)
+
+    Returns:
+    --------
+    dict : beta, fit, L, rank, n_iter, converged, loo (处理城市政策前观测的留一期预测误差)
+    """
+    Y, X, observed, treated = (arrays[key] for key in ('Y', 'X', 'observed', 'treated'))
+    control = ~treated.any(axis=1)
+    base = fit_factor_model(Y[control], X[control], observed[control], 'ife', rank,
+                            init=None if init is None else
+                            {'fit': init['fit'][control], 'L': init['L'][control]})
+    xi = (base['fit'] - base['L']).mean(axis=0)
+    F = np.linalg.svd(base['L'], full_matrices=False)[2][:rank].T
+    design = np.column_stack([np.ones(len(xi)), F])
+
+    fit, L = np.empty_like(Y), np.zeros_like(Y)
+    fit[control], L[control] = base['fit'], base['L']
+    loo = []
+    for i in np.flatnonzero(~control):
+        pre = observed[i]
+        u = Y[i] - X[i] @ base['beta'] - xi
+        Z = design[pre]
+        Z_pinv = np.linalg.pinv(Z)
+        coef = Z_pinv @ u[pre]
+        hat = np.einsum('ij,ji->i', Z, Z_pinv)
+        loo.append((u[pre] - Z @ coef) / (1 - hat))
+        L[i] = F @ coef[1:]
+        fit[i] = xi + coef[0] + L[i]
+    return {'beta': base['beta'], 'fit': fit, 'L': L, 'rank': rank, 'n_iter': base['n_iter'],
+            'converged': base['converged'], 'loo': np.concatenate(loo) if loo else np.array([])}
+
+
+def estimate(arrays, method, param, projector=None, init=None):
+    """按方法分派: IFE → fit_gsynth, MC → fit_factor_model"""
+    if method == 'ife':
+        return fit_gsynth(arrays, param, init=init)
+    return fit_factor_model(arrays['Y'], arrays['X'], arrays['observed'], 'mc', param,
+                            projector=projector, init=init)
+
+
+def event_cells(treated, observed, event_time):
+    """处理城市的全部完整观测: 政策前为拟合残差 (诊断), 政策后为处理效应"""
+    return treated.any(axis=1, keepdims=True) & (treated | (observed & (event_time < 0)))
+
+
+def treatment_effects(arrays, model, event_grid, cohorts):
+    """
+    处理单元格的 Y - Ŷ(0) 及其汇总
+
+    Returns:
+    --------
+    dict : att, event (len(event_grid),), cohort (len(cohorts),), 无观测处为 NaN
+    """
+    Y, X, observed, treated, event_time, cohort = (arrays[key] for key in ROW_KEYS)
+    resid = Y - X @ model['beta'] - model['fit']
+    usable = event_cells(treated, observed, event_time)
+
+    def cell_mean(cells):
+        return resid[cells].mean() if cells.any() else np.nan
+
+    return {
+        'att': cell_mean(treated),
+        'event': np.array([cell_mean(usable & (event_time == e)) for e in event_grid]),
+        'cohort': np.array([cell_mean(treated & (cohort == g)[:, None]) for g in cohorts]),
+    }
+
+
+def _cv_task(task):
+    """
+    一个交叉验证任务
+
+    ('ife', arrays, r): 处理城市政策前留一期 MSPE
+    ('mc', arrays, holdout, λ路径): 沿惩罚路径热启动, 返回留出单元格的 MSPE
+    第四个返回值为未收敛的估计次数
+    """
+    if task[0] == 'ife':
+        _, arrays, rank = task
+        model = fit_gsynth(arrays, rank)
+        return 'ife', rank, np.mean(model['loo'] ** 2), int(not model['converged'])
+
+    _, arrays, holdout, grid = task
+    Y, X = arrays['Y'], arrays['X']
+    train = arrays['observed'] & ~holdout
+    design = ObservedDesign(X, train)
+    rows, cols = np.nonzero(holdout)
+    mspe, init, n_failed = [], None, 0
+    for param in grid:
+        model = fit_factor_model(Y, X, train, 'mc', param, init=init, design=design)
+        pred = X[rows, cols] @ model['beta'] + model['fit'][rows, cols]
+        mspe.append(np.mean((Y[rows, cols] - pred) ** 2))
+        n_failed += not model['converged']
+        init = model
+    return 'mc', None, np.array(mspe), n_failed
+
+
+def _bootstrap_task(task):
+    """
+    一批城市 bootstrap: 按重抽样城市取行, 从全样本解热启动
+    """
+    arrays, method, param, full_model, samples, event_grid, cohorts = task
+    draws = []
+    for idx in samples:
+        sample = subset_rows(arrays, idx)
+        init = {'fit': full_model['fit'][idx], 'L': full_model['L'][idx]}
+        model = estimate(sample, method, param, init=init)
+        draw = treatment_effects(sample, model, event_grid, cohorts)
+        draw['converged'] = model['converged']
+        draws.append(draw)
+    return draws
+
+
+def _run_pool(func, tasks, n_jobs):
+    if n_jobs == 1:
+        return [func(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(func, tasks))
+
+
+class CounterfactualEstimator:
+    """
+    IFE / MC 反事实估计: 交叉验证、全样本估计与城市 bootstrap 推断
+    """
+
+    def __init__(self, df, y_var='ln_carbon_intensity', controls=None, treatment='did',
+                 min_pre=5):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据
+        y_var : str
+            被解释变量
+        controls : list, optional
+            控制变量
+        min_pre : int
+            IFE 中处理城市至少需要的政策前观测数
+        """
+        self.y_var = y_var
+        a = panel_arrays(df, y_var, controls, treatment)
+        self.event_grid = np.unique(
+            a['event_time'][event_cells(a['treated'], a['observed'], a['event_time'])]).astype(int)
+        self.cohorts = np.unique(a['cohort'][~np.isnan(a['cohort'])])
+
+        n_pre = (a['observed'] & (a['event_time'] < 0)).sum(axis=1)
+        short = a['treated'].any(axis=1) & (n_pre < min_pre)
+        self.samples = {'mc': a, 'ife': subset_rows(a, np.flatnonzero(~short))}
+        self.ife_excluded = a['cities'][short]
+        self.max_rank = int(n_pre[a['treated'].any(axis=1) & ~short].min()) - 2
+        self.projector = beta_projector(a['X'], a['observed'])
+        self.cv_results = None
+        self.models = {}
+
+    @property
+    def arrays(self):
+        return self.samples['mc']
+
+    def lambda_grid(self, n_lambdas=12, ratio=1e-3):
+        """MC 惩罚路径: 从 L = 0 的最小 λ (秩0拟合残差的最大奇异值) 几何递减"""
+        a = self.arrays
+        base = fit_factor_model(a['Y'], a['X'], a['observed'], 'ife', 0, projector=self.projector)
+        Z = base['fit'].copy()
+        rows, cols = np.nonzero(a['observed'])
+        Z[rows, cols] = a['Y'][rows, cols] - a['X'][rows, cols] @ base['beta']
+        Z = Z - Z.mean(axis=1, keepdims=True) - Z.mean(axis=0, keepdims=True) + Z.mean()
+        lam_max = np.linalg.svd(Z, compute_uv=False)[0]
+        return lam_max * np.geomspace(1.0, ratio, n_lambdas)
+
+    def cross_validate(self, max_rank=5, n_lambdas=12, n_folds=5, flat_tol=0.01, n_jobs=None,
+                       seed=2026):
+        """
+        选择 IFE 的因子个数 (政策前留一期) 与 MC 的惩罚 (未处理单元格 K 折)
+
+        Parameters:
+        -----------
+        flat_tol : float
+            MC 取 MSPE 在最小值 (1 + flat_tol) 倍以内的最大 λ
+
+        Returns:
+        --------
+        pd.DataFrame : 方法 × 超参数 的 MSPE
+        """
+        a = self.arrays
+        start = time.perf_counter()
+        ranks = list(range(0, min(max_rank, self.max_rank) + 1))
+        lambdas = self.lambda_grid(n_lambdas)
+        rows, cols = np.nonzero(a['observed'])
+        folds = np.random.default_rng(seed).permutation(len(rows)) % n_folds
+        tasks = [('ife', self.samples['ife'], r) for r in ranks]
+        for k in range(n_folds):
+            holdout = np.zeros_like(a['observed'])
+            holdout[rows[folds == k], cols[folds == k]] = True
+            tasks.append(('mc', a, holdout, lambdas))
+
+        outputs = _run_pool(_cv_task, tasks, n_jobs)
+        n_failed = sum(failed for *_, failed in outputs)
+        if n_failed:
+            print(f'[WARNING] 交叉验证中 {n_failed} 次估计未收敛 (达到 max_iter)')
+        fold_mspe = np.array([m for method, _, m, _ in outputs if method == 'mc'])
+        mspe = {'ife': np.array([m for method, _, m, _ in outputs if method == 'ife']),
+                'mc': fold_mspe.mean(axis=0)}
+        mc_se = fold_mspe.std(axis=0, ddof=1) / np.sqrt(n_folds)
+        # MC 的 MSPE 在小 λ 一端很平坦: 取 MSPE 不超过最小值 (1 + flat_tol) 倍的最大 λ
+        best_mc = int(np.argmax(mspe['mc'] <= mspe['mc'].min() * (1 + flat_tol)))
+        self.best = {'ife': ranks[int(np.argmin(mspe['ife']))], 'mc': lambdas[best_mc]}
+        self.cv_results = pd.DataFrame(
+            [{'方法': METHOD_LABELS['ife'], '超参数': r, 'MSPE': v, '标准误': np.nan,
+              '选中': r == self.best['ife']} for r, v in zip(ranks, mspe['ife'])]
+            + [{'方法': METHOD_LABELS['mc'], '超参数': lam, 'MSPE': v, '标准误': se,
+                '选中': k == best_mc}
+               for k, (lam, v, se) in enumerate(zip(lambdas, mspe['mc'], mc_se))])
+        print(f"[OK] 交叉验证完成 (耗时 {time.perf_counter() - start:.1f}s): "
+              f"IFE 因子数 r = {self.best['ife']}, MC λ = {self.best['mc']:.4f}")
+        return self.cv_results
+
+    def fit(self, method, param=None):
+        """
+        全样本估计 (param 缺省时使用交叉验证结果)
+
+        Returns:
+        --------
+        dict : 模型与点估计
+        """
+        if param is None:
+            param = self.best[method]
+        sample = self.samples[method]
+        model = estimate(sample, method, param, projector=self.projector)
+        if not model['converged']:
+            print(f"[WARNING] {METHOD_LABELS[method]} 全样本估计未收敛 "
+                  f"(迭代 {model['n_iter']} 次)")
+        model['param'] = param
+        model['effects'] = treatment_effects(sample, model, self.event_grid, self.cohorts)
+        self.models[method] = model
+        return model
+
+    def bootstrap(self, method, n_boot=200, n_jobs=None, chunk_size=25, seed=2026):
+        """
+        城市层面非参数 bootstrap (重抽样城市, 超参数固定为全样本选择)
+
+        Returns:
+        --------
+        dict : att (n_boot,), event (n_boot, E), cohort (n_boot, G)
+        """
+        sample, model = self.samples[method], self.models[method]
+        start = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        N = len(sample['cities'])
+        ever = sample['treated'].any(axis=1)
+        draws_idx = rng.integers(0, N, size=(n_boot, N))
+        # 重抽样中必须同时有处理城市与从未试点城市
+        while True:
+            bad = ever[draws_idx].all(axis=1) | ~ever[draws_idx].any(axis=1)
+            if not bad.any():
+                break
+            draws_idx[bad] = rng.integers(0, N, size=(bad.sum(), N))
+        light = {'fit': model['fit'], 'L': model['L']}
+        tasks = [(sample, method, model['param'], light, draws_idx[s:s + chunk_size],
+                  self.event_grid, self.cohorts) for s in range(0, n_boot, chunk_size)]
+        draws = [d for chunk in _run_pool(_bootstrap_task, tasks, n_jobs) for d in chunk]
+        n_failed = sum(not d['converged'] for d in draws)
+        if n_failed:
+            print(f'[WARNING] {METHOD_LABELS[method]} bootstrap 中 {n_failed}/{n_boot} 次'
+                  f'估计未收敛 (达到 max_iter)')
+        model['boot'] = {key: np.array([d[key] for d in draws]) for key in ('att', 'event', 'cohort')}
+        print(f'[OK] {METHOD_LABELS[method]} bootstrap 完成: {n_boot} 次, '
+              f'耗时 {time.perf_counter() - start:.1f}s')
+        return model['boot']
+
+    @staticmethod
+    def _row(label, estimate, draws, alpha=0.05):
+        draws = draws[np.isfinite(draws)]
+        se = draws.std(ddof=1)
+        return {'项目': label, '估计值': estimate, '标准误': se,
+                'CI下限': np.percentile(draws, 100 * alpha / 2),
+                'CI上限': np.percentile(draws, 100 * (1 - alpha / 2)),
+                'p值': 2 * (1 - stats.norm.cdf(abs(estimate / se)))}
+
+    def summary(self, method):
+        """ATT、分批次与动态效应表 (没有观测的批次/事件时间不列出)"""
+        model = self.models[method]
+        eff, boot = model['effects'], model['boot']
+        rows = [self._row('总体ATT', eff['att'], boot['att'])]
+        rows += [self._row(f'批次{int(g)}', eff['cohort'][k], boot['cohort'][:, k])
+                 for k, g in enumerate(self.cohorts) if np.isfinite(eff['cohort'][k])]
+        rows += [self._row(f'事件时间{e:+d}', eff['event'][k], boot['event'][:, k])
+                 for k, e in enumerate(self.event_grid) if np.isfinite(eff['event'][k])]
+        table = pd.DataFrame(rows)
+        table.insert(0, '方法', METHOD_LABELS[method])
+        return table
+
+    def run(self, n_boot=200, n_jobs=None, **cv_kwargs):
+        """交叉验证 → 两种估计量的全样本估计与 bootstrap"""
+        self.cross_validate(n_jobs=n_jobs, **cv_kwargs)
+        for method in ('ife', 'mc'):
+            model = self.fit(method)
+            print(f"[INFO] {METHOD_LABELS[method]}: 秩 {model['rank']}, "
+                  f"迭代 {model['n_iter']} 次, ATT = {model['effects']['att']:.4f}")
+            self.bootstrap(method, n_boot=n_boot, n_jobs=n_jobs)
+        return pd.concat([self.summary(m) for m in ('ife', 'mc')], ignore_index=True)
+
+    def plot_dynamic(self, output_file='反事实估计_动态效应.png', window=(-6, 10)):
+        """两种估计量的事件时间效应 (政策前为拟合残差) 与 95% bootstrap 区间"""
+        keep = (self.event_grid >= window[0]) & (self.event_grid <= window[1])
+        fig, axes = plt.subplots(1, 2, figsize=(16, 6), sharey=True)
+        for ax, method in zip(axes, ('ife', 'mc')):
+            model = self.models[method]
+            est = model['effects']['event'][keep]
+            draws = model['boot']['event'][:, keep]
+            lower = np.nanpercentile(draws, 2.5, axis=0)
+            upper = np.nanpercentile(draws, 97.5, axis=0)
+            e = self.event_grid[keep]
+            ax.fill_between(e, lower, upper, color='steelblue', alpha=0.25, label='95%置信区间')
+            ax.plot(e, est, 'o-', color='steelblue', linewidth=1.5)
+            ax.axhline(y=0, color='black', linestyle='--', linewidth=1.2)
+            ax.axvline(x=-0.5, color='red', linestyle='--', linewidth=1.5, label='政策实施')
+            label = f"r = {model['param']}" if method == 'ife' else f"λ = {model['param']:.3f}"
+            ax.set_title(f'{METHOD_LABELS[method]} ({label})', fontsize=14, fontweight='bold')
+            ax.set_xlabel('相对年份（年）', fontsize=12)
+            ax.grid(True, alpha=0.3, linestyle=':')
+            ax.legend(loc='upper left', fontsize=10)
+        axes[0].set_ylabel('实际值 - 反事实 (对数)', fontsize=12)
+        plt.tight_layout()
+        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.close()
+        print(f'[OK] 动态效应图已保存: {output_file}')
+
+    def save(self, results, output_file='交互固定效应与矩阵补全结果.xlsx'):
+        """保存 ATT 汇总、交叉验证、控制变量系数与模型设定"""
+        beta = pd.DataFrame({'变量': self.arrays['controls']})
+        for method, model in self.models.items():
+            beta[METHOD_LABELS[method]] = model['beta']
+        info = pd.DataFrame({
+            '项目': ['被解释变量', '控制变量', 'IFE 因子数', 'MC 惩罚 λ', 'IFE 剔除的处理城市'],
+            '内容': [self.y_var, ', '.join(self.arrays['controls']),
+                   self.models['ife']['param'], self.models['mc']['param'],
+                   ', '.join(self.ife_excluded)],
+        })
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            results.to_excel(writer, sheet_name='ATT汇总', index=False)
+            self.cv_results.to_excel(writer, sheet_name='交叉验证', index=False)
+            beta.to_excel(writer, sheet_name='控制变量系数', index=False)
+            info.to_excel(writer, sheet_name='模型设定', index=False)
+        print(f'[OK] 反事实估计结果已保存: {output_file}')
+
+
+def main(n_boot=200, n_jobs=None):
+    """
+    主函数: 交互固定效应与矩阵补全
+    """
+    print('[OK] === 交互固定效应 / 矩阵补全反事实估计 ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    estimator = CounterfactualEstimator(df)
+    a = estimator.arrays
+    print(f"[INFO] 城市 {len(a['cities'])}, 未处理观测 {a['observed'].sum()}, "
+          f"处理观测 {a['treated'].sum()}")
+    if len(estimator.ife_excluded):
+        print(f'[WARNING] {len(estimator.ife_excluded)} 个处理城市政策前观测不足, '
+              f'不进入交互固定效应估计 (矩阵补全保留)')
+    results = estimator.run(n_boot=n_boot, n_jobs=n_jobs)
+    print('\n[INFO] ATT 估计:')
+    print(results[~results['项目'].str.startswith('事件时间')]
+          .to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+    estimator.save(results)
+    estimator.plot_dynamic()
+    return estimator
+
+
+if __name__ == '__main__':
+    estimator = main()
@@ -0,0 +1,280 @@
+"""
+中介效应分析: 低碳试点 → 产业结构 → 碳排放强度
+
+三步法 (城市+年份固定效应, 城市聚类标准误):
+    (1) Y = c·did  + Xγ + μ_i + λ_t + ε        总效应 c
+    (2) M = a·did  + Xγ + μ_i + λ_t + ε        政策对中介变量的效应 a
+    (3) Y = c'·did + b·M + Xγ + μ_i + λ_t + ε  直接效应 c'、中介变量效应 b
+间接效应 = a·b, 中介比例 = a·b / c。
+
+候选中介变量: industrial_advanced (第三产业/第二产业产值)、secondary_share、tertiary_share。
+数据集中没有 secondary_share 时从原始产业结构数据提取 (同 add_real_secondary_share.py),
+原始数据不可用时取 1 - tertiary_share (同 add_secondary_share.py); 中介变量不进入控制变量。
+
+计算方式:
+- 全部中介变量使用同一样本, Y、did 与各中介变量只做一次双向去均值并对控制变量
+  做一次投影 (FWL), 之后三步回归都只是 2×2 以内的求解
+- 城市聚类 bootstrap: 每个城市的交叉乘积矩阵 S_g = V_g'V_g 预先计算,
+  一批 B 次重抽样的全部统计量由 (B × G) 权重矩阵与 (G × q²) 矩阵的一次乘积得到,
+  所有中介变量同时计算。重抽样在偏出固定效应与控制变量后的数据上进行。
+
+Created: 2026-10-19
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from panel_regression import TwoWayDemeaner, cluster_meat
+
+MEDIATORS = ['industrial_advanced', 'secondary_share', 'tertiary_share']
+CONTROL_VARS = ['ln_pgdp', 'ln_pop_density', 'ln_fdi', 'ln_road_area']
+
+# 原始产业结构数据 (第二产业占GDP比重, 同 add_real_secondary_share.py)
+INDUSTRY_SOURCE = '原始数据/2000-2023地级市产业结构 .xlsx'
+
+MEDIATOR_LABELS = {
+    'industrial_advanced': '产业结构高级化',
+    'secondary_share': '第二产业比重',
+    'tertiary_share': '第三产业比重',
+}
+
+
+def add_secondary_share(df, source=INDUSTRY_SOURCE):
+    """
+    补充第二产业比重 (已有该列时不变), 口径与仓库现有脚本一致:
+
+    - 原始产业结构数据存在时按 add_real_secondary_share.py 提取 "第二产业占GDP比重"
+      (按 年份 + 城市代码 合并, 百分比转为比例, 不在 [0, 1] 内的取值置为缺失)
+    - 否则按 add_secondary_share.py 取 1 - tertiary_share
+
+    industrial_advanced 来自另一张原始表, tertiary_share / industrial_advanced 会得到大于 1
+    的比重, 不再使用。
+    """
+    if 'secondary_share' in df.columns:
+        return df
+    df = df.copy()
+    if os.path.exists(source) and 'city_code' in df.columns:
+        industry = pd.read_excel(source, sheet_name=1).iloc[:, [0, 2, 10]]
+        industry.columns = ['year', 'city_code', 'secondary_share']
+        industry = industry.apply(pd.to_numeric, errors='coerce') \
+            .dropna().drop_duplicates(['year', 'city_code'])
+        if industry['secondary_share'].max() > 1:
+            industry['secondary_share'] /= 100
+        df = df.merge(industry, on=['year', 'city_code'], how='left')
+        invalid = ~df['secondary_share'].between(0, 1) & df['secondary_share'].notna()
+        if invalid.any():
+            print(f'[WARNING] {int(invalid.sum())} 个第二产业比重不在 [0, 1] 内, 置为缺失')
+            df.loc[invalid, 'secondary_share'] = np.nan
+        print(f'[INFO] secondary_share 取自 {source}')
+    elif 'tertiary_share' in df.columns:
+        df['secondary_share'] = 1 - df['tertiary_share']
+        print('[INFO] secondary_share 按 1 - tertiary_share 计算 (与 tertiary_share 完全共线, '
+              '其中介结果为 tertiary_share 的镜像)')
+    return df
+
+
+class MediationAnalysis:
+    """
+    面板固定效应中介效应 (多个候选中介变量共用一次固定效应投影)
+    """
+
+    def __init__(self, df, y_var='ln_carbon_intensity', treatment='did', mediators=None,
+                 controls=None, entity_var='city_name', time_var='year'):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据
+        y_var : str
+            被解释变量
+        treatment : str
+            政策变量
+        mediators : list, optional
+            候选中介变量
+        controls : list, optional
+            控制变量 (自动剔除与中介变量重复者)
+        """
+        df = add_secondary_share(df)
+        self.y_var = y_var
+        self.treatment = treatment
+        self.mediators = [m for m in (MEDIATORS if mediators is None else mediators)
+                          if m in df.columns]
+        self.controls = [c for c in (CONTROL_VARS if controls is None else controls)
+                         if c not in self.mediators]
+
+        columns = [y_var, treatment] + self.mediators + self.controls
+        self.sample = df.dropna(subset=columns).reset_index(drop=True)
+        self.clusters = pd.Categorical(self.sample[entity_var]).codes
+        demeaner = TwoWayDemeaner(self.clusters, pd.Categorical(self.sample[time_var]).codes)
+
+        # 一次去均值 + 一次控制变量投影
+        V = demeaner.demean(self.sample[[treatment, y_var] + self.mediators]
+                            .to_numpy(dtype=np.float64))
+        C = demeaner.demean(self.sample[self.controls].to_numpy(dtype=np.float64))
+        if C.shape[1]:
+            V = V - C @ np.linalg.lstsq(C, V, rcond=None)[0]
+        self.V = V
+        self.n = len(V)
+        self.k_absorbed = demeaner.n_fe + len(self.controls)
+
+        # 每个城市的交叉乘积 S_g = V_g'V_g
+        q = V.shape[1]
+        outer = (V[:, :, None] * V[:, None, :]).reshape(self.n, q * q)
+        S = np.zeros((self.clusters.max() + 1, q * q))
+        np.add.at(S, self.clusters, outer)
+        self.S_city = S
+        self.results = None
+
+    @staticmethod
+    def _paths(S):
+        """
+        由交叉乘积矩阵计算各路径系数
+
+        Parameters:
+        -----------
+        S : np.ndarray
+            (..., q, q), 变量顺序 [did, Y, M_1, ..., M_m]
+
+        Returns:
+        --------
+        dict : a, b, c, c' (各为 (..., m), c 为 (...,))
+        """
+        s_dd, s_dy = S[..., 0, 0], S[..., 0, 1]
+        s_dm = S[..., 0, 2:]
+        s_my = S[..., 1, 2:]
+        s_mm = np.diagonal(S[..., 2:, 2:], axis1=-2, axis2=-1)
+        det = s_dd[..., None] * s_mm - s_dm ** 2
+        return {
+            'a': s_dm / s_dd[..., None],
+            'b': (s_dd[..., None] * s_my - s_dm * s_dy[..., None]) / det,
+            'c': s_dy / s_dd,
+            'c_direct': (s_mm * s_dy[..., None] - s_dm * s_my) / det,
+        }
+
+    def _cluster_se(self, X, y):
+        """偏出后数据上的 OLS 聚类标准误 (校正因子计入被吸收的固定效应与控制变量, t 检验自由度 G - 1)"""
+        XtX_inv = np.linalg.inv(X.T @ X)
+        beta = XtX_inv @ (X.T @ y)
+        resid = y - X @ beta
+        meat, G = cluster_meat(X * resid[:, None], self.clusters)
+        k = X.shape[1] + self.k_absorbed
+        vcov = (G / (G - 1)) * ((self.n - 1) / (self.n - k)) * XtX_inv @ meat @ XtX_inv
+        return beta, np.sqrt(np.diag(vcov)), G - 1
+
+    def bootstrap(self, n_boot=5000, batch_size=1000, seed=2026):
+        """
+        城市聚类 bootstrap (分批向量化)
+
+        Returns:
+        --------
+        dict : 各路径系数的 bootstrap 抽样, 形状 (n_boot, m)
+        """
+        rng = np.random.default_rng(seed)
+        G, q = self.S_city.shape[0], self.V.shape[1]
+        draws = {key: [] for key in ('a', 'b', 'c', 'c_direct', 'indirect')}
+        for start in range(0, n_boot, batch_size):
+            B = min(batch_size, n_boot - start)
+            weights = rng.multinomial(G, np.full(G, 1.0 / G), size=B).astype(np.float64)
+            paths = self._paths((weights @ self.S_city).reshape(B, q, q))
+            paths['indirect'] = paths['a'] * paths['b']
+            for key in draws:
+                draws[key].append(paths[key])
+        return {key: np.concatenate(value) for key, value in draws.items()}
+
+    def run(self, n_boot=5000, seed=2026, alpha=0.05):
+        """
+        全部候选中介变量的三步法回归、Sobel 检验与 bootstrap 间接效应
+
+        Returns:
+        --------
+        pd.DataFrame : 每个中介变量一行
+        """
+        d, y = self.V[:, 0], self.V[:, 1]
+        (c,), (se_c,), dof_c = self._cluster_se(d[:, None], y)
+        boot = self.bootstrap(n_boot=n_boot, seed=seed)
+        lower, upper = 100 * alpha / 2, 100 * (1 - alpha / 2)
+
+        rows = []
+        for j, mediator in enumerate(self.mediators):
+            m = self.V[:, 2 + j]
+            (a,), (se_a,), dof_a = self._cluster_se(d[:, None], m)
+            (c_direct, b), (se_cd, se_b), dof_b = self._cluster_se(np.column_stack([d, m]), y)
+            indirect = a * b
+            sobel_se = np.sqrt(a ** 2 * se_b ** 2 + b ** 2 * se_a ** 2)
+            draws = boot['indirect'][:, j]
+            rows.append({
+                '中介变量': mediator,
+                '含义': MEDIATOR_LABELS.get(mediator, mediator),
+                '总效应c': c, 'c_标准误': se_c,
+                'c_p值': 2 * (1 - stats.t.cdf(abs(c / se_c), dof_c)),
+                '路径a': a, 'a_标准误': se_a,
+                'a_p值': 2 * (1 - stats.t.cdf(abs(a / se_a), dof_a)),
+                '路径b': b, 'b_标准误': se_b,
+                'b_p值': 2 * (1 - stats.t.cdf(abs(b / se_b), dof_b)),
+                '直接效应c\'': c_direct, "c'_标准误": se_cd,
+                "c'_p值": 2 * (1 - stats.t.cdf(abs(c_direct / se_cd), dof_b)),
+                '间接效应ab': indirect,
+                'Sobel_z': indirect / sobel_se,
+                'Sobel_p值': 2 * (1 - stats.norm.cdf(abs(indirect / sobel_se))),
+                'Bootstrap标准误': draws.std(ddof=1),
+                'Bootstrap_CI下限': np.percentile(draws, lower),
+                'Bootstrap_CI上限': np.percentile(draws, upper),
+                'Bootstrap_p值': min(1.0, 2 * min(np.mean(draws <= 0), np.mean(draws >= 0))),
+                '中介比例': indirect / c if c != 0 else np.nan,
+            })
+        self.results = pd.DataFrame(rows)
+        self.n_boot = n_boot
+        return self.results
+
+    def save(self, output_file='中介效应检验结果.xlsx'):
+        """保存中介效应汇总与三步法系数"""
+        res = self.results
+        steps = []
+        for _, row in res.iterrows():
+            steps.extend([
+                {'中介变量': row['中介变量'], '步骤': '(1) Y ~ did', '变量': 'did',
+                 '系数': row['总效应c'], '标准误': row['c_标准误'], 'p值': row['c_p值']},
+                {'中介变量': row['中介变量'], '步骤': '(2) M ~ did', '变量': 'did',
+                 '系数': row['路径a'], '标准误': row['a_标准误'], 'p值': row['a_p值']},
+                {'中介变量': row['中介变量'], '步骤': '(3) Y ~ did + M', '变量': 'did',
+                 '系数': row["直接效应c'"], '标准误': row["c'_标准误"], 'p值': row["c'_p值"]},
+                {'中介变量': row['中介变量'], '步骤': '(3) Y ~ did + M', '变量': row['中介变量'],
+                 '系数': row['路径b'], '标准误': row['b_标准误'], 'p值': row['b_p值']},
+            ])
+        info = pd.DataFrame({
+            '项目': ['被解释变量', '政策变量', '控制变量', '样本量', '城市数', 'Bootstrap次数'],
+            '内容': [self.y_var, self.treatment, ', '.join(self.controls), self.n,
+                   self.S_city.shape[0], self.n_boot],
+        })
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            res.to_excel(writer, sheet_name='中介效应汇总', index=False)
+            pd.DataFrame(steps).to_excel(writer, sheet_name='三步法系数', index=False)
+            info.to_excel(writer, sheet_name='模型设定', index=False)
+        print(f'[OK] 中介效应结果已保存: {output_file}')
+
+
+def main(n_boot=5000):
+    """
+    主函数: 产业结构渠道的中介效应检验
+    """
+    print('[OK] === 中介效应分析: 产业结构渠道 ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    analysis = MediationAnalysis(df)
+    print(f'[INFO] 中介变量: {analysis.mediators}, 控制变量: {analysis.controls}, '
+          f'样本量: {analysis.n}')
+    results = analysis.run(n_boot=n_boot)
+    print('\n[INFO] 中介效应:')
+    print(results[['中介变量', '路径a', 'a_p值', '路径b', 'b_p值', '间接效应ab',
+                   'Bootstrap_CI下限', 'Bootstrap_CI上限', '中介比例']]
+          .to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+    analysis.save()
+    return analysis
+
+
+if __name__ == '__main__':
+    analysis = main()
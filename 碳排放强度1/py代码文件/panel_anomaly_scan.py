@@ -0,0 +1,346 @@
+"""
+全面板异常值批量扫描
+
+把 sanya_statistical_test.py / investigate_sanya_2017.py / check_ordos_data.py /
+fix_pop_density_bug.py 中针对单个城市手工进行的检验推广到 全部城市 × 年份 × 变量:
+
+检验项目 (均为分组向量化统计, 一次计算全部单元格):
+1. 截面 z 分数        : 同年份全部城市的均值/标准差
+2. 稳健 MAD 分数      : 同年份中位数 / 中位数绝对偏差 (0.6745 * (x - med) / MAD)
+3. IQR 围栏           : 同年份 [Q1 - 1.5 IQR, Q3 + 1.5 IQR] 之外
+4. 百分位排名         : 同年份排名低于 1% 或高于 99%
+5. 同类城市 z 分数    : 同年份 × 同省份 (city_code 前两位) 或 × 同规模组 (人口三分位),
+                        与其余同类城市比较 (留一均值/标准差)
+6. 年际跳变           : 城市内相邻年份变化 (正值变量取对数差) 的稳健 z 分数
+7. 数值停滞           : 城市内连续多年取值完全相同 (pop_density 列错位问题的特征)
+
+输出按异常检验数量和严重程度排序的异常表, 新的"三亚型"问题一次扫描即可发现。
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from panel_data import PanelData
+from panel_winsorize import group_nanquantile
+
+# 各检验的判定阈值
+THRESHOLDS = {
+    'z': 3.0,
+    'mad': 3.5,
+    'iqr': 1.5,
+    'percentile': 0.01,
+    'peer_z': 3.0,
+    'jump': 5.0,
+    'stuck': 4,
+}
+
+# 同类城市 z 分数使用本组标准差所需的最少其余同类城市数 (不足时用同年份合并组内标准差)
+MIN_PEERS = 3
+
+
+def group_mean_std(block, group_codes, n_groups):
+    """
+    分组均值与标准差 (忽略缺失值, 全部列一次计算)
+
+    Returns:
+    --------
+    mean, std, count : np.ndarray
+        形状 (n_groups, k)
+    """
+    n = len(block)
+    D = sparse.csr_matrix((np.ones(n), (np.arange(n), group_codes)), shape=(n, n_groups))
+    valid = ~np.isnan(block)
+    X0 = np.where(valid, block, 0.0)
+    count = np.asarray(D.T @ valid.astype(np.float64))
+    s1 = np.asarray(D.T @ X0)
+    s2 = np.asarray(D.T @ (X0 ** 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s1 / count
+        var = (s2 - count * mean ** 2) / (count - 1)
+    return mean, np.sqrt(np.clip(var, 0, None)), count
+
+
+def _robust_scores(block, group_codes, n_groups):
+    """组内 MAD 稳健分数 (两次分组分位数计算)"""
+    median = group_nanquantile(block, group_codes, n_groups, [0.5])[0]
+    deviation = np.abs(block - median[group_codes])
+    mad = group_nanquantile(deviation, group_codes, n_groups, [0.5])[0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = 0.6745 * (block - median[group_codes]) / mad[group_codes]
+    return np.where(np.isfinite(score), score, np.nan)
+
+
+class AnomalyScanner:
+    """
+    面板异常值扫描器
+
+    所有检验都在排序后的 (城市, 年份) 面板列块上完成, 不按城市或变量循环。
+    """
+
+    def __init__(self, data, variables, entity_var='city_name', time_var='year',
+                 code_var='city_code', size_var='population'):
+        """
+        Parameters:
+        -----------
+        data : pd.DataFrame
+            面板数据
+        variables : list
+            需要扫描的数值变量
+        entity_var, time_var : str
+            城市、年份标识
+        code_var : str
+            城市行政区划代码 (用于提取省份, 前两位)
+        size_var : str
+            城市规模变量 (用于划分同规模组)
+        """
+        self.variables = [var for var in variables if var in data.columns]
+        extra = [var for var in (code_var, size_var)
+                 if var in data.columns and var not in self.variables]
+        self.panel = PanelData.from_frame(data, entity_var=entity_var, time_var=time_var,
+                                          value_vars=self.variables + extra)
+        self.code_var = code_var
+        self.size_var = size_var
+        self.block = np.column_stack([self.panel[var] for var in self.variables])
+
+        # 扫描结果
+        self.scores = None
+        self.anomalies = None
+
+    # ------------------------------------------------------------------
+    # 分组定义
+    # ------------------------------------------------------------------
+    def _province_codes(self):
+        if self.code_var not in self.panel:
+            return None
+        codes = self.panel[self.code_var]
+        province = np.where(np.isnan(codes), -1, np.floor(codes / 10000)).astype(np.int64)
+        return province
+
+    def _size_class(self):
+        """同年份人口三分位 (0/1/2), 缺失为 -1"""
+        if self.size_var not in self.panel:
+            return None
+        size = self.panel[self.size_var].astype(np.float64)
+        year_codes = self.panel.year_codes.astype(np.int64)
+        cuts = group_nanquantile(size, year_codes, self.panel.n_years, [1 / 3, 2 / 3])
+        lower, upper = cuts[0][year_codes, 0], cuts[1][year_codes, 0]
+        size_class = (size > lower).astype(np.int64) + (size > upper).astype(np.int64)
+        return np.where(np.isnan(size), -1, size_class)
+
+    def _peer_z(self, peer):
+        """
+        同年份 × 同类城市的留一 z 分数; peer 为 -1 的观测不参与
+
+        (x - 其余同类城市均值) / (s · sqrt(1 + 1/m)), m 为其余同类城市数, 由组内和与平方和
+        扣除本单元格得到 (本单元格计入自身组均值与标准差时 |z| ≤ (n-1)/√n, 小省份无法触发)。
+        s 取其余同类城市的标准差; 其余城市少于 MIN_PEERS 个时 (如海南只有两个城市)
+        改用同年份各组合并的组内标准差 (同样扣除本单元格)。
+        """
+        year_codes = self.panel.year_codes.astype(np.int64)
+        labels, peer_codes = np.unique(peer, return_inverse=True)
+        group = year_codes * len(labels) + peer_codes
+        n_groups = self.panel.n_years * len(labels)
+        mean, std, count = group_mean_std(self.block, group, n_groups)
+
+        # 组内离差平方和, 未分组 (peer = -1) 的城市不计入合并标准差
+        ss = np.nan_to_num(std ** 2 * (count - 1))
+        dof = np.maximum(count - 1, 0)
+        grouped = (labels >= 0)[np.arange(n_groups) % len(labels)]
+        group_year = np.arange(n_groups) // len(labels)
+        ss_year = np.zeros((self.panel.n_years, self.block.shape[1]))
+        dof_year = np.zeros_like(ss_year)
+        np.add.at(ss_year, group_year[grouped], ss[grouped])
+        np.add.at(dof_year, group_year[grouped], dof[grouped])
+
+        n = count[group]
+        n_peers = n - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            deviation = (self.block - mean[group]) * n / n_peers
+            removed = deviation ** 2 * n_peers / n
+            own_var = (ss[group] - removed) / (n_peers - 1)
+            pooled_var = (ss_year[year_codes] - removed) / (dof_year[year_codes] - 1)
+            var = np.where(n_peers >= MIN_PEERS, own_var, pooled_var)
+            z = deviation / np.sqrt(np.clip(var, 0, None) * (1 + 1 / n_peers))
+        z[(peer < 0)[:, None] | (n_peers < 1)] = np.nan
+        return np.where(np.isfinite(z), z, np.nan)
+
+    # ------------------------------------------------------------------
+    # 扫描
+    # ------------------------------------------------------------------
+    def _jump_block(self):
+        """城市内年际变化: 正值变量取对数差, 其余取差分"""
+        jumps = []
+        for j, var in enumerate(self.variables):
+            x = self.block[:, j]
+            lag = self.panel.lag(var, 1).astype(np.float64)
+            if np.nanmin(x) > 0:
+                jumps.append(np.log(x) - np.log(lag))
+            else:
+                jumps.append(x - lag)
+        return np.column_stack(jumps)
+
+    def _stuck_runs(self):
+        """城市内连续相同取值的游程长度"""
+        lagged = np.column_stack([self.panel.lag(var, 1).astype(np.float64)
+                                  for var in self.variables])
+        same = (self.block == lagged)
+        runs = np.zeros(self.block.shape, dtype=np.int64)
+        for j in range(self.block.shape[1]):
+            run_id = np.cumsum(~same[:, j])
+            runs[:, j] = np.bincount(run_id)[run_id]
+        runs[np.isnan(self.block)] = 0
+        return runs
+
+    def scan(self, peer_by='province'):
+        """
+        对全部单元格执行所有检验
+
+        Parameters:
+        -----------
+        peer_by : str
+            同类城市分组: 'province' (省份) 或 'size' (人口三分位)
+
+        Returns:
+        --------
+        pd.DataFrame : 按严重程度排序的异常单元格表
+        """
+        print('[INFO] 开始全面板异常值扫描...')
+        block = self.block
+        year_codes = self.panel.year_codes.astype(np.int64)
+        n_years = self.panel.n_years
+
+        # 1. 截面 z 分数
+        mean, std, _ = group_mean_std(block, year_codes, n_years)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (block - mean[year_codes]) / std[year_codes]
+
+        # 2. 稳健 MAD 分数
+        mad = _robust_scores(block, year_codes, n_years)
+
+        # 3. IQR 围栏 (以 IQR 为单位的越界距离)
+        q1, q3 = group_nanquantile(block, year_codes, n_years, [0.25, 0.75])
+        iqr = (q3 - q1)[year_codes]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iqr_score = np.maximum((block - q3[year_codes]) / iqr,
+                                   (q1[year_codes] - block) / iqr)
+        iqr_score = np.where(np.isfinite(iqr_score), np.maximum(iqr_score, 0), np.nan)
+
+        # 4. 百分位排名
+        frame = pd.DataFrame(block, columns=self.variables)
+        pct = frame.groupby(year_codes).rank(pct=True).to_numpy()
+
+        # 5. 同类城市 z 分数
+        peer = self._province_codes() if peer_by == 'province' else self._size_class()
+        peer_z = self._peer_z(peer) if peer is not None else np.full(block.shape, np.nan)
+
+        # 6. 年际跳变 (全部年份合并的稳健分数)
+        jump = self._jump_block()
+        jump_z = _robust_scores(jump, np.zeros(len(jump), dtype=np.int64), 1)
+
+        # 7. 数值停滞
+        stuck = self._stuck_runs()
+
+        flags = {
+            'z分数': np.abs(z) > THRESHOLDS['z'],
+            'MAD分数': np.abs(mad) > THRESHOLDS['mad'],
+            'IQR围栏': iqr_score > THRESHOLDS['iqr'],
+            '百分位极端': (pct < THRESHOLDS['percentile']) | (pct > 1 - THRESHOLDS['percentile']),
+            '同类城市z分数': np.abs(peer_z) > THRESHOLDS['peer_z'],
+            '年际跳变': np.abs(jump_z) > THRESHOLDS['jump'],
+            '数值停滞': stuck >= THRESHOLDS['stuck'],
+        }
+        severity = np.nanmax(np.stack([
+            np.abs(z) / THRESHOLDS['z'],
+            np.abs(mad) / THRESHOLDS['mad'],
+            iqr_score / THRESHOLDS['iqr'],
+            np.abs(peer_z) / THRESHOLDS['peer_z'],
+            np.abs(jump_z) / THRESHOLDS['jump'],
+            stuck / THRESHOLDS['stuck'],
+        ]), axis=0)
+        n_flags = sum(flag.astype(np.int64) for flag in flags.values())
+
+        n, k = block.shape
+        city = self.panel.city_categories[np.repeat(self.panel.city_codes, k)]
+        self.scores = pd.DataFrame({
+            self.panel.entity_var: city,
+            self.panel.time_var: np.repeat(self.panel.years, k),
+            '变量': np.tile(self.variables, n),
+            '取值': block.ravel(),
+            'z分数': z.ravel(),
+            'MAD分数': mad.ravel(),
+            'IQR越界': iqr_score.ravel(),
+            '百分位': pct.ravel(),
+            '同类城市z分数': peer_z.ravel(),
+            '年际变化': jump.ravel(),
+            '跳变分数': jump_z.ravel(),
+            '停滞年数': stuck.ravel(),
+            '异常检验数': n_flags.ravel(),
+            '异常程度': severity.ravel(),
+            '触发检验': self._flag_labels(flags),
+        })
+
+        anomalies = self.scores[self.scores['异常检验数'] > 0]
+        self.anomalies = anomalies.sort_values(['异常检验数', '异常程度'],
+                                               ascending=False).reset_index(drop=True)
+        self.anomalies.insert(0, '排名', np.arange(1, len(self.anomalies) + 1))
+        print(f'[OK] 扫描完成: {n} 观测 × {k} 变量 = {n * k} 个单元格, '
+              f'{len(self.anomalies)} 个单元格至少触发一项检验')
+        return self.anomalies
+
+    @staticmethod
+    def _flag_labels(flags):
+        names = list(flags)
+        stacked = np.stack([flag.ravel() for flag in flags.values()], axis=1)
+        return ['+'.join(name for name, hit in zip(names, row) if hit) for row in stacked]
+
+    def summary_by_variable(self):
+        """各变量触发每项检验的单元格数"""
+        tests = ['z分数', 'MAD分数', 'IQR围栏', '百分位极端', '同类城市z分数', '年际跳变', '数值停滞']
+        table = pd.DataFrame({
+            test: self.anomalies['触发检验'].str.split('+').apply(lambda x, t=test: t in x)
+            for test in tests
+        })
+        table['变量'] = self.anomalies['变量']
+        return table.groupby('变量').sum().reset_index()
+
+    def save_results(self, output_file='异常值扫描报告.xlsx', top=500):
+        """保存扫描结果"""
+        city_summary = (self.anomalies.groupby(self.panel.entity_var, observed=True)
+                        .agg(异常单元格数=('变量', 'size'), 最高异常程度=('异常程度', 'max'))
+                        .sort_values('最高异常程度', ascending=False).reset_index())
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            self.anomalies.head(top).to_excel(writer, sheet_name='异常排名', index=False)
+            self.summary_by_variable().to_excel(writer, sheet_name='变量汇总', index=False)
+            city_summary.to_excel(writer, sheet_name='城市汇总', index=False)
+        print(f'[OK] 异常值扫描报告已保存: {output_file}')
+
+
+def main():
+    """
+    主函数: 扫描主数据集的全部连续变量
+    """
+    print('[OK] === 全面板异常值批量扫描 ===')
+
+    df = pd.read_excel('总数据集_2007-2023_完整版_无缺失FDI.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    variables = ['carbon_intensity', 'pop_density', 'gdp_per_capita', 'population',
+                 'tertiary_share', 'industrial_upgrading', 'fdi', 'fdi_openness',
+                 'road_area', 'financial_development']
+
+    scanner = AnomalyScanner(df, variables)
+    anomalies = scanner.scan(peer_by='province')
+
+    print('\n[INFO] 异常程度最高的20个单元格:')
+    print(anomalies.head(20)[['排名', 'city_name', 'year', '变量', '取值',
+                              '异常检验数', '异常程度', '触发检验']].to_string(index=False))
+
+    scanner.save_results()
+    return scanner
+
+
+if __name__ == '__main__':
+    scanner = main()
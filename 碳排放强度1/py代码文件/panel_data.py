@@ -0,0 +1,360 @@
+"""
+紧凑型面板数据容器 (city × year)
+
+用途:
+- 替代各脚本中反复出现的 `df['city_name'].astype('category').cat.codes` 面板标识构造
+- 城市存储为分类编码 (int16/int32)，年份存储为 int16
+- 数值变量统一存储为 float32 或 float64 (可选)
+- (城市, 年份) 索引存储为排序后的整数数组，并预计算每个城市的行区间
+
+主要功能:
+1. O(1) 取得任一城市的时间序列切片
+2. 基于 (城市, 年份) 网格的滞后项 / 前导项 (自动处理非连续年份)
+3. 平衡面板检验
+4. 内存占用对比 (相对于原始 DataFrame)
+
+用法示例:
+    from panel_data import PanelData
+    panel = PanelData.from_frame(df, float_dtype='float32')
+    y = panel['ln_carbon_intensity']
+    y_lag1 = panel.lag('ln_carbon_intensity', 1)
+    rows = panel.city_slice('三亚市')
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _smallest_int_dtype(max_value):
+    """返回能容纳 [0, max_value] 的最小有符号整数类型"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class PanelData:
+    """
+    以 (城市, 年份) 为键的紧凑面板数据
+
+    存储结构:
+    - city_codes : 每行的城市编码 (按城市名排序的分类编码)
+    - years      : 每行的年份 (int16)
+    - year_codes : 每行的年份编码 (0, 1, ..., T-1)
+    - city_offsets : 长度 N+1 的行区间数组, 第 i 个城市占据 [offsets[i], offsets[i+1])
+    - values     : {变量名: 一维数组}, 与行顺序一致
+
+    所有行按 (城市编码, 年份) 排序, 因此每个城市的观测是连续的一段。
+    """
+
+    def __init__(self, city_categories, city_codes, years, values,
+                 entity_var='city_name', time_var='year'):
+        """
+        直接由已排序的数组构造面板 (一般使用 from_frame)
+
+        Parameters:
+        -----------
+        city_categories : array-like
+            城市名称 (编码 i 对应 city_categories[i])
+        city_codes : np.ndarray
+            每行的城市编码, 已按 (城市, 年份) 排序
+        years : np.ndarray
+            每行的年份
+        values : dict
+            {变量名: 一维数值数组}
+        entity_var, time_var : str
+            转换回 DataFrame 时使用的列名
+        """
+        self.entity_var = entity_var
+        self.time_var = time_var
+        self.city_categories = pd.Index(city_categories)
+        self.city_codes = np.asarray(city_codes)
+        self.years = np.asarray(years, dtype=np.int16)
+        self.values = dict(values)
+
+        self.n_obs = len(self.city_codes)
+        self.n_cities = len(self.city_categories)
+
+        # 年份编码 (替代 year_entity)
+        self.year_levels = np.unique(self.years)
+        self.n_years = len(self.year_levels)
+        self.year_codes = np.searchsorted(self.year_levels, self.years).astype(np.int16)
+
+        # 每个城市的行区间 (city_codes 已排序)
+        counts = np.bincount(self.city_codes, minlength=self.n_cities)
+        self.city_offsets = np.zeros(self.n_cities + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.city_offsets[1:])
+
+        # (城市, 年份) -> 行号 网格, 缺失为 -1
+        self._grid = np.full((self.n_cities, self.n_years), -1,
+                             dtype=_smallest_int_dtype(max(self.n_obs, 1)))
+        self._grid[self.city_codes, self.year_codes] = np.arange(self.n_obs)
+
+        # 名称 -> 编码 查找表
+        self._city_lookup = {name: i for i, name in enumerate(self.city_categories)}
+
+    # ------------------------------------------------------------------
+    # 构造与转换
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_frame(cls, df, entity_var='city_name', time_var='year',
+                   value_vars=None, float_dtype='float64'):
+        """
+        由面板 DataFrame 构造 PanelData
+
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据 (每个 城市×年份 至多一行)
+        entity_var : str
+            截面标识列 (默认 city_name)
+        time_var : str
+            时间标识列 (默认 year)
+        value_vars : list, optional
+            需要保存的数值变量; 默认保存全部数值列
+        float_dtype : str
+            数值变量存储精度: 'float32' 或 'float64'
+        """
+        if float_dtype not in ('float32', 'float64'):
+            raise ValueError(f"float_dtype 必须为 'float32' 或 'float64', 收到: {float_dtype}")
+
+        if value_vars is None:
+            value_vars = [col for col in df.columns
+                          if col not in (entity_var, time_var)
+                          and pd.api.types.is_numeric_dtype(df[col])]
+
+        city = pd.Categorical(df[entity_var])
+        city_categories = city.categories
+        raw_codes = city.codes.astype(np.int64)
+        if (raw_codes < 0).any():
+            raise ValueError(f'{entity_var} 存在缺失值, 无法构造面板')
+
+        years = df[time_var].to_numpy(dtype=np.int64)
+
+        # 按 (城市编码, 年份) 排序
+        order = np.lexsort((years, raw_codes))
+        sorted_codes = raw_codes[order]
+        sorted_years = years[order]
+
+        duplicated = (np.diff(sorted_codes) == 0) & (np.diff(sorted_years) == 0)
+        if duplicated.any():
+            first = np.flatnonzero(duplicated)[0]
+            raise ValueError(
+                f'存在重复的 (城市, 年份) 观测: '
+                f'{city_categories[sorted_codes[first]]} {sorted_years[first]}'
+            )
+
+        code_dtype = _smallest_int_dtype(max(len(city_categories) - 1, 0))
+        values = {
+            var: df[var].to_numpy(dtype=float_dtype, na_value=np.nan)[order]
+            for var in value_vars
+        }
+
+        return cls(city_categories, sorted_codes.astype(code_dtype), sorted_years,
+                   values, entity_var=entity_var, time_var=time_var)
+
+    def to_frame(self, value_vars=None):
+        """转换回 DataFrame (城市名恢复为分类列)"""
+        value_vars = list(self.values) if value_vars is None else value_vars
+        data = {
+            self.entity_var: pd.Categorical.from_codes(self.city_codes, self.city_categories),
+            self.time_var: self.years,
+        }
+        for var in value_vars:
+            data[var] = self.values[var]
+        return pd.DataFrame(data)
+
+    def subset(self, value_vars):
+        """仅保留部分变量 (共享索引数组, 不复制)"""
+        missing = [var for var in value_vars if var not in self.values]
+        if missing:
+            raise KeyError(f'变量不存在: {missing}')
+        new = object.__new__(PanelData)
+        new.__dict__.update(self.__dict__)
+        new.values = {var: self.values[var] for var in value_vars}
+        return new
+
+    # ------------------------------------------------------------------
+    # 访问
+    # ------------------------------------------------------------------
+    def __getitem__(self, var):
+        return self.values[var]
+
+    def __contains__(self, var):
+        return var in self.values
+
+    def __len__(self):
+        return self.n_obs
+
+    @property
+    def variables(self):
+        return list(self.values)
+
+    @property
+    def entity_codes(self):
+        """城市编码 (与旧脚本的 city_entity 含义一致)"""
+        return self.city_codes
+
+    def city_code_of(self, city):
+        """城市名 -> 编码"""
+        try:
+            return self._city_lookup[city]
+        except KeyError:
+            raise KeyError(f'城市不存在: {city}') from None
+
+    def city_slice(self, city):
+        """
+        返回某城市所有观测的行区间 (O(1))
+
+        Parameters:
+        -----------
+        city : str or int
+            城市名称或城市编码
+        """
+        code = self.city_code_of(city) if isinstance(city, str) else int(city)
+        return slice(int(self.city_offsets[code]), int(self.city_offsets[code + 1]))
+
+    def city_series(self, city, var):
+        """返回某城市某变量的时间序列 (pd.Series, 以年份为索引)"""
+        rows = self.city_slice(city)
+        return pd.Series(self.values[var][rows], index=self.years[rows], name=var)
+
+    def row(self, city, year):
+        """返回 (城市, 年份) 对应的行号, 不存在时返回 -1"""
+        code = self.city_code_of(city) if isinstance(city, str) else int(city)
+        pos = np.searchsorted(self.year_levels, year)
+        if pos >= self.n_years or self.year_levels[pos] != year:
+            return -1
+        return int(self._grid[code, pos])
+
+    # ------------------------------------------------------------------
+    # 滞后 / 前导
+    # ------------------------------------------------------------------
+    def shift(self, var, periods=1):
+        """
+        城市内按年份平移 (正数为滞后, 负数为前导)
+
+        使用 (城市, 年份) 网格定位, 因此年份不连续时缺失年份对应 NaN,
+        而不会错误地取到相邻的非连续观测。
+        """
+        values = self.values[var]
+        target_years = self.years.astype(np.int64) - periods
+        pos = np.searchsorted(self.year_levels, target_years)
+        pos_clipped = np.clip(pos, 0, self.n_years - 1)
+        valid = self.year_levels[pos_clipped] == target_years
+
+        source_rows = np.where(valid, self._grid[self.city_codes, pos_clipped], -1)
+        result = np.full(self.n_obs, np.nan, dtype=values.dtype)
+        has_source = source_rows >= 0
+        result[has_source] = values[source_rows[has_source]]
+        return result
+
+    def lag(self, var, periods=1):
+        """滞后 periods 期"""
+        return self.shift(var, periods)
+
+    def lead(self, var, periods=1):
+        """前导 periods 期"""
+        return self.shift(var, -periods)
+
+    def diff(self, var, periods=1):
+        """城市内一阶差分 x_t - x_{t-periods}"""
+        return self.values[var] - self.lag(var, periods)
+
+    # ------------------------------------------------------------------
+    # 面板结构检验
+    # ------------------------------------------------------------------
+    def obs_per_city(self):
+        """每个城市的观测数"""
+        return np.diff(self.city_offsets)
+
+    def is_balanced(self, var=None):
+        """
+        是否为平衡面板
+
+        Parameters:
+        -----------
+        var : str, optional
+            若指定, 则同时要求该变量在所有 城市×年份 上非缺失
+        """
+        if self.n_obs != self.n_cities * self.n_years:
+            return False
+        if var is not None:
+            return not np.isnan(self.values[var]).any()
+        return True
+
+    def balance_report(self, value_vars=None):
+        """
+        平衡面板检验报告
+
+        Returns:
+        --------
+        pd.DataFrame : 每个城市的观测数、缺失年份数及各变量缺失数
+        """
+        value_vars = [] if value_vars is None else value_vars
+        n_obs = self.obs_per_city()
+        report = pd.DataFrame({
+            self.entity_var: self.city_categories,
+            '观测数': n_obs,
+            '缺失年份数': self.n_years - n_obs,
+        })
+        for var in value_vars:
+            missing = np.isnan(self.values[var])
+            report[f'{var}_缺失数'] = np.bincount(
+                self.city_codes, weights=missing, minlength=self.n_cities
+            ).astype(np.int64)
+        return report
+
+    # ------------------------------------------------------------------
+    # 内存
+    # ------------------------------------------------------------------
+    def memory_usage(self):
+        """面板占用的字节数 (索引数组 + 数值变量)"""
+        index_bytes = (self.city_codes.nbytes + self.years.nbytes + self.year_codes.nbytes
+                       + self.city_offsets.nbytes + self._grid.nbytes)
+        value_bytes = sum(arr.nbytes for arr in self.values.values())
+        return index_bytes + value_bytes
+
+    def summary(self):
+        """打印面板结构概况"""
+        print(f'[OK] 面板数据结构:')
+        print(f'    - 样本量: {self.n_obs} 观测值')
+        print(f'    - 城市数: {self.n_cities} 个')
+        print(f'    - 年份数: {self.n_years} 年')
+        print(f'    - 时间范围: {self.year_levels.min()}-{self.year_levels.max()}')
+        print(f'    - 变量数: {len(self.values)}')
+        print(f'    - 面板类型: {"平衡面板" if self.is_balanced() else "非平衡面板"}')
+
+
+def main():
+    """
+    主函数: 加载主数据集并对比内存占用
+    """
+    print('[OK] === 紧凑型面板数据容器 ===')
+
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    frame_bytes = df.memory_usage(deep=True).sum()
+    for float_dtype in ('float64', 'float32'):
+        panel = PanelData.from_frame(df, float_dtype=float_dtype)
+        panel_bytes = panel.memory_usage()
+        print(f'[INFO] {float_dtype}: DataFrame {frame_bytes / 1024:.1f} KB -> '
+              f'PanelData {panel_bytes / 1024:.1f} KB '
+              f'({frame_bytes / panel_bytes:.1f}x)')
+
+    panel.summary()
+
+    report = panel.balance_report(['ln_carbon_intensity'])
+    unbalanced = report[report['缺失年份数'] > 0]
+    print(f'[INFO] 非完整城市数: {len(unbalanced)}')
+    if len(unbalanced) > 0:
+        print(unbalanced.head(10).to_string(index=False))
+
+    return panel
+
+
+if __name__ == '__main__':
+    panel = main()
@@ -0,0 +1,308 @@
+"""
+主面板数据集的按列延迟加载
+
+问题:
+回归脚本通常只用到 `总数据集_2007-2023_*` 工作簿 50+ 列中的约 10 列,
+但每次 pd.read_excel 都会解析全部列。
+
+方案:
+1. 首次访问时把工作簿转换为列式磁盘副本 (每列一个 .npy 文件 + manifest.json),
+   存放在工作簿同目录的 `.column_cache/<文件名>/` 下
+2. 源工作簿修改 (mtime 或大小变化) 后自动重建副本
+3. 脚本声明需要的列和行过滤条件, 只反序列化这些列 (np.load 内存映射),
+   先读取过滤列计算行掩码, 再读取投影列
+
+用法示例:
+    from panel_loader import LazyPanel
+    df = (LazyPanel('总数据集_2007-2023_最终回归版.xlsx')
+          .select(['city_name', 'year', 'did', 'ln_carbon_intensity', 'ln_pgdp'])
+          .where(year=(2007, 2019))
+          .dropna(['ln_carbon_intensity'])
+          .collect())
+
+Created: 2026-10-19
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR_NAME = '.column_cache'
+MANIFEST_VERSION = 1
+
+
+def _cache_dir_for(path, sheet_name):
+    """工作簿对应的列式缓存目录"""
+    suffix = '' if sheet_name == 0 else f'__{sheet_name}'
+    return path.parent / CACHE_DIR_NAME / f'{path.stem}{suffix}'
+
+
+def _source_signature(path):
+    stat = path.stat()
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def build_column_store(path, sheet_name=0):
+    """
+    把 Excel 工作簿转换为列式磁盘副本
+
+    数值列保存为原始 dtype 的 .npy;
+    文本列保存为分类编码 (int32, 缺失为 -1), 类别列表写入 manifest。
+
+    Returns:
+    --------
+    dict : manifest
+    """
+    path = Path(path)
+    cache_dir = _cache_dir_for(path, sheet_name)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f'[INFO] 构建列式缓存: {path.name} -> {cache_dir}')
+    df = pd.read_excel(path, sheet_name=sheet_name)
+
+    columns = {}
+    for i, col in enumerate(df.columns):
+        file_name = f'col_{i:03d}.npy'
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            np.save(cache_dir / file_name, series.to_numpy())
+            columns[str(col)] = {'file': file_name, 'kind': 'numeric'}
+        else:
+            cat = pd.Categorical(series.astype('string'))
+            np.save(cache_dir / file_name, cat.codes.astype(np.int32))
+            columns[str(col)] = {
+                'file': file_name,
+                'kind': 'category',
+                'categories': [str(c) for c in cat.categories],
+            }
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source': path.name,
+        'sheet_name': sheet_name,
+        'signature': _source_signature(path),
+        'n_rows': len(df),
+        'columns': columns,
+    }
+    with open(cache_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    print(f'[OK] 列式缓存完成: {len(df)} 行 × {len(columns)} 列')
+    return manifest
+
+
+def load_manifest(path, sheet_name=0, rebuild=False):
+    """读取 manifest, 缓存缺失或过期时重建"""
+    path = Path(path)
+    manifest_file = _cache_dir_for(path, sheet_name) / 'manifest.json'
+    if not rebuild and manifest_file.exists():
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get('version') == MANIFEST_VERSION
+                and manifest.get('signature') == _source_signature(path)):
+            return manifest
+        print(f'[INFO] 源文件已更新, 重建列式缓存')
+    return build_column_store(path, sheet_name)
+
+
+class LazyPanel:
+    """
+    延迟加载的面板数据句柄
+
+    select / where / dropna 只记录查询计划 (返回新句柄, 原句柄不变),
+    collect 时才从列式缓存中读取需要的列。
+    """
+
+    def __init__(self, path, sheet_name=0):
+        """
+        Parameters:
+        -----------
+        path : str or Path
+            Excel 工作簿路径
+        sheet_name : int or str
+            工作表 (默认第一个)
+        """
+        self.path = Path(path)
+        self.sheet_name = sheet_name
+        self._columns = None
+        self._filters = {}
+        self._notna = []
+        self._manifest = None
+
+    def _clone(self):
+        new = LazyPanel(self.path, self.sheet_name)
+        new._columns = None if self._columns is None else list(self._columns)
+        new._filters = dict(self._filters)
+        new._notna = list(self._notna)
+        new._manifest = self._manifest
+        return new
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = load_manifest(self.path, self.sheet_name)
+        return self._manifest
+
+    @property
+    def columns(self):
+        """工作簿中全部可用列"""
+        return list(self.manifest['columns'])
+
+    @property
+    def n_rows(self):
+        return self.manifest['n_rows']
+
+    # ------------------------------------------------------------------
+    # 查询计划
+    # ------------------------------------------------------------------
+    def select(self, columns):
+        """声明需要的列 (投影)"""
+        new = self._clone()
+        new._columns = list(dict.fromkeys(columns))
+        return new
+
+    def where(self, **conditions):
+        """
+        行过滤条件
+
+        每个条件的取值:
+        - (low, high) 元组: 闭区间 low <= x <= high, 任一端可为 None (只用于数值列,
+          分类列传元组会报错, 集合条件请用 list / set)
+        - list / set: 取值属于集合
+        - 其他标量: 等于该值
+        """
+        new = self._clone()
+        new._filters.update(conditions)
+        return new
+
+    def dropna(self, columns):
+        """要求这些列非缺失"""
+        new = self._clone()
+        new._notna = list(dict.fromkeys(self._notna + list(columns)))
+        return new
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+    def _column_spec(self, col):
+        try:
+            return self.manifest['columns'][col]
+        except KeyError:
+            raise KeyError(f'列不存在: {col} (工作簿: {self.path.name})') from None
+
+    def _read_raw(self, col):
+        """读取一列的原始存储 (内存映射, 未复制)"""
+        spec = self._column_spec(col)
+        cache_dir = _cache_dir_for(self.path, self.sheet_name)
+        return np.load(cache_dir / spec['file'], mmap_mode='r')
+
+    def _decode(self, col, raw):
+        spec = self._column_spec(col)
+        if spec['kind'] == 'category':
+            cat = pd.Categorical.from_codes(np.asarray(raw), spec['categories'])
+            return cat.remove_unused_categories()
+        return np.asarray(raw)
+
+    def _condition_mask(self, col, condition):
+        spec = self._column_spec(col)
+        if isinstance(condition, tuple):
+            if spec['kind'] == 'category':
+                raise TypeError(f'分类列 {col} 不支持区间条件 (low, high); '
+                                '取值集合请用 list 或 set')
+            if len(condition) != 2:
+                raise ValueError(f'列 {col} 的区间条件应为 (low, high), 实际为 {condition}')
+        raw = self._read_raw(col)
+        if spec['kind'] == 'category':
+            categories = spec['categories']
+            if isinstance(condition, (list, set)):
+                wanted = [categories.index(v) for v in condition if v in categories]
+            else:
+                wanted = [categories.index(condition)] if condition in categories else []
+            return np.isin(raw, wanted)
+
+        if isinstance(condition, tuple):
+            low, high = condition
+            mask = np.ones(len(raw), dtype=bool)
+            if low is not None:
+                mask &= raw >= low
+            if high is not None:
+                mask &= raw <= high
+            return mask
+        if isinstance(condition, (list, set)):
+            return np.isin(raw, list(condition))
+        return raw == condition
+
+    def row_mask(self):
+        """根据过滤条件计算行掩码 (只读取过滤涉及的列)"""
+        mask = np.ones(self.n_rows, dtype=bool)
+        for col, condition in self._filters.items():
+            mask &= self._condition_mask(col, condition)
+        for col in self._notna:
+            raw = self._read_raw(col)
+            if self._column_spec(col)['kind'] == 'category':
+                mask &= raw >= 0
+            elif raw.dtype.kind == 'f':
+                mask &= ~np.isnan(raw)
+        return mask
+
+    def collect(self):
+        """执行查询, 返回 DataFrame (只包含投影列和满足过滤条件的行)"""
+        columns = self.columns if self._columns is None else self._columns
+        mask = self.row_mask()
+        rows = np.flatnonzero(mask)
+        data = {col: self._decode(col, self._read_raw(col)[rows]) for col in columns}
+        return pd.DataFrame(data, columns=columns)
+
+    def to_panel(self, entity_var='city_name', time_var='year', float_dtype='float64'):
+        """执行查询并构造 PanelData"""
+        from panel_data import PanelData
+
+        plan = self
+        if self._columns is not None:
+            needed = [entity_var, time_var] + [c for c in self._columns
+                                               if c not in (entity_var, time_var)]
+            plan = self.select(needed)
+        return PanelData.from_frame(plan.collect(), entity_var=entity_var,
+                                    time_var=time_var, float_dtype=float_dtype)
+
+    def __repr__(self):
+        cols = '全部' if self._columns is None else len(self._columns)
+        return (f'LazyPanel({self.path.name!r}, 列={cols}, '
+                f'过滤={self._filters}, 非缺失={self._notna})')
+
+
+def main():
+    """
+    主函数: 演示投影加载与完整加载的对比
+    """
+    import time
+
+    print('[OK] === 主面板按列延迟加载 ===')
+    data_file = '总数据集_2007-2023_最终回归版.xlsx'
+
+    start = time.perf_counter()
+    df_full = pd.read_excel(data_file)
+    t_excel = time.perf_counter() - start
+    print(f'[INFO] pd.read_excel 完整加载: {df_full.shape}, {t_excel:.3f}s, '
+          f'{df_full.memory_usage(deep=True).sum() / 1024:.1f} KB')
+
+    lazy = LazyPanel(data_file)
+    lazy.manifest  # 首次访问时构建缓存
+
+    start = time.perf_counter()
+    df = (lazy.select(['city_name', 'year', 'did', 'ln_carbon_intensity',
+                       'ln_pgdp', 'ln_pop_density', 'ln_fdi', 'ln_road_area'])
+              .where(year=(2007, 2019))
+              .dropna(['ln_carbon_intensity'])
+              .collect())
+    t_lazy = time.perf_counter() - start
+    print(f'[OK] 投影加载: {df.shape}, {t_lazy:.3f}s, '
+          f'{df.memory_usage(deep=True).sum() / 1024:.1f} KB')
+
+    return df
+
+
+if __name__ == '__main__':
+    df = main()
@@ -0,0 +1,225 @@
+"""
+双向固定效应面板回归核心 (组内变换 + 聚类稳健标准误)
+
+与 did_baseline_regression.py 中 LSDV (城市/年份虚拟变量) 做法等价:
+- 对 y 和 X 同时做城市、年份两向去均值 (交替投影, 平衡面板一次收敛)
+- 在去均值后的数据上做 OLS, 系数与 LSDV 完全一致
+- R2 按 LSDV 口径计算 (含固定效应的整体 R2)
+- 聚类标准误使用与 ols_regression_clustered 相同的小样本校正因子,
+  聚类时 t 检验自由度取 G - 1 (与各回归脚本的聚类 p 值一致)
+
+组内均值用稀疏指示矩阵一次性计算全部列, 不再构造 N+T 列的虚拟变量矩阵。
+
+用法示例:
+    from panel_regression import twfe_regression
+    res = twfe_regression(y, X, entity_codes, time_codes,
+                          cluster_codes=entity_codes, var_names=['did', 'ln_pgdp'])
+    res['coefficients'][0], res['std_errors'][0]
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+
+def _indicator(codes):
+    """由整数编码构造 (n × G) 稀疏指示矩阵"""
+    codes = np.asarray(codes)
+    uniques, inverse = np.unique(codes, return_inverse=True)
+    n = len(codes)
+    return sparse.csr_matrix(
+        (np.ones(n), (np.arange(n), inverse)), shape=(n, len(uniques))
+    ), inverse
+
+
+class TwoWayDemeaner:
+    """
+    城市 + 年份双向去均值算子
+
+    对同一样本的多个变量重复使用 (指示矩阵与组规模只计算一次)。
+    """
+
+    def __init__(self, entity_codes, time_codes, tol=1e-10, max_iter=1000):
+        """
+        Parameters:
+        -----------
+        entity_codes : array-like
+            每行的城市编码
+        time_codes : array-like
+            每行的年份编码
+        tol : float
+            交替投影收敛阈值 (非平衡面板)
+        max_iter : int
+            最大迭代次数
+        """
+        self.D_entity, self.entity_index = _indicator(entity_codes)
+        self.D_time, self.time_index = _indicator(time_codes)
+        self.n_obs = len(self.entity_index)
+        self.n_entities = self.D_entity.shape[1]
+        self.n_periods = self.D_time.shape[1]
+        self.entity_counts = np.asarray(self.D_entity.sum(axis=0)).ravel()
+        self.time_counts = np.asarray(self.D_time.sum(axis=0)).ravel()
+        self.balanced = self.n_obs == self.n_entities * self.n_periods
+        self.tol = tol
+        self.max_iter = max_iter
+
+    @property
+    def n_fe(self):
+        """固定效应消耗的自由度 (城市数 + 年份数 - 1)"""
+        return self.n_entities + self.n_periods - 1
+
+    def _group_means(self, D, counts, index, X):
+        means = (D.T @ X) / counts[:, None]
+        return means[index]
+
+    def demean(self, X):
+        """
+        双向去均值
+
+        Parameters:
+        -----------
+        X : np.ndarray
+            (n,) 或 (n, k) 数组, 不能包含缺失值
+
+        Returns:
+        --------
+        np.ndarray : 与 X 同形状的去均值结果
+        """
+        X = np.asarray(X, dtype=np.float64)
+        squeeze = X.ndim == 1
+        Z = X.reshape(len(X), -1).copy()
+        if np.isnan(Z).any():
+            raise ValueError('去均值的输入包含缺失值, 请先删除不完整观测')
+
+        if self.balanced:
+            Z -= self._group_means(self.D_entity, self.entity_counts, self.entity_index, Z)
+            Z -= self._group_means(self.D_time, self.time_counts, self.time_index, Z)
+        else:
+            scale = max(np.abs(Z).max(), 1.0)
+            for _ in range(self.max_iter):
+                Z -= self._group_means(self.D_entity, self.entity_counts, self.entity_index, Z)
+                time_means = self._group_means(self.D_time, self.time_counts, self.time_index, Z)
+                Z -= time_means
+                if np.abs(time_means).max() < self.tol * scale:
+                    break
+
+        return Z[:, 0] if squeeze else Z
+
+
+def cluster_meat(scores, cluster_codes):
+    """
+    聚类层面得分外积之和 sum_g (X_g'u_g)(X_g'u_g)'
+
+    Parameters:
+    -----------
+    scores : np.ndarray
+        (n, k) 每行 x_i * u_i
+    cluster_codes : array-like
+        聚类编码
+    """
+    D, _ = _indicator(cluster_codes)
+    S = D.T @ scores
+    return S.T @ S, D.shape[1]
+
+
+def twfe_regression(y, X, entity_codes, time_codes, cluster_codes=None,
+                    var_names=None, demeaner=None):
+    """
+    双向固定效应 OLS
+
+    Parameters:
+    -----------
+    y : np.ndarray
+        被解释变量 (n,)
+    X : np.ndarray
+        解释变量 (n, k), 不含常数项和固定效应
+    entity_codes, time_codes : array-like
+        城市、年份编码
+    cluster_codes : array-like, optional
+        聚类编码; 为 None 时报告普通 OLS 标准误
+    var_names : list, optional
+        解释变量名称
+    demeaner : TwoWayDemeaner, optional
+        复用已构建的去均值算子 (同一样本多次回归时)
+
+    Returns:
+    --------
+    dict : 与 ols_regression 相同的键 (coefficients, std_errors, t_stats, p_values,
+           r2, adj_r2, n_obs, n_vars, residuals), 另含 vcov、var_names、n_clusters、
+           dof (t 检验自由度: 聚类时 G - 1, 否则 n - k)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    if demeaner is None:
+        demeaner = TwoWayDemeaner(entity_codes, time_codes)
+
+    yd = demeaner.demean(y)
+    Xd = demeaner.demean(X)
+
+    XtX = Xd.T @ Xd
+    beta = np.linalg.solve(XtX, Xd.T @ yd)
+    residuals = yd - Xd @ beta
+
+    n = len(y)
+    # 与 LSDV 口径一致: 常数项 + (N-1) 城市 + (T-1) 年份 + k 个解释变量
+    k = X.shape[1] + demeaner.n_fe
+    XtX_inv = np.linalg.inv(XtX)
+
+    n_clusters = None
+    if cluster_codes is None:
+        sigma2 = residuals @ residuals / (n - k)
+        vcov = sigma2 * XtX_inv
+        dof = n - k
+    else:
+        meat, n_clusters = cluster_meat(Xd * residuals[:, None], cluster_codes)
+        correction = (n_clusters / (n_clusters - 1)) * ((n - 1) / (n - k))
+        vcov = correction * XtX_inv @ meat @ XtX_inv
+        dof = n_clusters - 1
+
+    se = np.sqrt(np.diag(vcov))
+    t_stats = beta / se
+    p_values = 2 * (1 - stats.t.cdf(np.abs(t_stats), dof))
+
+    ss_tot = np.sum((y - y.mean()) ** 2)
+    ss_res = residuals @ residuals
+    r2 = 1 - ss_res / ss_tot
+    adj_r2 = 1 - (1 - r2) * (n - 1) / (n - k)
+
+    return {
+        'coefficients': beta,
+        'std_errors': se,
+        't_stats': t_stats,
+        'p_values': p_values,
+        'vcov': vcov,
+        'r2': r2,
+        'adj_r2': adj_r2,
+        'n_obs': n,
+        'n_vars': k,
+        'n_clusters': n_clusters,
+        'dof': dof,
+        'residuals': residuals,
+        'var_names': list(var_names) if var_names is not None
+                     else [f'x{i}' for i in range(X.shape[1])],
+    }
+
+
+def twfe_from_frame(df, y_var, x_vars, entity_var='city_name', time_var='year',
+                    cluster_var='city_name'):
+    """
+    从 DataFrame 直接估计双向固定效应模型 (自动删除不完整观测)
+
+    Returns:
+    --------
+    dict : 同 twfe_regression
+    """
+    sample = df.dropna(subset=[y_var] + list(x_vars))
+    entity = pd.Categorical(sample[entity_var]).codes
+    time = pd.Categorical(sample[time_var]).codes
+    cluster = None if cluster_var is None else pd.Categorical(sample[cluster_var]).codes
+    return twfe_regression(sample[y_var].to_numpy(dtype=float),
+                           sample[list(x_vars)].to_numpy(dtype=float),
+                           entity, time, cluster_codes=cluster, var_names=x_vars)
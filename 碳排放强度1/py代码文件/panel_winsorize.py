@@ -0,0 +1,225 @@
+"""
+多变量单次缩尾处理 (支持全样本 / 分年份 / 分组截断点)
+
+替代 winsorize_and_log_transform.py 中逐变量调用 quantile(0.01) / quantile(0.99) 的循环:
+- 全部变量的上下分位数通过一次 np.nanquantile 调用在列块上计算
+- 分年份或分组缩尾时, 把各组数据排成 (组数 × 组内最大样本 × 变量数) 的 NaN 填充数组,
+  仍然只调用一次 np.nanquantile
+- 被缩尾单元格的原始值保存在紧凑的侧存储中 (行号 int32, 变量号 int16, 原值 float64),
+  用于审计和还原
+- 缩尾报告 (缩尾处理报告.xlsx) 与缩尾本身在同一遍计算中生成
+
+用法示例:
+    from panel_winsorize import Winsorizer
+    w = Winsorizer(continuous_vars, lower=0.01, upper=0.99, by='year')
+    df = w.fit_transform(df)
+    w.save_report('缩尾处理报告.xlsx')
+
+Created: 2026-10-19
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def group_nanquantile(block, group_codes, n_groups, quantiles):
+    """
+    一次 nanquantile 调用计算所有组、所有变量的分位数
+
+    把各组数据排成 (组数 × 组内最大样本 × 变量数) 的 NaN 填充数组后统一计算。
+
+    Parameters:
+    -----------
+    block : np.ndarray
+        (n, k) 数据块
+    group_codes : np.ndarray
+        每行的组编码 (0 ~ n_groups-1)
+    n_groups : int
+        组数
+    quantiles : list
+        分位数列表
+
+    Returns:
+    --------
+    np.ndarray : 形状 (len(quantiles), n_groups, k)
+    """
+    block = np.asarray(block, dtype=np.float64).reshape(len(block), -1)
+    order = np.argsort(group_codes, kind='stable')
+    counts = np.bincount(group_codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(len(order)) - np.repeat(starts, counts)
+
+    padded = np.full((n_groups, max(counts.max(), 1), block.shape[1]), np.nan)
+    padded[group_codes[order], position] = block[order]
+
+    with warnings.catch_warnings():
+        # 全部缺失的组返回 NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(padded, quantiles, axis=1)
+
+
+class Winsorizer:
+    """
+    列块缩尾器
+
+    by 参数:
+    - None       : 全样本截断点 (与原脚本一致)
+    - 'year'     : 分年份截断点
+    - 其他列名   : 按该列分组 (如省份、城市规模分组)
+    """
+
+    def __init__(self, variables, lower=0.01, upper=0.99, by=None):
+        """
+        Parameters:
+        -----------
+        variables : list
+            需要缩尾的连续型变量
+        lower, upper : float
+            下/上分位数
+        by : str, optional
+            分组列名
+        """
+        if not 0 <= lower < upper <= 1:
+            raise ValueError(f'分位数设置错误: lower={lower}, upper={upper}')
+        self.variables = list(variables)
+        self.lower = lower
+        self.upper = upper
+        self.by = by
+
+        # 拟合结果
+        self.cutoffs = None
+        self.summary = None
+        self.audit_rows = None
+        self.audit_vars = None
+        self.audit_values = None
+        self.variables_used = None
+        self._index = None
+
+    def fit_transform(self, df):
+        """
+        计算截断点并缩尾
+
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            输入数据 (不修改原对象)
+
+        Returns:
+        --------
+        pd.DataFrame : 缩尾后的数据
+        """
+        variables = [var for var in self.variables
+                     if var in df.columns and df[var].notna().any()]
+        skipped = sorted(set(self.variables) - set(variables))
+        if skipped:
+            print(f'[WARNING] 以下变量不存在或全部缺失, 跳过: {skipped}')
+
+        block = df[variables].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        if self.by is None:
+            group_codes = np.zeros(len(df), dtype=np.int64)
+            group_labels = ['全样本']
+        else:
+            cat = pd.Categorical(df[self.by])
+            group_codes = cat.codes.astype(np.int64)
+            if (group_codes < 0).any():
+                raise ValueError(f'分组变量 {self.by} 存在缺失值')
+            group_labels = list(cat.categories)
+
+        lower, upper = group_nanquantile(block, group_codes, len(group_labels),
+                                         [self.lower, self.upper])
+        row_lower = lower[group_codes]
+        row_upper = upper[group_codes]
+
+        clipped = np.clip(block, row_lower, row_upper)
+        below = block < row_lower
+        above = block > row_upper
+        changed = below | above
+
+        # 紧凑侧存储: 仅保存被缩尾单元格
+        rows, cols = np.nonzero(changed)
+        self.audit_rows = rows.astype(np.int32)
+        self.audit_vars = cols.astype(np.int16)
+        self.audit_values = block[rows, cols]
+        self._index = df.index
+        self.variables_used = variables
+
+        self.cutoffs = pd.DataFrame({
+            '分组': np.repeat(group_labels, len(variables)),
+            '变量': np.tile(variables, len(group_labels)),
+            f'{self.lower:.0%}分位': lower.ravel(),
+            f'{self.upper:.0%}分位': upper.ravel(),
+        })
+        self.summary = self._build_summary(variables, block, clipped, below, above,
+                                           lower, upper)
+
+        result = df.copy()
+        result[variables] = clipped
+        return result
+
+    def _build_summary(self, variables, block, clipped, below, above, lower, upper):
+        """与原脚本 '缩尾摘要' 相同列结构的报告 (向量化计算)"""
+        n_obs = (~np.isnan(block)).sum(axis=0)
+        original_mean = np.nanmean(block, axis=0)
+        winsorized_mean = np.nanmean(clipped, axis=0)
+        n_lower = below.sum(axis=0)
+        n_upper = above.sum(axis=0)
+
+        summary = pd.DataFrame({
+            '变量': variables,
+            '原始最小值': np.nanmin(block, axis=0),
+            f'{self.lower:.0%}分位': lower.mean(axis=0) if self.by else lower[0],
+            '原始均值': original_mean,
+            f'{self.upper:.0%}分位': upper.mean(axis=0) if self.by else upper[0],
+            '原始最大值': np.nanmax(block, axis=0),
+            '原始标准差': np.nanstd(block, axis=0, ddof=1),
+            '缩尾后最小值': np.nanmin(clipped, axis=0),
+            '缩尾后均值': winsorized_mean,
+            '缩尾后最大值': np.nanmax(clipped, axis=0),
+            '缩尾后标准差': np.nanstd(clipped, axis=0, ddof=1),
+            '均值变化(%)': (winsorized_mean - original_mean) / original_mean * 100,
+            '下尾缩尾数': n_lower,
+            '上尾缩尾数': n_upper,
+            '总缩尾数': n_lower + n_upper,
+            '缩尾比例(%)': (n_lower + n_upper) / n_obs * 100,
+        })
+        if self.by:
+            summary = summary.rename(columns={
+                f'{self.lower:.0%}分位': f'{self.lower:.0%}分位(组均值)',
+                f'{self.upper:.0%}分位': f'{self.upper:.0%}分位(组均值)',
+            })
+        return summary
+
+    def audit_table(self):
+        """被缩尾单元格明细 (行索引、变量、原值)"""
+        return pd.DataFrame({
+            '行索引': self._index[self.audit_rows],
+            '变量': np.asarray(self.variables_used)[self.audit_vars],
+            '原始值': self.audit_values,
+        })
+
+    def restore(self, df):
+        """用侧存储中的原值还原缩尾 (df 须为 fit_transform 的输出)"""
+        result = df.copy()
+        for j, var in enumerate(self.variables_used):
+            sel = self.audit_vars == j
+            col = result[var].to_numpy(dtype=np.float64, copy=True)
+            col[self.audit_rows[sel]] = self.audit_values[sel]
+            result[var] = col
+        return result
+
+    def save_report(self, output_file='缩尾处理报告.xlsx'):
+        """保存缩尾报告"""
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            self.summary.to_excel(writer, sheet_name='缩尾摘要', index=False)
+            comparison_df = self.summary[['变量', '原始均值', '缩尾后均值', '均值变化(%)',
+                                          '原始最小值', '缩尾后最小值',
+                                          '原始最大值', '缩尾后最大值',
+                                          '总缩尾数', '缩尾比例(%)']]
+            comparison_df.to_excel(writer, sheet_name='缩尾前后对比', index=False)
+            if self.by:
+                self.cutoffs.to_excel(writer, sheet_name='分组截断点', index=False)
+            self.audit_table().to_excel(writer, sheet_name='缩尾明细', index=False)
+        print(f'[OK] 缩尾效果报告已保存: {output_file}')
@@ -0,0 +1,459 @@
+"""
+流程脚本的阶段计时与运行追踪 (Chrome Trace / JSON)
+
+各脚本只打印 [OK] / [INFO] 提示, 不记录耗时。本模块提供:
+
+1. 计时区间 (span): 记录墙钟时间、CPU时间、常驻内存 (RSS) 及峰值、输入数据形状、
+   矩阵条件数等, 可嵌套
+       from pipeline_trace import span, traced
+       with span('读取数据', 'load', file=path):
+           df = pd.read_excel(path)
+
+2. 无需修改原脚本的自动插桩 (run_scripts):
+   - 脚本打印的 "=== 第N步：... ===" 提示行 → 阶段区间 (stage)
+   - pd.read_excel → load;  merge → merge;  to_excel / with ExcelWriter 退出 → write_excel
+   - np.linalg.solve / inv / lstsq → fit (记录矩阵形状与条件数)
+   - 脚本目录中定义的函数调用 (ols_regression、cluster_se、perform_matching 等)
+     → 按函数名归类为 fit / cluster_se / match / transform 等
+   只记录脚本目录内代码发起的调用, 不记录 pandas / numpy 内部调用
+
+3. 每次运行写出一个 Chrome Trace 文件 (运行追踪/trace_*.json),
+   可在 chrome://tracing 或 https://ui.perfetto.dev 打开, 并打印各类别耗时汇总
+
+命令行:
+    py py代码文件/pipeline_trace.py py代码文件/did_baseline_regression.py [更多脚本 ...]
+
+Created: 2026-10-19
+"""
+
+import contextlib
+import functools
+import json
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:  # psutil 为可选依赖, 缺失时从 /proc 读取 RSS
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # resource 仅 Unix 可用 (Windows 下峰值内存改由 psutil 提供)
+    resource = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_DIR = '运行追踪'
+MAX_COND_DIM = 2000
+
+# 函数名关键词 → 类别 (按顺序匹配)
+FUNCTION_CATEGORIES = [
+    (re.compile(r'cluster'), 'cluster_se'),
+    (re.compile(r'match|propensity|pscore'), 'match'),
+    (re.compile(r'regression|ols|fit|estimate|twfe'), 'fit'),
+    (re.compile(r'merge|join'), 'merge'),
+    (re.compile(r'load|read|from_excel'), 'load'),
+    (re.compile(r'save|write|to_excel|export'), 'write_excel'),
+]
+
+# 阶段名至少含一个非 '=' 字符, 不把 print('=' * 60) 之类的分隔线当作阶段
+STAGE_PATTERN = re.compile(r'===\s*([^=\s][^=]*?)\s*===')
+
+
+def _rss_mb():
+    """当前常驻内存 (MB)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return float('nan')
+
+
+def _peak_rss_mb():
+    """进程峰值常驻内存 (MB)"""
+    if resource is None:
+        if psutil is None:
+            return float('nan')
+        # Windows: peak_wset 为峰值工作集
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _normpath(path):
+    """绝对、大小写规范化路径 (Windows 下不区分大小写)"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def shape_of(obj):
+    """数据对象的形状 (DataFrame / ndarray / 其他返回 None)"""
+    shape = getattr(obj, 'shape', None)
+    return list(shape) if shape is not None else None
+
+
+def condition_number(matrix, max_dim=MAX_COND_DIM):
+    """方阵 / 设计矩阵的条件数 (维度过大时跳过)"""
+    matrix = np.asarray(matrix)
+    if matrix.ndim != 2 or min(matrix.shape) > max_dim or not np.isfinite(matrix).all():
+        return None
+    return float(np.linalg.cond(matrix))
+
+
+class Tracer:
+    """
+    计时区间记录器 (Chrome Trace 'X' 事件)
+    """
+
+    def __init__(self):
+        self.events = []
+        self.t0 = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self._open = {}
+        self._next_token = 0
+
+    def _now_us(self):
+        return (time.perf_counter_ns() - self.t0) / 1000
+
+    def begin(self, name, cat='stage', **args):
+        """开始一个区间, 返回令牌"""
+        token = self._next_token
+        self._next_token += 1
+        self._open[token] = (name, cat, args, self._now_us(), time.process_time(), _rss_mb())
+        return token
+
+    def end(self, token, **args):
+        """结束区间并记录事件"""
+        if token not in self._open:
+            return None
+        name, cat, start_args, ts, cpu0, rss0 = self._open.pop(token)
+        rss1 = _rss_mb()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': ts,
+            'dur': self._now_us() - ts,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': {
+                **start_args,
+                **args,
+                'cpu_s': time.process_time() - cpu0,
+                'rss_start_mb': rss0,
+                'rss_end_mb': rss1,
+                'peak_rss_mb': _peak_rss_mb(),
+            },
+        }
+        self.events.append(event)
+        return event
+
+    @contextlib.contextmanager
+    def span(self, name, cat='stage', **args):
+        """
+        计时区间 (上下文管理器)
+
+        Parameters:
+        -----------
+        name : str
+            区间名称
+        cat : str
+            类别: load / merge / transform / fit / cluster_se / match / write_excel / stage
+        **args :
+            附加信息 (如 shape、file); 区间内可通过 yield 的 dict 追加
+        """
+        token = self.begin(name, cat, **args)
+        extra = {}
+        try:
+            yield extra
+        finally:
+            self.end(token, **extra)
+
+    def close_all(self):
+        for token in list(self._open):
+            self.end(token)
+
+    def to_chrome(self):
+        return {'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+                'displayTimeUnit': 'ms'}
+
+    def save(self, output_file):
+        """写出 Chrome Trace JSON"""
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False, default=str)
+        print(f'[OK] 运行追踪已保存: {output_file}')
+
+    def summary(self):
+        """
+        各类别耗时汇总 (不含嵌套区间重复计算的总时长无法精确扣除, 仅供定位热点)
+
+        Returns:
+        --------
+        pd.DataFrame : 类别、名称、调用次数、总墙钟时间、总CPU时间、最大峰值内存
+        """
+        if not self.events:
+            return pd.DataFrame()
+        frame = pd.DataFrame({
+            '类别': [e['cat'] for e in self.events],
+            '名称': [e['name'] for e in self.events],
+            '墙钟时间(秒)': [e['dur'] / 1e6 for e in self.events],
+            'CPU时间(秒)': [e['args']['cpu_s'] for e in self.events],
+            '峰值内存(MB)': [e['args']['peak_rss_mb'] for e in self.events],
+        })
+        return (frame.groupby(['类别', '名称'])
+                .agg(调用次数=('墙钟时间(秒)', 'size'), 总墙钟时间=('墙钟时间(秒)', 'sum'),
+                     总CPU时间=('CPU时间(秒)', 'sum'), 峰值内存=('峰值内存(MB)', 'max'))
+                .sort_values('总墙钟时间', ascending=False)
+                .reset_index())
+
+
+TRACER = Tracer()
+
+
+def span(name, cat='stage', **args):
+    """使用默认记录器的计时区间"""
+    return TRACER.span(name, cat, **args)
+
+
+def traced(cat='stage', name=None):
+    """函数装饰器: 每次调用记录一个区间 (记录第一个参数的形状)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            shape = shape_of(args[0]) if args else None
+            with TRACER.span(name or func.__name__, cat, shape=shape):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============================================================================
+# 自动插桩
+# ============================================================================
+class _StageTee:
+    """stdout 包装: 识别 "=== ... ===" 提示行并切换阶段区间"""
+
+    def __init__(self, stream, tracer, script):
+        self.stream = stream
+        self.tracer = tracer
+        self.script = script
+        self.token = None
+
+    def write(self, text):
+        for line in text.splitlines():
+            match = STAGE_PATTERN.search(line)
+            if match:
+                self.close()
+                self.token = self.tracer.begin(match.group(1), 'stage', script=self.script)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.token is not None:
+            self.tracer.end(self.token)
+            self.token = None
+
+    def __getattr__(self, item):
+        return getattr(self.stream, item)
+
+
+class ScriptInstrumentation:
+    """
+    运行期插桩: 替换 pandas / numpy 的关键函数并注册函数调用钩子
+
+    只记录由 roots 目录下代码发起的调用。
+    """
+
+    def __init__(self, tracer=TRACER, roots=(SCRIPT_DIR,), profile_functions=True):
+        self.tracer = tracer
+        self.roots = tuple(os.path.join(_normpath(root), '') for root in roots)
+        self.profile_functions = profile_functions
+        self._originals = []
+        self._calls = {}
+        self._user_files = {}
+        self._self_file = _normpath(__file__)
+
+    def _is_user_file(self, filename):
+        """
+        文件是否位于 roots 目录内 (且不是本模块); 结果按 co_filename 缓存
+
+        co_filename 保留脚本的调用方式 (相对路径时也是相对的), 两侧都规范为绝对路径后比较
+        """
+        user = self._user_files.get(filename)
+        if user is None:
+            path = _normpath(filename)
+            user = path.startswith(self.roots) and path != self._self_file
+            self._user_files[filename] = user
+        return user
+
+    def _from_user_code(self, depth=2):
+        return self._is_user_file(sys._getframe(depth).f_code.co_filename)
+
+    def _patch(self, owner, attr, cat, describe):
+        original = getattr(owner, attr)
+        instrumentation = self
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if not instrumentation._from_user_code():
+                return original(*args, **kwargs)
+            token = instrumentation.tracer.begin(f'{cat}:{attr}', cat, **describe(args, kwargs))
+            result = None
+            try:
+                result = original(*args, **kwargs)
+                return result
+            finally:
+                instrumentation.tracer.end(token, result_shape=shape_of(result))
+
+        setattr(owner, attr, wrapper)
+        self._originals.append((owner, attr, original))
+
+    def _profile(self, frame, event, arg):
+        if event == 'call':
+            code = frame.f_code
+            if code.co_name.startswith('<') or not self._is_user_file(code.co_filename):
+                return
+            name = code.co_name
+            cat = next((c for pattern, c in FUNCTION_CATEGORIES if pattern.search(name.lower())),
+                       'transform')
+            self._calls[id(frame)] = self.tracer.begin(
+                name, cat, file=os.path.basename(code.co_filename), line=code.co_firstlineno)
+        elif event == 'return':
+            token = self._calls.pop(id(frame), None)
+            if token is not None:
+                self.tracer.end(token)
+
+    def install(self):
+        def file_arg(args, kwargs):
+            return {'file': str(args[0]) if args else str(kwargs.get('io'))}
+
+        def frame_shapes(args, kwargs):
+            return {'shapes': [shape_of(a) for a in args[:2]]}
+
+        def matrix_info(args, kwargs):
+            matrix = args[0] if args else None
+            return {'shape': shape_of(matrix), 'condition_number': condition_number(matrix)}
+
+        def writer_info(args, kwargs):
+            target = args[0] if args else None
+            if isinstance(target, pd.ExcelWriter):
+                handle = getattr(getattr(target, '_handles', None), 'handle', None)
+                return {'file': str(getattr(handle, 'name', None))}
+            output = args[1] if len(args) > 1 else kwargs.get('excel_writer')
+            if isinstance(output, pd.ExcelWriter):
+                output = '(ExcelWriter)'
+            return {'shape': shape_of(target), 'file': str(output)}
+
+        self._patch(pd, 'read_excel', 'load', file_arg)
+        self._patch(pd, 'merge', 'merge', frame_shapes)
+        self._patch(pd.DataFrame, 'merge', 'merge', frame_shapes)
+        self._patch(pd.DataFrame, 'to_excel', 'write_excel', writer_info)
+        self._patch(pd.ExcelWriter, '__exit__', 'write_excel', writer_info)
+        for attr in ('solve', 'inv', 'lstsq'):
+            self._patch(np.linalg, attr, 'fit', matrix_info)
+        if self.profile_functions:
+            sys.setprofile(self._profile)
+
+    def uninstall(self):
+        sys.setprofile(None)
+        for owner, attr, original in reversed(self._originals):
+            setattr(owner, attr, original)
+        self._originals.clear()
+        for token in list(self._calls.values()):
+            self.tracer.end(token)
+        self._calls.clear()
+
+
+def run_scripts(scripts, output_dir=TRACE_DIR, profile_functions=True):
+    """
+    依次运行脚本并记录整条流程的追踪
+
+    Parameters:
+    -----------
+    scripts : list
+        脚本路径 (按流程顺序)
+    output_dir : str
+        追踪文件目录
+    profile_functions : bool
+        是否记录脚本内函数调用 (开销较大时可关闭)
+
+    Returns:
+    --------
+    Tracer : 本次运行的记录器
+    """
+    tracer = Tracer()
+    roots = {SCRIPT_DIR} | {os.path.dirname(os.path.abspath(s)) for s in scripts}
+    instrumentation = ScriptInstrumentation(tracer, roots, profile_functions)
+    original_stdout, original_argv = sys.stdout, sys.argv
+
+    instrumentation.install()
+    try:
+        for script in scripts:
+            name = os.path.basename(script)
+            tee = _StageTee(original_stdout, tracer, name)
+            sys.stdout = tee
+            sys.argv = [script]
+            script_dir = os.path.dirname(os.path.abspath(script))
+            if script_dir not in sys.path:
+                sys.path.insert(0, script_dir)
+            with tracer.span(name, 'script', path=script) as info:
+                try:
+                    runpy.run_path(script, run_name='__main__')
+                    info['status'] = 'ok'
+                except SystemExit as exc:
+                    info['status'] = f'exit {exc.code}'
+                except Exception as exc:
+                    info['status'] = f'error: {exc!r}'
+                    print(f'[ERROR] {name} 运行失败: {exc!r}', file=original_stdout)
+                finally:
+                    tee.close()
+                    sys.stdout = original_stdout
+    finally:
+        instrumentation.uninstall()
+        sys.stdout, sys.argv = original_stdout, original_argv
+        tracer.close_all()
+
+    stem = '_'.join(os.path.splitext(os.path.basename(s))[0] for s in scripts)[:80]
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    tracer.save(os.path.join(output_dir, f'trace_{stem}_{stamp}.json'))
+    return tracer
+
+
+def main():
+    """
+    主函数: 追踪命令行给出的脚本
+    """
+    scripts = sys.argv[1:]
+    if not scripts:
+        print('用法: py py代码文件/pipeline_trace.py 脚本1.py [脚本2.py ...]')
+        return None
+
+    print(f'[OK] === 流程追踪: {len(scripts)} 个脚本 ===')
+    tracer = run_scripts(scripts)
+
+    summary = tracer.summary()
+    print('\n[INFO] 耗时汇总 (前20项):')
+    print(summary.head(20).to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+    by_category = summary.groupby('类别')['总墙钟时间'].sum().sort_values(ascending=False)
+    print('\n[INFO] 各类别总耗时 (秒, 嵌套区间重复计入):')
+    print(by_category.to_string(float_format=lambda x: f'{x:.3f}'))
+    return tracer
+
+
+if __name__ == '__main__':
+    tracer = main()
@@ -0,0 +1,226 @@
+"""
+声明式政策日历: 构建DID政策变量
+
+替代 construct_did_variable.py / reconstruct_did_variable.py 中写死的批次城市名单、
+省级代码 (2010年: 44, 21, 42, 61, 53; 2013年: 46) 以及逐城市/逐省份的嵌套循环。
+
+政策日历 (每行一条政策覆盖记录):
+    policy      政策标识 (用作输出列名前缀, 如 low_carbon, carbon_trading)
+    level       覆盖层级: 'city' 或 'province'
+    unit        城市名称 / 6位城市代码 (level=city), 或省级代码前两位 (level=province)
+    start_year  政策开始年份
+    batch       批次说明 (可选)
+
+解析规则 (与 reconstruct_did_variable.py 一致, 按政策分别解析):
+1. 明确名单优先: 城市级记录 (名称或代码匹配) 先赋值, 同一城市多次出现时以最早年份为准
+2. 省级试点只覆盖城市级记录未赋值的城市 (通过 city_code 前两位匹配),
+   即武汉 (湖北省级 2010, 名单 2013) 取 2013、三亚 (海南省级 2013, 名单 2017) 取 2017
+3. post = 1 当且仅当 当前年份 >= 开始年份
+
+输出 (主政策沿用原列名 pilot_year / treat / post / did):
+    {policy}_pilot_year, {policy}_treat, {policy}_post, {policy}_did, {policy}_exposure
+    n_active_policies  当年生效的政策数
+    policy_overlap     当年是否有多项政策同时生效
+
+新增政策 (碳交易试点、新能源示范城市等) 只需在日历工作簿中添加行, 无需修改代码。
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+
+CALENDAR_COLUMNS = ['policy', 'level', 'unit', 'start_year', 'batch']
+
+
+def _normalize_calendar(table, default_policy='low_carbon'):
+    """
+    把工作表统一为日历格式
+
+    兼容原有的试点城市名单 (city_name, pilot_year[, batch]) 格式,
+    视为 default_policy 的城市级记录。
+    """
+    table = table.copy()
+    if 'policy' not in table.columns:
+        if not {'city_name', 'pilot_year'} <= set(table.columns):
+            raise ValueError(f'无法识别的政策日历格式, 列名: {list(table.columns)}')
+        table = pd.DataFrame({
+            'policy': default_policy,
+            'level': 'city',
+            'unit': table['city_name'],
+            'start_year': table['pilot_year'],
+            'batch': table['batch'] if 'batch' in table.columns else None,
+        })
+
+    for col in CALENDAR_COLUMNS:
+        if col not in table.columns:
+            table[col] = None
+
+    table = table[CALENDAR_COLUMNS].dropna(subset=['policy', 'level', 'unit', 'start_year'])
+    table['level'] = table['level'].astype(str).str.lower()
+    bad_levels = set(table['level']) - {'city', 'province'}
+    if bad_levels:
+        raise ValueError(f'未知的政策层级: {bad_levels}')
+    table['start_year'] = table['start_year'].astype(int)
+    return table.reset_index(drop=True)
+
+
+class PolicyCalendar:
+    """
+    政策日历与向量化解析器
+    """
+
+    def __init__(self, calendar):
+        """
+        Parameters:
+        -----------
+        calendar : pd.DataFrame
+            日历表 (列: policy, level, unit, start_year[, batch])
+        """
+        self.calendar = _normalize_calendar(calendar)
+
+    @classmethod
+    def from_excel(cls, path, default_policy='low_carbon'):
+        """
+        从工作簿读取政策日历 (读取全部工作表并合并)
+
+        Parameters:
+        -----------
+        path : str or Path
+            日历工作簿, 如 原始数据/试点城市名单.xlsx
+        default_policy : str
+            旧格式名单 (city_name, pilot_year) 对应的政策标识
+        """
+        sheets = pd.read_excel(path, sheet_name=None)
+        tables = [_normalize_calendar(sheet, default_policy) for sheet in sheets.values()
+                  if len(sheet) > 0]
+        return cls(pd.concat(tables, ignore_index=True))
+
+    def add(self, policy, level, units, start_year, batch=None):
+        """追加覆盖记录 (units 可为单个或列表)"""
+        units = units if isinstance(units, (list, tuple, set)) else [units]
+        rows = pd.DataFrame({'policy': policy, 'level': level, 'unit': list(units),
+                             'start_year': start_year, 'batch': batch})
+        self.calendar = _normalize_calendar(pd.concat([self.calendar, rows], ignore_index=True))
+        return self
+
+    @property
+    def policies(self):
+        return list(dict.fromkeys(self.calendar['policy']))
+
+    def to_excel(self, output_file='政策日历.xlsx'):
+        self.calendar.to_excel(output_file, index=False)
+        print(f'[OK] 政策日历已保存: {output_file}')
+
+    # ------------------------------------------------------------------
+    # 解析
+    # ------------------------------------------------------------------
+    def assignments(self, df, entity_var='city_name', code_var='city_code'):
+        """
+        城市 → 各政策开始年份 (城市级记录优先, 省级记录只填补未赋值城市;
+        同一层级内多次出现取最早年份)
+
+        Returns:
+        --------
+        pd.DataFrame : 行为城市, 列为政策, 值为开始年份 (未覆盖为 NaN)
+        """
+        # 每个城市取第一个非缺失的城市代码 (首行代码缺失时不丢失省级匹配)
+        cities = df.groupby(entity_var, sort=False)[code_var].first().reset_index()
+        codes = pd.to_numeric(cities[code_var], errors='coerce')
+        cities['_city_code'] = codes.astype('Int64').astype(str)
+        cities['_province'] = (codes // 10000).astype('Int64').astype(str)
+
+        calendar = self.calendar.copy()
+        calendar['_unit'] = calendar['unit'].astype(str).str.replace(r'\.0$', '', regex=True)
+        city_rows = calendar[calendar['level'] == 'city']
+        province_rows = calendar[calendar['level'] == 'province']
+
+        def earliest(matches):
+            return (matches.groupby([entity_var, 'policy'])['start_year'].min()
+                    .unstack('policy')
+                    .reindex(index=cities[entity_var], columns=self.policies))
+
+        city_start = earliest(pd.concat([
+            cities.merge(city_rows, left_on=entity_var, right_on='_unit'),
+            cities.merge(city_rows, left_on='_city_code', right_on='_unit'),
+        ], ignore_index=True))
+        province_start = earliest(
+            cities.merge(province_rows, left_on='_province', right_on='_unit'))
+        return city_start.fillna(province_start)
+
+    def resolve(self, df, primary='low_carbon', entity_var='city_name',
+                code_var='city_code', time_var='year'):
+        """
+        把政策日历映射到面板, 生成政策变量
+
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据 (需包含城市名称、城市代码、年份)
+        primary : str
+            主政策; 其变量使用原列名 pilot_year / treat / post / did
+
+        Returns:
+        --------
+        pd.DataFrame : 增加政策变量后的数据 (不修改原对象)
+        """
+        start = self.assignments(df, entity_var=entity_var, code_var=code_var)
+        start.columns = [f'{policy}_pilot_year' for policy in start.columns]
+        result = df.drop(columns=[c for c in start.columns if c in df.columns])
+        result = result.merge(start, left_on=entity_var, right_index=True, how='left')
+
+        year = result[time_var].to_numpy()
+        active = []
+        for policy in self.policies:
+            pilot_year = result[f'{policy}_pilot_year'].to_numpy(dtype=float)
+            treat = ~np.isnan(pilot_year)
+            post = treat & (year >= np.nan_to_num(pilot_year, nan=np.inf))
+            result[f'{policy}_treat'] = treat.astype(int)
+            result[f'{policy}_post'] = post.astype(int)
+            result[f'{policy}_did'] = (treat & post).astype(int)
+            result[f'{policy}_exposure'] = np.where(post, year - np.nan_to_num(pilot_year) + 1, 0)
+            active.append(post)
+
+        result['n_active_policies'] = np.sum(active, axis=0).astype(int)
+        result['policy_overlap'] = (result['n_active_policies'] > 1).astype(int)
+
+        if primary in self.policies:
+            for suffix in ('pilot_year', 'treat', 'post', 'did'):
+                result[suffix] = result[f'{primary}_{suffix}']
+        return result
+
+    def summary(self, resolved, entity_var='city_name', time_var='year'):
+        """各政策各批次 (开始年份) 覆盖城市数"""
+        rows = []
+        for policy in self.policies:
+            firsts = resolved.drop_duplicates(entity_var)[f'{policy}_pilot_year'].dropna()
+            for start_year, count in firsts.value_counts().sort_index().items():
+                rows.append({'政策': policy, '开始年份': int(start_year), '城市数': count})
+        return pd.DataFrame(rows)
+
+
+def main():
+    """
+    主函数: 由试点城市名单构建DID变量
+    """
+    print('[OK] === 政策日历: 构建DID变量 ===')
+
+    calendar = PolicyCalendar.from_excel('原始数据/试点城市名单.xlsx')
+    print(f'[OK] 政策日历加载成功: {len(calendar.calendar)} 条记录, '
+          f'政策: {calendar.policies}')
+
+    df = pd.read_excel('总数据集_2007-2023_完整版_无缺失FDI.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    resolved = calendar.resolve(df)
+    print('\n[INFO] 各批次试点城市数:')
+    print(calendar.summary(resolved).to_string(index=False))
+    print(f'\n[INFO] DID=1的观测数: {resolved["did"].sum()} '
+          f'({resolved["did"].mean() * 100:.2f}%)')
+    print(f'[INFO] 多政策重叠观测数: {resolved["policy_overlap"].sum()}')
+
+    return resolved
+
+
+if __name__ == '__main__':
+    resolved = main()
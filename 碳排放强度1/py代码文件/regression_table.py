@@ -0,0 +1,333 @@
+"""
+回归结果表生成器 (从模型结果库读取, 输出 Excel / LaTeX / Markdown)
+
+替代各回归脚本中手工拼接 f'{coef:.4f}\\n({se:.4f})'、add_stars 的做法:
+- 任意多个已存储的模型结果组成多列回归表, 列可以来自不同批次的运行
+- 显著性星号、固定效应指示行、样本量、R2、调整R2 统一生成
+- 只读取结果库 (result_store.ResultStore), 不触发任何估计
+
+用法示例:
+    from result_store import ResultStore
+    from regression_table import RegressionTable
+    store = ResultStore()
+    table = RegressionTable.from_store(store, labels=['基准回归', '仅人均GDP'])
+    table.to_excel('基准回归结果表.xlsx')
+    print(table.to_markdown())
+
+Created: 2026-10-19
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# 常用变量的表内名称
+VAR_LABELS = {
+    'did': 'DID政策变量',
+}
+
+# 聚类变量 → 表注中的聚类层面
+CLUSTER_LABELS = {
+    'city_name': '城市',
+    'city_entity': '城市',
+    'province': '省份',
+}
+
+# LaTeX 特殊字符 (逐字符替换, 反斜杠替换结果中的花括号不会被再次转义)
+LATEX_ESCAPES = {
+    '\\': r'\textbackslash{}',
+    '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_', '{': r'\{', '}': r'\}',
+}
+
+# 固定效应名称 → 指示行名称
+FE_ROWS = {
+    '城市': '城市固定效应',
+    '年份': '年份固定效应',
+}
+
+
+def add_stars(p, levels=(0.1, 0.05, 0.01)):
+    """显著性标记 (默认 * p<0.1, ** p<0.05, *** p<0.01)"""
+    return '*' * int(sum(p < level for level in levels))
+
+
+class RegressionTable:
+    """
+    多列回归结果表
+    """
+
+    def __init__(self, results=None, column_labels=None, var_labels=None, order=None,
+                 digits=4, star_levels=(0.1, 0.05, 0.01)):
+        """
+        Parameters:
+        -----------
+        results : list of dict, optional
+            模型结果 (ResultStore 读取的格式, 或 twfe_regression 的返回值)
+        column_labels : list, optional
+            列标题 (默认使用结果标签)
+        var_labels : dict, optional
+            变量名 → 表内名称
+        order : list, optional
+            变量行顺序 (默认按首次出现顺序)
+        digits : int
+            小数位数
+        star_levels : tuple
+            显著性水平 (由宽到严)
+        """
+        self.columns = []
+        self.var_labels = {**VAR_LABELS, **(var_labels or {})}
+        self.order = order
+        self.digits = digits
+        self.star_levels = star_levels
+        for i, res in enumerate(results or []):
+            label = column_labels[i] if column_labels is not None else None
+            self.add_column(res, label)
+
+    @classmethod
+    def from_store(cls, store, keys=None, labels=None, **kwargs):
+        """
+        从结果库读取模型组成表格
+
+        Parameters:
+        -----------
+        store : ResultStore
+            模型结果库
+        keys : list, optional
+            主键列表
+        labels : list, optional
+            标签列表 (每个标签取最新一条结果)
+        """
+        results = [] if keys is None else store.load(keys)
+        for label in labels or []:
+            matches = store.query(label=label)
+            if not matches:
+                raise KeyError(f'结果库中不存在标签: {label}')
+            results.append(matches[-1])
+        return cls(results, **kwargs)
+
+    def add_column(self, result, label=None):
+        """追加一列 (可来自不同运行)"""
+        label = label or result.get('label') or f'模型{len(self.columns) + 1}'
+        coefficients = np.asarray(result['coefficients'], dtype=np.float64)
+        std_errors = np.asarray(result['std_errors'], dtype=np.float64)
+        # 聚类结果的 t 检验自由度为 G - 1 (与 twfe_regression 一致)
+        dof = result.get('dof') or (result['n_clusters'] - 1 if result.get('n_clusters')
+                                    else result['n_obs'] - (result.get('n_vars')
+                                                            or len(coefficients)))
+        p_values = result.get('p_values')
+        if p_values is None:
+            p_values = 2 * (1 - stats.t.cdf(np.abs(coefficients / std_errors), dof))
+        extra = result.get('extra') or {}
+        self.columns.append({
+            'label': label,
+            'n_clusters': result.get('n_clusters'),
+            'cluster_var': (result.get('spec') or {}).get('cluster_var'),
+            'var_names': list(result['var_names']),
+            'coefficients': coefficients,
+            'std_errors': std_errors,
+            'p_values': np.asarray(p_values, dtype=np.float64),
+            'fixed_effects': extra.get('fixed_effects', ['城市', '年份']),
+            'n_obs': result['n_obs'],
+            'r2': result.get('r2'),
+            'adj_r2': result.get('adj_r2'),
+        })
+        return self
+
+    # ------------------------------------------------------------------
+    # 表格主体
+    # ------------------------------------------------------------------
+    def _variables(self):
+        if self.order is not None:
+            return list(self.order)
+        return list(dict.fromkeys(var for col in self.columns for var in col['var_names']))
+
+    def _body(self):
+        """
+        系数与标准误字符串矩阵
+
+        Returns:
+        --------
+        variables : list
+        coef_cells, se_cells : np.ndarray
+            (变量数 × 模型数) 字符串数组, 未包含的变量为空字符串
+        """
+        variables = self._variables()
+        position = {var: i for i, var in enumerate(variables)}
+        coef_cells = np.full((len(variables), len(self.columns)), '', dtype=object)
+        se_cells = np.full((len(variables), len(self.columns)), '', dtype=object)
+        fmt = f'{{:.{self.digits}f}}'
+        for j, col in enumerate(self.columns):
+            for name, coef, se, p in zip(col['var_names'], col['coefficients'],
+                                         col['std_errors'], col['p_values']):
+                if name not in position:
+                    continue
+                i = position[name]
+                coef_cells[i, j] = fmt.format(coef) + add_stars(p, self.star_levels)
+                se_cells[i, j] = f'({fmt.format(se)})'
+        return variables, coef_cells, se_cells
+
+    def _footer(self):
+        """固定效应指示行及模型统计量"""
+        fe_names = list(dict.fromkeys(fe for col in self.columns for fe in col['fixed_effects']))
+        fmt = f'{{:.{self.digits}f}}'
+        rows = []
+        for fe in fe_names:
+            rows.append([FE_ROWS.get(fe, f'{fe}固定效应')] +
+                        ['Yes' if fe in col['fixed_effects'] else 'No' for col in self.columns])
+        rows.append(['样本量'] + [f"{col['n_obs']:,}" for col in self.columns])
+        rows.append(['R2'] + ['' if col['r2'] is None else fmt.format(col['r2'])
+                              for col in self.columns])
+        rows.append(['调整R2'] + ['' if col['adj_r2'] is None else fmt.format(col['adj_r2'])
+                                for col in self.columns])
+        return rows
+
+    def _headers(self):
+        return [f'({j + 1})\n{col["label"]}' for j, col in enumerate(self.columns)]
+
+    def to_frame(self, stacked=False):
+        """
+        表格 DataFrame
+
+        Parameters:
+        -----------
+        stacked : bool
+            False: 系数与标准误放在同一单元格 (系数\\n(标准误), 与原回归脚本一致)
+            True : 标准误单独一行
+        """
+        variables, coef_cells, se_cells = self._body()
+        names = [self.var_labels.get(var, var) for var in variables]
+        headers = self._headers()
+        if stacked:
+            rows = []
+            for name, coefs, ses in zip(names, coef_cells, se_cells):
+                rows.append([name] + list(coefs))
+                rows.append([''] + list(ses))
+        else:
+            cells = np.where(coef_cells == '', '-', coef_cells + '\n' + se_cells)
+            rows = [[name] + list(row) for name, row in zip(names, cells)]
+        rows += self._footer()
+        return pd.DataFrame(rows, columns=['变量'] + headers)
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+    def _note(self):
+        levels = sorted(self.star_levels, reverse=True)
+        stars = ', '.join(f'{"*" * (i + 1)} p<{level}' for i, level in enumerate(levels))
+        return f'注: 括号内为{self._se_note()}; {stars}'
+
+    def _se_note(self):
+        """由各列是否聚类 (n_clusters) 与聚类变量生成标准误说明"""
+        def describe(col):
+            if not col['n_clusters']:
+                return '普通标准误'
+            level = CLUSTER_LABELS.get(col['cluster_var'])
+            return f'{level}层面聚类稳健标准误' if level else '聚类稳健标准误'
+
+        kinds = [describe(col) for col in self.columns]
+        if len(set(kinds)) <= 1:
+            return kinds[0] if kinds else '标准误'
+        groups = {}
+        for col, kind in zip(self.columns, kinds):
+            groups.setdefault(kind, []).append(col['label'])
+        return '标准误 (' + '; '.join(f"{'、'.join(labels)}: {kind}"
+                                    for kind, labels in groups.items()) + ')'
+
+    def to_excel(self, output_file, sheet_name='回归结果'):
+        """保存为 Excel (另附数值明细工作表)"""
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            table = self.to_frame()
+            table.loc[len(table)] = [self._note()] + [''] * len(self.columns)
+            table.to_excel(writer, sheet_name=sheet_name, index=False)
+            self.details().to_excel(writer, sheet_name='详细结果', index=False)
+        print(f'[OK] 回归结果表已保存: {output_file}')
+
+    def details(self):
+        """数值明细 (长格式: 模型 × 变量)"""
+        rows = []
+        for col in self.columns:
+            for name, coef, se, p in zip(col['var_names'], col['coefficients'],
+                                         col['std_errors'], col['p_values']):
+                rows.append({'模型': col['label'], '变量': name, '系数': coef, '标准误': se,
+                             't值': coef / se, 'p值': p})
+        return pd.DataFrame(rows)
+
+    def to_latex(self, caption=None, label=None):
+        """LaTeX 表格 (booktabs 格式)"""
+        def escape(text):
+            return ''.join(LATEX_ESCAPES.get(char, char) for char in str(text))
+
+        variables, coef_cells, se_cells = self._body()
+        coef_cells = [[self._latex_stars(cell) for cell in row] for row in coef_cells]
+        n = len(self.columns)
+        lines = ['\\begin{table}[htbp]', '\\centering']
+        if caption:
+            lines.append(f'\\caption{{{escape(caption)}}}')
+        if label:
+            lines.append(f'\\label{{{label}}}')
+        lines += [f'\\begin{{tabular}}{{l{"c" * n}}}', '\\toprule',
+                  ' & ' + ' & '.join(f'({j + 1})' for j in range(n)) + ' \\\\',
+                  ' & ' + ' & '.join(escape(col['label']) for col in self.columns) + ' \\\\',
+                  '\\midrule']
+        for var, coefs, ses in zip(variables, coef_cells, se_cells):
+            lines.append(escape(self.var_labels.get(var, var)) + ' & ' +
+                         ' & '.join(coefs) + ' \\\\')
+            lines.append(' & ' + ' & '.join(ses) + ' \\\\')
+        lines.append('\\midrule')
+        for row in self._footer():
+            lines.append(' & '.join(escape(cell) for cell in row) + ' \\\\')
+        lines += ['\\bottomrule', '\\end{tabular}',
+                  f'\\par\\footnotesize {escape(self._note())}', '\\end{table}']
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _latex_stars(cell):
+        stripped = cell.rstrip('*')
+        n_stars = len(cell) - len(stripped)
+        return stripped + (f'$^{{{"*" * n_stars}}}$' if n_stars else '')
+
+    def to_markdown(self):
+        """Markdown 表格 (标准误单独一行)"""
+        table = self.to_frame(stacked=True)
+        headers = ['变量'] + [f'({j + 1}) {col["label"]}' for j, col in enumerate(self.columns)]
+        escape = lambda text: str(text).replace('*', '\\*').replace('|', '\\|')
+        lines = ['| ' + ' | '.join(headers) + ' |',
+                 '|' + '---|' + ':---:|' * len(self.columns)]
+        for row in table.itertuples(index=False):
+            lines.append('| ' + ' | '.join(escape(cell) for cell in row) + ' |')
+        lines.append('')
+        lines.append(escape(self._note()))
+        return '\n'.join(lines)
+
+    def save(self, stem):
+        """同时保存 Excel / LaTeX / Markdown 三种格式"""
+        self.to_excel(f'{stem}.xlsx')
+        with open(f'{stem}.tex', 'w', encoding='utf-8') as f:
+            f.write(self.to_latex(caption=stem))
+        with open(f'{stem}.md', 'w', encoding='utf-8') as f:
+            f.write(self.to_markdown())
+        print(f'[OK] LaTeX / Markdown 表格已保存: {stem}.tex, {stem}.md')
+
+
+def main():
+    """
+    主函数: 由结果库中的全部模型生成回归结果表
+    """
+    from result_store import ResultStore
+
+    print('[OK] === 从结果库生成回归结果表 ===')
+    with ResultStore() as store:
+        results = store.query()
+        if not results:
+            print('[WARNING] 结果库为空, 请先运行 result_store.py 或其他估计脚本')
+            return None
+        table = RegressionTable(results)
+
+    print(f'[OK] 共 {len(table.columns)} 个模型')
+    print('\n' + table.to_markdown())
+    table.save('回归结果表_结果库')
+    return table
+
+
+if __name__ == '__main__':
+    table = main()
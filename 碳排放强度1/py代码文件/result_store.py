@@ -0,0 +1,363 @@
+"""
+模型结果持久化存储 (SQLite)
+
+回归结果不再只存在于 基准回归结果表.xlsx、PSM-DID回归结果*.xlsx 等输出文件中:
+- 每个模型记录系数向量、方差协方差矩阵、样本量、R2 及设定信息
+- 主键 = 模型设定 (JSON) 的哈希 + 输入数据 (所用列) 的哈希 + 估计函数标识
+  (模块.函数名、所在模块源码的哈希与 CACHE_VERSION); 估计代码修改后旧结果不再命中
+- 设定和数据都未变化时, 估计函数直接返回已存储的结果, 不重新估计
+- 制表脚本只从结果库读取, 生成论文表格不会触发任何估计
+
+用法示例:
+    from result_store import ResultStore, cached_twfe
+    store = ResultStore()
+    res = cached_twfe(store, df, 'ln_carbon_intensity', ['did'] + controls,
+                      label='基准回归')
+    store.query(label='基准回归')
+
+Created: 2026-10-19
+"""
+
+import hashlib
+import inspect
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from panel_regression import twfe_from_frame
+
+DEFAULT_STORE = '模型结果库.sqlite'
+
+# 结果口径变化 (如小样本校正、自由度) 但估计模块源码未变时手动递增
+CACHE_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key          TEXT PRIMARY KEY,
+    model        TEXT NOT NULL,
+    label        TEXT,
+    spec         TEXT NOT NULL,
+    data_hash    TEXT NOT NULL,
+    var_names    TEXT NOT NULL,
+    coefficients BLOB NOT NULL,
+    std_errors   BLOB NOT NULL,
+    vcov         BLOB NOT NULL,
+    n_obs        INTEGER,
+    n_clusters   INTEGER,
+    n_vars       INTEGER,
+    r2           REAL,
+    adj_r2       REAL,
+    elapsed      REAL,
+    created      TEXT,
+    extra        TEXT
+)
+"""
+
+
+def data_fingerprint(df, columns=None):
+    """
+    输入数据的哈希 (只对所用列计算, 其他列变化不影响结果复用)
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        输入数据
+    columns : list, optional
+        参与估计的列 (默认全部列)
+    """
+    columns = list(df.columns) if columns is None else list(dict.fromkeys(columns))
+    digest = hashlib.sha256()
+    digest.update(json.dumps(columns, ensure_ascii=False).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def estimator_fingerprint(func):
+    """
+    估计函数标识: 模块.函数名 + 所在模块源码的哈希 + CACHE_VERSION
+
+    Parameters:
+    -----------
+    func : callable
+        实际执行估计的函数 (不是外层的 lambda)
+    """
+    module = inspect.getmodule(func)
+    try:
+        source = inspect.getsource(module)
+    except (OSError, TypeError):
+        source = ''
+    digest = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return f'{func.__module__}.{func.__qualname__}@{digest}|v{CACHE_VERSION}'
+
+
+def spec_key(spec, data_hash, estimator_id=''):
+    """由模型设定、数据哈希与估计函数标识生成主键"""
+    payload = json.dumps(spec, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(f'{payload}|{data_hash}|{estimator_id}'.encode('utf-8')).hexdigest()
+
+
+def _to_blob(array):
+    return np.ascontiguousarray(array, dtype=np.float64).tobytes()
+
+
+def _from_blob(blob, shape=None):
+    array = np.frombuffer(blob, dtype=np.float64).copy()
+    return array if shape is None else array.reshape(shape)
+
+
+class ResultStore:
+    """
+    SQLite 模型结果库
+    """
+
+    def __init__(self, path=DEFAULT_STORE):
+        """
+        Parameters:
+        -----------
+        path : str
+            数据库文件路径
+        """
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def __contains__(self, key):
+        row = self.conn.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+    def put(self, key, model, spec, data_hash, result, label=None, elapsed=None,
+            extra=None):
+        """
+        写入一个模型结果 (同一主键覆盖)
+
+        Parameters:
+        -----------
+        result : dict
+            估计结果 (需包含 coefficients, std_errors, vcov, var_names, n_obs)
+        """
+        k = len(result['coefficients'])
+        self.conn.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, model, label,
+             json.dumps(spec, ensure_ascii=False, sort_keys=True, default=str),
+             data_hash,
+             json.dumps(list(result['var_names']), ensure_ascii=False),
+             _to_blob(result['coefficients']),
+             _to_blob(result['std_errors']),
+             _to_blob(np.asarray(result['vcov']).reshape(k, k)),
+             int(result['n_obs']),
+             None if result.get('n_clusters') is None else int(result['n_clusters']),
+             None if result.get('n_vars') is None else int(result['n_vars']),
+             None if result.get('r2') is None else float(result['r2']),
+             None if result.get('adj_r2') is None else float(result['adj_r2']),
+             elapsed,
+             datetime.now().isoformat(timespec='seconds'),
+             json.dumps(extra or {}, ensure_ascii=False, default=str)))
+        self.conn.commit()
+
+    def _row_to_result(self, row):
+        (key, model, label, spec, data_hash, var_names, coefficients, std_errors, vcov,
+         n_obs, n_clusters, n_vars, r2, adj_r2, elapsed, created, extra) = row
+        var_names = json.loads(var_names)
+        k = len(var_names)
+        return {
+            'key': key,
+            'model': model,
+            'label': label,
+            'spec': json.loads(spec),
+            'data_hash': data_hash,
+            'var_names': var_names,
+            'coefficients': _from_blob(coefficients),
+            'std_errors': _from_blob(std_errors),
+            'vcov': _from_blob(vcov, (k, k)),
+            'n_obs': n_obs,
+            'n_clusters': n_clusters,
+            'n_vars': n_vars,
+            'r2': r2,
+            'adj_r2': adj_r2,
+            'elapsed': elapsed,
+            'created': created,
+            'extra': json.loads(extra) if extra else {},
+        }
+
+    def get(self, key):
+        """按主键读取结果 (不存在时返回 None)"""
+        row = self.conn.execute('SELECT * FROM results WHERE key = ?', (key,)).fetchone()
+        return None if row is None else self._row_to_result(row)
+
+    def load(self, keys):
+        """按主键列表读取结果 (保持顺序)"""
+        results = [self.get(key) for key in keys]
+        missing = [key for key, res in zip(keys, results) if res is None]
+        if missing:
+            raise KeyError(f'结果库中不存在以下主键: {missing}')
+        return results
+
+    def query(self, model=None, label=None):
+        """
+        按模型类型 / 标签检索结果
+
+        Parameters:
+        -----------
+        model : str, optional
+            模型类型 (如 'twfe')
+        label : str, optional
+            标签; 以 % 结尾时按前缀匹配
+
+        Returns:
+        --------
+        list of dict : 按写入时间排序
+        """
+        sql, params = 'SELECT * FROM results WHERE 1 = 1', []
+        if model is not None:
+            sql += ' AND model = ?'
+            params.append(model)
+        if label is not None:
+            sql += ' AND label LIKE ?' if label.endswith('%') else ' AND label = ?'
+            params.append(label)
+        sql += ' ORDER BY created, rowid'
+        return [self._row_to_result(row) for row in self.conn.execute(sql, params)]
+
+    def delete(self, key):
+        self.conn.execute('DELETE FROM results WHERE key = ?', (key,))
+        self.conn.commit()
+
+    def catalog(self):
+        """结果库目录 (每个模型一行)"""
+        return pd.read_sql_query(
+            'SELECT key, model, label, n_obs, n_clusters, r2, elapsed, created '
+            'FROM results ORDER BY created, rowid', self.conn)
+
+    def coefficient_table(self, results=None):
+        """长格式系数表 (标签 × 变量)"""
+        results = self.query() if results is None else results
+        rows = []
+        for res in results:
+            for name, coef, se in zip(res['var_names'], res['coefficients'], res['std_errors']):
+                rows.append({'标签': res['label'], '变量': name, '系数': coef, '标准误': se,
+                             '样本量': res['n_obs'], 'R2': res['r2'], '主键': res['key']})
+        return pd.DataFrame(rows)
+
+    # ------------------------------------------------------------------
+    # 缓存估计
+    # ------------------------------------------------------------------
+    def cached(self, model, spec, df, columns, estimator, label=None, extra=None,
+               source=None):
+        """
+        通用缓存估计: 设定与数据未变化时直接返回已存储结果
+
+        Parameters:
+        -----------
+        model : str
+            模型类型
+        spec : dict
+            完整模型设定 (可 JSON 序列化)
+        df : pd.DataFrame
+            输入数据
+        columns : list
+            估计用到的列 (用于计算数据哈希)
+        estimator : callable
+            无参数函数, 返回估计结果 dict
+        source : callable, optional
+            estimator 实际调用的估计函数, 其标识进入主键 (缺省用 estimator 本身)
+
+        Returns:
+        --------
+        dict : 估计结果, 'cached' 表示是否来自结果库
+        """
+        data_hash = data_fingerprint(df, columns)
+        key = spec_key({'model': model, **spec}, data_hash,
+                       estimator_fingerprint(estimator if source is None else source))
+        stored = self.get(key)
+        if stored is not None:
+            if label is not None and stored['label'] != label:
+                self.conn.execute('UPDATE results SET label = ? WHERE key = ?', (label, key))
+                self.conn.commit()
+                stored['label'] = label
+            stored['cached'] = True
+            return stored
+
+        start = time.perf_counter()
+        result = estimator()
+        elapsed = time.perf_counter() - start
+        self.put(key, model, spec, data_hash, result, label=label, elapsed=elapsed,
+                 extra=extra)
+        stored = self.get(key)
+        stored['cached'] = False
+        return stored
+
+
+def cached_twfe(store, df, y_var, x_vars, entity_var='city_name', time_var='year',
+                cluster_var='city_name', label=None, extra=None):
+    """
+    带缓存的双向固定效应回归 (参数同 panel_regression.twfe_from_frame)
+
+    Returns:
+    --------
+    dict : 估计结果 (含 key, cached)
+    """
+    x_vars = list(x_vars)
+    spec = {'y_var': y_var, 'x_vars': x_vars, 'entity_var': entity_var,
+            'time_var': time_var, 'cluster_var': cluster_var,
+            'fixed_effects': [entity_var, time_var]}
+    columns = [y_var] + x_vars + [entity_var, time_var]
+    if cluster_var is not None:
+        columns.append(cluster_var)
+    extra = {'fixed_effects': ['城市', '年份'], **(extra or {})}
+    return store.cached('twfe', spec, df, columns,
+                        lambda: twfe_from_frame(df, y_var, x_vars, entity_var=entity_var,
+                                                time_var=time_var, cluster_var=cluster_var),
+                        label=label, extra=extra, source=twfe_from_frame)
+
+
+def main():
+    """
+    主函数: 估计基准回归及控制变量替换模型并存入结果库
+    """
+    print('[OK] === 模型结果库 ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    models = {
+        '基准回归': ['did', 'ln_pgdp', 'ln_pop_density', 'tertiary_share', 'ln_fdi',
+                  'ln_road_area'],
+        '产业高级化+外商投资水平': ['did', 'ln_pgdp', 'ln_pop_density', 'industrial_advanced',
+                           'fdi_openness', 'ln_road_area'],
+        '仅人均GDP': ['did', 'ln_pgdp'],
+    }
+
+    with ResultStore() as store:
+        for label, x_vars in models.items():
+            start = time.perf_counter()
+            res = cached_twfe(store, df, 'ln_carbon_intensity', x_vars, label=label)
+            source = '结果库' if res['cached'] else '重新估计'
+            print(f'[OK] {label}: DID={res["coefficients"][0]:.4f} '
+                  f'(SE={res["std_errors"][0]:.4f}), N={res["n_obs"]}, '
+                  f'{source}, 耗时 {(time.perf_counter() - start) * 1000:.1f}ms')
+
+        print(f'\n[INFO] 结果库共 {len(store)} 个模型: {store.path}')
+        print(store.catalog()[['label', 'n_obs', 'r2', 'created']].to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
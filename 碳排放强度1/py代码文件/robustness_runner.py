@@ -0,0 +1,326 @@
+"""
+多进程稳健性检验批量运行器
+
+一次命令完成整轮稳健性检验, 替代逐个运行 did_baseline_regression.py、
+psm_did_regression_*.py 等脚本 (每个脚本单线程、各自重复读取 Excel):
+
+1. 稳健性方案 (ROBUSTNESS_PLAN) 按以下维度展开为独立任务 (笛卡尔积):
+   - 控制变量组合
+   - 样本区间
+   - 是否缩尾 (1%/99%)
+   - 被解释变量来源 (原始碳排放强度 / CEADs 碳排放强度)
+   - PSM 方案 (无匹配 / 不同卡尺)
+2. 面板数据只读取一次, 数值列放入共享内存 (multiprocessing.shared_memory),
+   各工作进程直接映射, 不复制、不重新读取 Excel
+3. 任务在进程池中并行执行, 每个任务记录耗时
+4. 全部结果汇总到一个工作簿 (稳健性检验汇总.xlsx)
+
+Created: 2026-10-19
+"""
+
+import contextlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from panel_regression import twfe_from_frame
+from panel_winsorize import Winsorizer
+
+# ============================================================================
+# 稳健性方案
+# ============================================================================
+ROBUSTNESS_PLAN = {
+    'data_file': '总数据集_2007-2023_最终回归版.xlsx',
+    'ceads_file': '使用CEADs数据/CEADs_最终数据集_2007-2019_V2.xlsx',
+    'treatment': 'did',
+    'outcomes': {
+        '原始碳排放强度': 'ln_carbon_intensity',
+        'CEADs碳排放强度': 'ln_carbon_intensity_ceads',
+    },
+    'controls': {
+        '基准控制(三产占比+FDI)': ['ln_pgdp', 'ln_pop_density', 'tertiary_share',
+                                  'ln_fdi', 'ln_road_area'],
+        '产业高级化+外商投资水平': ['ln_pgdp', 'ln_pop_density', 'industrial_advanced',
+                                  'fdi_openness', 'ln_road_area'],
+        '产业高级化+金融发展': ['ln_pgdp', 'ln_pop_density', 'industrial_advanced',
+                              'ln_road_area', 'financial_development'],
+        '仅人均GDP': ['ln_pgdp'],
+    },
+    'windows': {
+        '2007-2023': (2007, 2023),
+        '2007-2019': (2007, 2019),
+    },
+    'winsorize': [False, True],
+    'psm': {
+        '无匹配': None,
+        'PSM卡尺0.02': {'caliper': 0.02},
+        'PSM卡尺0.05': {'caliper': 0.05},
+    },
+}
+
+
+def expand_plan(plan):
+    """
+    把稳健性方案展开为任务列表
+
+    Returns:
+    --------
+    list of dict : 每个任务的完整设定
+    """
+    jobs = []
+    grid = itertools.product(plan['outcomes'].items(), plan['controls'].items(),
+                             plan['windows'].items(), plan['winsorize'],
+                             plan['psm'].items())
+    for (outcome_label, outcome), (control_label, controls), (window_label, window), \
+            winsorize, (psm_label, psm) in grid:
+        jobs.append({
+            '任务编号': len(jobs) + 1,
+            '被解释变量': outcome_label,
+            '控制变量组合': control_label,
+            '样本区间': window_label,
+            '缩尾': '是' if winsorize else '否',
+            'PSM': psm_label,
+            'y_var': outcome,
+            'treatment': plan['treatment'],
+            'controls': list(controls),
+            'window': tuple(window),
+            'winsorize': winsorize,
+            'psm': psm,
+        })
+    return jobs
+
+
+# ============================================================================
+# 共享内存面板
+# ============================================================================
+_WORKER = {}
+
+
+CEADS_COLUMNS = ['ln_carbon_intensity_ceads']
+
+
+def load_panel(plan):
+    """
+    读取面板数据 (含可选的 CEADs 被解释变量)
+
+    配置了 ceads_file 但文件不存在时发出警告, 并在 df.attrs['missing_inputs'] 中记录
+    {列名: 文件路径}, 用到这些列的任务标记为 "跳过: 输入文件不存在" 而不是 "缺少变量"。
+    """
+    df = pd.read_excel(plan['data_file'])
+    missing_inputs = {}
+    ceads_file = plan.get('ceads_file')
+    if ceads_file:
+        if os.path.exists(ceads_file):
+            ceads = pd.read_excel(ceads_file)[['city_name', 'year'] + CEADS_COLUMNS]
+            df = df.merge(ceads, on=['city_name', 'year'], how='left')
+        else:
+            print(f'[WARNING] CEADs 数据文件不存在: {os.path.abspath(ceads_file)}; '
+                  f'以 {CEADS_COLUMNS} 为被解释变量的任务将被跳过 (请检查工作目录或文件位置)')
+            missing_inputs.update({col: ceads_file for col in CEADS_COLUMNS})
+    df.attrs['missing_inputs'] = missing_inputs
+    return df
+
+
+def share_panel(df, columns):
+    """
+    把面板数值列复制到共享内存
+
+    Returns:
+    --------
+    shm : SharedMemory
+        共享内存块 (调用方负责 close/unlink)
+    meta : dict
+        工作进程映射共享内存所需的信息
+    """
+    columns = [col for col in dict.fromkeys(columns) if col in df.columns]
+    block = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    shm = shared_memory.SharedMemory(create=True, size=max(block.nbytes, 1))
+    shared = np.ndarray(block.shape, dtype=np.float64, buffer=shm.buf)
+    shared[:] = block
+    meta = {
+        'shm_name': shm.name,
+        'shape': block.shape,
+        'columns': columns,
+        'city_name': df['city_name'].to_numpy(dtype=object),
+        'missing_inputs': dict(df.attrs.get('missing_inputs', {})),
+    }
+    return shm, meta
+
+
+def _init_worker(meta):
+    """工作进程初始化: 映射共享内存 (只读)"""
+    shm = shared_memory.SharedMemory(name=meta['shm_name'])
+    block = np.ndarray(meta['shape'], dtype=np.float64, buffer=shm.buf)
+    block.flags.writeable = False
+    _WORKER['shm'] = shm
+    _WORKER['block'] = block
+    _WORKER['index'] = {col: i for i, col in enumerate(meta['columns'])}
+    _WORKER['city_name'] = meta['city_name']
+    _WORKER['missing_inputs'] = meta['missing_inputs']
+
+
+def _worker_frame(columns):
+    """从共享内存取出任务需要的列"""
+    index = _WORKER['index']
+    data = {'city_name': _WORKER['city_name']}
+    for col in dict.fromkeys(columns):
+        data[col] = _WORKER['block'][:, index[col]]
+    return pd.DataFrame(data)
+
+
+# ============================================================================
+# 单个任务
+# ============================================================================
+def run_job(job):
+    """
+    执行一个稳健性检验任务
+
+    Returns:
+    --------
+    dict : 任务设定 + DID系数、聚类标准误、p值、样本量、R2、耗时
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    labels = {k: v for k, v in job.items()
+              if k in ('任务编号', '被解释变量', '控制变量组合', '样本区间', '缩尾', 'PSM')}
+
+    needed = ['year', 'treat', job['y_var'], job['treatment']] + job['controls']
+    skipped_files = sorted({_WORKER['missing_inputs'][col] for col in needed
+                            if col in _WORKER['missing_inputs']})
+    if skipped_files:
+        return {**labels, '状态': f'跳过: 输入文件不存在 {skipped_files}'}
+    missing = [col for col in needed if col not in _WORKER['index']]
+    if missing:
+        return {**labels, '状态': f'缺少变量: {missing}'}
+
+    df = _worker_frame(needed)
+    low, high = job['window']
+    df = df[(df['year'] >= low) & (df['year'] <= high)]
+    df = df.dropna(subset=[job['y_var'], job['treatment'], 'treat'])
+
+    if job['winsorize']:
+        continuous = [job['y_var']] + job['controls']
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = Winsorizer(continuous).fit_transform(df)
+
+    if job['psm'] is not None:
+        from propensity_score_matching import PropensityScoreMatcher
+        matcher = PropensityScoreMatcher(df.reset_index(drop=True), covariates=job['controls'],
+                                         caliper=job['psm']['caliper'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            matcher.handle_missing_values()
+            matcher.estimate_propensity_scores()
+            matcher.perform_matching()
+        df = matcher.matched_data
+
+    x_vars = [job['treatment']] + job['controls']
+    try:
+        res = twfe_from_frame(df, job['y_var'], x_vars)
+    except np.linalg.LinAlgError as exc:
+        return {**labels, '状态': f'估计失败: {exc}'}
+
+    return {
+        **labels,
+        '状态': 'OK',
+        'DID系数': res['coefficients'][0],
+        '聚类标准误': res['std_errors'][0],
+        't值': res['t_stats'][0],
+        'p值': res['p_values'][0],
+        '样本量': res['n_obs'],
+        '城市数': res['n_clusters'],
+        'R2': res['r2'],
+        '耗时(秒)': time.perf_counter() - start_wall,
+        'CPU时间(秒)': time.process_time() - start_cpu,
+        '进程号': os.getpid(),
+    }
+
+
+def run_battery(plan=ROBUSTNESS_PLAN, n_jobs=None, df=None):
+    """
+    展开方案并在进程池中运行全部任务
+
+    Parameters:
+    -----------
+    plan : dict
+        稳健性方案
+    n_jobs : int, optional
+        进程数 (默认 CPU 核数); 1 表示在当前进程串行执行
+    df : pd.DataFrame, optional
+        已加载的面板数据 (默认按 plan['data_file'] 读取)
+
+    Returns:
+    --------
+    pd.DataFrame : 每个任务一行的结果汇总
+    """
+    jobs = expand_plan(plan)
+    if df is None:
+        df = load_panel(plan)
+    columns = ['year', 'treat', plan['treatment']] + list(plan['outcomes'].values())
+    for controls in plan['controls'].values():
+        columns += controls
+
+    print(f'[INFO] 稳健性任务数: {len(jobs)}, 并行进程数: {n_jobs or os.cpu_count()}')
+    shm, meta = share_panel(df, columns)
+    start = time.perf_counter()
+    try:
+        if n_jobs == 1:
+            _init_worker(meta)
+            results = [run_job(job) for job in jobs]
+            _WORKER['shm'].close()
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(meta,)) as pool:
+                results = list(pool.map(run_job, jobs))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    print(f'[OK] 全部任务完成, 总耗时: {time.perf_counter() - start:.2f}s')
+    return pd.DataFrame(results)
+
+
+def save_battery(results, output_file='稳健性检验汇总.xlsx'):
+    """把全部任务结果写入一个工作簿"""
+    ok = results[results['状态'] == 'OK']
+    timing_cols = ['任务编号', '被解释变量', '控制变量组合', '样本区间', '缩尾', 'PSM',
+                   '耗时(秒)', 'CPU时间(秒)', '进程号']
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        results.drop(columns=[c for c in ('CPU时间(秒)', '进程号') if c in results.columns]) \
+            .to_excel(writer, sheet_name='汇总', index=False)
+        if len(ok) > 0:
+            pivot = ok.pivot_table(index=['被解释变量', '控制变量组合', 'PSM'],
+                                   columns=['样本区间', '缩尾'], values='DID系数')
+            pivot.to_excel(writer, sheet_name='DID系数对比')
+            ok[timing_cols].to_excel(writer, sheet_name='任务耗时', index=False)
+    print(f'[OK] 稳健性检验汇总已保存: {output_file}')
+
+
+def main():
+    """
+    主函数: 运行默认稳健性方案
+    """
+    print('[OK] === 多进程稳健性检验批量运行 ===')
+    results = run_battery(ROBUSTNESS_PLAN)
+
+    ok = results[results['状态'] == 'OK']
+    print(f'\n[INFO] 成功任务: {len(ok)}/{len(results)}')
+    skipped = results['状态'].str.startswith('跳过')
+    if skipped.any():
+        print(f'[WARNING] {skipped.sum()} 个任务因输入文件不存在被跳过')
+    if len(ok) > 0:
+        print(f'[INFO] DID系数范围: [{ok["DID系数"].min():.4f}, {ok["DID系数"].max():.4f}]')
+        print(f'[INFO] p<0.1 的任务数: {(ok["p值"] < 0.1).sum()}')
+        print(f'[INFO] 单任务平均耗时: {ok["耗时(秒)"].mean():.3f}s')
+
+    save_battery(results)
+    return results
+
+
+if __name__ == '__main__':
+    results = main()
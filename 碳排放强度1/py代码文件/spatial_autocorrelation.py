@@ -0,0 +1,287 @@
+"""
+空间自相关检验: 全局 Moran's I、Geary's C 与局部 LISA (逐年)
+
+对 ln_carbon_intensity 与双向固定效应DID残差逐年计算:
+- 全局 Moran's I、Geary's C 及其置换检验 p 值
+- 局部 Moran's I (LISA), 条件置换检验 p 值与 HH/LL/HL/LH 聚类类型
+
+置换推断以矩阵批量完成: 一批置换 (n × B) 的空间滞后是一次稀疏矩阵乘积 W @ Z[Π],
+全局统计量按列求和; LISA 的条件置换在同一乘积上修正 —— 若城市 i 自身的值被置换到
+其邻居位置, 则与 i 所在位置的值交换, 得到固定 i 的均匀置换。
+
+聚类图: 当前目录存在 城市经纬度.xlsx 时按经纬度绘制逐年点图, 否则绘制 城市×年份 聚类热力图
+(城市按省级代码排序)。
+
+Created: 2026-10-19
+"""
+
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.colors import ListedColormap
+
+from panel_regression import twfe_from_frame
+from spatial_weights import SpatialWeights
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+CONTROL_VARS = ['ln_pgdp', 'ln_pop_density', 'tertiary_share', 'ln_fdi', 'ln_road_area']
+CLUSTER_LABELS = ['不显著', 'HH', 'LH', 'LL', 'HL']
+CLUSTER_COLORS = ['#eeeeee', '#d7191c', '#abd9e9', '#2c7bb6', '#fdae61']
+
+
+def _pseudo_p(observed, simulated):
+    """单侧置换 p 值 (取观测值所在一侧的尾部)"""
+    larger = (simulated >= observed[..., None]).sum(axis=-1)
+    n_perm = simulated.shape[-1]
+    larger = np.where(larger > n_perm / 2, n_perm - larger, larger)
+    return (larger + 1) / (n_perm + 1)
+
+
+class SpatialAutocorrelation:
+    """
+    单个截面的全局/局部空间自相关及批量置换推断
+    """
+
+    def __init__(self, values, W):
+        """
+        Parameters:
+        -----------
+        values : array-like
+            (n,) 截面变量
+        W : sparse matrix
+            (n × n) 行标准化权重
+        """
+        self.x = np.asarray(values, dtype=np.float64)
+        self.W = W.tocsr()
+        self.n = len(self.x)
+        self.z = self.x - self.x.mean()
+        self.m2 = self.z @ self.z / self.n
+        self.s0 = self.W.sum()
+        self.row_col = np.asarray(self.W.sum(axis=1)).ravel() + np.asarray(self.W.sum(axis=0)).ravel()
+        coo = self.W.tocoo()
+        self._keys = coo.row.astype(np.int64) * self.n + coo.col
+        order = np.argsort(self._keys)
+        self._keys, self._vals = self._keys[order], coo.data[order]
+
+    def _weight_lookup(self, rows, cols):
+        """稀疏权重的批量元素查找 w[rows, cols]"""
+        keys = rows.astype(np.int64) * self.n + cols
+        pos = np.clip(np.searchsorted(self._keys, keys), 0, len(self._keys) - 1)
+        return np.where(self._keys[pos] == keys, self._vals[pos], 0.0)
+
+    def _global(self, Z, lag):
+        """按列计算 Moran's I 与 Geary's C"""
+        cross = np.einsum('ij,ij->j', Z, lag)
+        moran = self.n / self.s0 * cross / (self.n * self.m2)
+        squared = self.row_col @ (Z ** 2) - 2 * cross
+        geary = (self.n - 1) * squared / (2 * self.s0 * self.n * self.m2)
+        return moran, geary
+
+    def run(self, n_perm=9999, batch_size=1000, seed=0):
+        """
+        计算统计量与置换 p 值
+
+        Returns:
+        --------
+        global_stats : dict
+            Moran's I、Geary's C、期望值、正态近似z值与置换p值
+        local : pd.DataFrame
+            每个单元的 LISA、空间滞后、条件置换p值
+        """
+        rng = np.random.default_rng(seed)
+        lag = self.W @ self.z
+        moran, geary = self._global(self.z[:, None], lag[:, None])
+        local_i = self.z * lag / self.m2
+
+        moran_sim, geary_sim, local_sim = [], [], []
+        rows = np.arange(self.n)[:, None]
+        for start in range(0, n_perm, batch_size):
+            B = min(batch_size, n_perm - start)
+            perm = np.argsort(rng.random((self.n, B)), axis=0)
+            Zp = self.z[perm]
+            lag_p = self.W @ Zp
+            m, g = self._global(Zp, lag_p)
+            moran_sim.append(m)
+            geary_sim.append(g)
+
+            # 条件置换: i 的值所在位置 s 若是 i 的邻居, 换成位置 i 上的值
+            slot = np.argsort(perm, axis=0)
+            w_own = self._weight_lookup(np.broadcast_to(rows, slot.shape), slot)
+            lag_c = lag_p + w_own * (Zp - self.z[:, None])
+            local_sim.append(self.z[:, None] * lag_c / self.m2)
+
+        moran_sim = np.concatenate(moran_sim)
+        geary_sim = np.concatenate(geary_sim)
+        local_sim = np.concatenate(local_sim, axis=1)
+
+        expected = -1 / (self.n - 1)
+        global_stats = {
+            "Moran's I": moran[0],
+            'E[I]': expected,
+            'I_z值': (moran[0] - moran_sim.mean()) / moran_sim.std(ddof=1),
+            'I_置换p值': float(_pseudo_p(moran, moran_sim[None, :])[0]),
+            "Geary's C": geary[0],
+            'C_z值': (geary[0] - geary_sim.mean()) / geary_sim.std(ddof=1),
+            'C_置换p值': float(_pseudo_p(geary, geary_sim[None, :])[0]),
+            '置换次数': n_perm,
+        }
+        spread = local_sim.std(axis=1, ddof=1)
+        local = pd.DataFrame({
+            'LISA': local_i,
+            '标准化值': self.z / np.sqrt(self.m2),
+            '空间滞后': lag / np.sqrt(self.m2),
+            'LISA_z值': np.divide(local_i - local_sim.mean(axis=1), spread,
+                                 out=np.full(self.n, np.nan), where=spread > 0),
+            '置换p值': _pseudo_p(local_i, local_sim),
+        })
+        return global_stats, local
+
+
+def classify_clusters(local, alpha=0.05):
+    """LISA 聚类类型: HH / LH / LL / HL (不显著者为 '不显著')"""
+    high, high_lag = local['标准化值'] > 0, local['空间滞后'] > 0
+    quadrant = np.select([high & high_lag, ~high & high_lag, ~high & ~high_lag],
+                         ['HH', 'LH', 'LL'], default='HL')
+    return np.where(local['置换p值'] < alpha, quadrant, '不显著')
+
+
+def yearly_autocorrelation(df, value_var, weights, entity_var='city_name', time_var='year',
+                           n_perm=9999, seed=2026, alpha=0.05):
+    """
+    逐年计算空间自相关
+
+    Returns:
+    --------
+    global_table : pd.DataFrame
+        年份 × 全局统计量
+    local_table : pd.DataFrame
+        城市-年份 × LISA 结果
+    """
+    data = df.dropna(subset=[value_var])
+    data = data[data[entity_var].isin(weights.ids)]
+    global_rows, local_frames = [], []
+    for year, group in data.groupby(time_var, sort=True):
+        group = group.drop_duplicates(entity_var)
+        W = weights.panel_matrix(group[entity_var], np.zeros(len(group)))
+        if W.nnz == 0 or len(group) < 3:
+            continue
+        stats_, local = SpatialAutocorrelation(group[value_var], W).run(
+            n_perm=n_perm, seed=seed + int(year))
+        global_rows.append({'年份': year, '城市数': len(group), **stats_})
+        local.insert(0, time_var, year)
+        local.insert(0, entity_var, group[entity_var].to_numpy())
+        local['聚类类型'] = classify_clusters(local, alpha)
+        local_frames.append(local)
+    return pd.DataFrame(global_rows), pd.concat(local_frames, ignore_index=True)
+
+
+def did_residuals(df, y_var='ln_carbon_intensity', controls=None):
+    """双向固定效应DID残差 (附在样本行上)"""
+    controls = CONTROL_VARS if controls is None else list(controls)
+    x_vars = ['did'] + controls
+    sample = df.dropna(subset=[y_var] + x_vars).copy()
+    sample['DID残差'] = twfe_from_frame(sample, y_var, x_vars)['residuals']
+    return sample
+
+
+def plot_cluster_map(local, title, output_file, coords=None, entity_var='city_name',
+                     time_var='year', order=None):
+    """
+    LISA 聚类图
+
+    Parameters:
+    -----------
+    coords : pd.DataFrame, optional
+        经纬度表 (city_name, lon, lat); 提供时绘制逐年点图, 否则绘制 城市×年份 热力图
+    order : list, optional
+        热力图中城市的排列顺序
+    """
+    cmap = ListedColormap(CLUSTER_COLORS)
+    codes = local['聚类类型'].map({c: i for i, c in enumerate(CLUSTER_LABELS)})
+    years = sorted(local[time_var].unique())
+
+    if coords is not None:
+        merged = local.assign(code=codes).merge(coords, on=entity_var, how='inner')
+        ncols = 6
+        nrows = int(np.ceil(len(years) / ncols))
+        fig, axes = plt.subplots(nrows, ncols, figsize=(3.2 * ncols, 2.8 * nrows), squeeze=False)
+        for ax, year in zip(axes.ravel(), years):
+            part = merged[merged[time_var] == year]
+            ax.scatter(part['lon'], part['lat'], c=part['code'], cmap=cmap, vmin=-0.5,
+                       vmax=len(CLUSTER_LABELS) - 0.5, s=12, edgecolors='none')
+            ax.set_title(str(year), fontsize=10)
+            ax.set_xticks([])
+            ax.set_yticks([])
+        for ax in axes.ravel()[len(years):]:
+            ax.axis('off')
+    else:
+        grid = local.assign(code=codes).pivot_table(index=entity_var, columns=time_var,
+                                                    values='code', aggfunc='first')
+        if order is not None:
+            grid = grid.reindex([c for c in order if c in grid.index])
+        fig, ax = plt.subplots(figsize=(10, max(6, len(grid) * 0.04)))
+        ax.imshow(grid.to_numpy(dtype=float), aspect='auto', cmap=cmap, vmin=-0.5,
+                  vmax=len(CLUSTER_LABELS) - 0.5, interpolation='nearest')
+        ax.set_xticks(range(len(grid.columns)))
+        ax.set_xticklabels(grid.columns, rotation=45, fontsize=8)
+        ax.set_yticks([])
+        ax.set_ylabel('城市 (按省级代码排序)')
+
+    handles = [plt.Rectangle((0, 0), 1, 1, color=c) for c in CLUSTER_COLORS]
+    fig.legend(handles, CLUSTER_LABELS, loc='lower center', ncol=len(CLUSTER_LABELS),
+               fontsize=9, frameon=False)
+    fig.suptitle(title, fontsize=13, fontweight='bold')
+    plt.tight_layout(rect=(0, 0.04, 1, 0.96))
+    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    plt.close()
+    print(f'[OK] 聚类图已保存: {output_file}')
+
+
+def main(n_perm=9999):
+    """
+    主函数: ln_carbon_intensity 与 DID 残差的逐年空间自相关
+    """
+    print("[OK] === 空间自相关: Moran's I / Geary's C / LISA ===")
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    weights = SpatialWeights.from_province(df)
+    coords = pd.read_excel('城市经纬度.xlsx') if os.path.exists('城市经纬度.xlsx') else None
+    if coords is not None:
+        weights = SpatialWeights.from_coordinates(coords, cutoff_km=500)
+    print(f'[INFO] 空间权重: {weights.summary()}')
+
+    order = df.dropna(subset=['city_code']).drop_duplicates('city_name') \
+        .sort_values('city_code')['city_name'].tolist()
+    targets = {
+        'ln_carbon_intensity': df,
+        'DID残差': did_residuals(df),
+    }
+
+    output_file = '空间自相关检验结果.xlsx'
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        for k, (var, data) in enumerate(targets.items()):
+            global_table, local_table = yearly_autocorrelation(data, var, weights, n_perm=n_perm)
+            print(f'\n[INFO] {var} 全局空间自相关:')
+            print(global_table[['年份', '城市数', "Moran's I", 'I_置换p值', "Geary's C",
+                                'C_置换p值']].to_string(index=False,
+                                                      float_format=lambda x: f'{x:.4f}'))
+            counts = local_table.groupby(['year', '聚类类型']).size().unstack(fill_value=0)
+            global_table.to_excel(writer, sheet_name=f'全局_{k + 1}', index=False)
+            local_table.to_excel(writer, sheet_name=f'LISA_{k + 1}', index=False)
+            counts.to_excel(writer, sheet_name=f'聚类计数_{k + 1}')
+            plot_cluster_map(local_table, f'{var} LISA 聚类图 (2007-2023)',
+                             f'LISA聚类图_{k + 1}.png', coords=coords, order=order)
+        pd.DataFrame({'编号': [1, 2], '变量': list(targets)}) \
+            .to_excel(writer, sheet_name='变量说明', index=False)
+    print(f'\n[OK] 空间自相关结果已保存: {output_file}')
+
+
+if __name__ == '__main__':
+    main()
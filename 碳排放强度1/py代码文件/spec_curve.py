@@ -0,0 +1,276 @@
+"""
+设定曲线 (Specification Curve / Multiverse) 分析
+
+枚举全部 控制变量组合 × 样本定义 × 被解释变量来源, 估计每个设定下的DID系数,
+按系数大小排序绘制设定曲线及设定指示面板。
+
+计算方式 (每个设定只是一次小矩阵求解, 不重新回归):
+1. 对每个 (被解释变量, 样本) 组合, 取全部候选变量均不缺失的共同样本,
+   对 [y, did, 全部候选控制变量] 一次性做城市+年份双向去均值
+2. 计算去均值数据的 Gram 矩阵 Z'Z, 以及按城市分组的 Gram 矩阵 Z_g'Z_g
+3. 每个设定: 系数 = (Z_S'Z_S)^{-1} Z_S'y, 取 Gram 矩阵的子块求解;
+   聚类得分 Z_gS'e_g = Z_gS'y_g - Z_gS'Z_gS b 同样由分组 Gram 子块得到,
+   聚类标准误无需回到观测层面
+
+注意: 同一 (被解释变量, 样本) 下的全部设定使用共同样本 (设定曲线分析的常规做法),
+因此与单独运行各回归脚本 (按所选变量删除缺失) 的样本量可能略有差异。
+
+Created: 2026-10-19
+"""
+
+import itertools
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from panel_regression import TwoWayDemeaner
+from robustness_runner import ROBUSTNESS_PLAN, load_panel
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+# ============================================================================
+# 设定空间
+# ============================================================================
+# 每个控制变量维度: 可以不加入, 或加入其中一个备选变量
+CONTROL_SLOTS = {
+    '经济水平': ['ln_pgdp'],
+    '人口集聚': ['ln_pop_density'],
+    '产业结构': ['tertiary_share', 'industrial_advanced', 'industrial_upgrading'],
+    '外资水平': ['ln_fdi', 'fdi_openness'],
+    '基础设施': ['ln_road_area'],
+    '金融发展': ['financial_development'],
+}
+
+OUTCOMES = {
+    '原始碳排放强度': 'ln_carbon_intensity',
+    'CEADs碳排放强度': 'ln_carbon_intensity_ceads',
+}
+
+SAMPLES = {
+    '全样本': {},
+    '2007-2019': {'years': (2007, 2019)},
+    '剔除直辖市': {'exclude': ['北京市', '上海市', '天津市', '重庆市']},
+}
+
+
+def enumerate_controls(slots=CONTROL_SLOTS):
+    """
+    枚举全部控制变量组合
+
+    Returns:
+    --------
+    list of tuple : 每个元素为一组控制变量 (可为空)
+    """
+    options = [[None] + list(variants) for variants in slots.values()]
+    return [tuple(var for var in combo if var is not None)
+            for combo in itertools.product(*options)]
+
+
+def select_sample(df, rule):
+    """按样本定义筛选数据"""
+    mask = np.ones(len(df), dtype=bool)
+    if 'years' in rule:
+        low, high = rule['years']
+        mask &= df['year'].between(low, high).to_numpy()
+    if 'exclude' in rule:
+        mask &= ~df['city_name'].isin(rule['exclude']).to_numpy()
+    return df[mask]
+
+
+class SpecUniverse:
+    """
+    一个 (被解释变量, 样本) 组合下的共享去均值 Gram 矩阵
+    """
+
+    def __init__(self, df, y_var, treatment, candidates, entity_var='city_name',
+                 time_var='year'):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            已筛选的样本
+        y_var : str
+            被解释变量
+        treatment : str
+            核心解释变量 (did)
+        candidates : list
+            全部候选控制变量
+        """
+        columns = [y_var, treatment] + list(candidates)
+        sample = df.dropna(subset=columns)
+        self.columns = columns
+        self.position = {col: i for i, col in enumerate(columns)}
+
+        entity = pd.Categorical(sample[entity_var]).codes
+        time = pd.Categorical(sample[time_var]).codes
+        demeaner = TwoWayDemeaner(entity, time)
+        Z = demeaner.demean(sample[columns].to_numpy(dtype=np.float64))
+
+        self.n_obs = len(sample)
+        self.n_fe = demeaner.n_fe
+        self.n_clusters = demeaner.n_entities
+        self.gram = Z.T @ Z
+        # 城市层面 Gram 矩阵 (G × p × p)
+        self.cluster_gram = np.zeros((demeaner.n_entities, len(columns), len(columns)))
+        np.add.at(self.cluster_gram, demeaner.entity_index, Z[:, :, None] * Z[:, None, :])
+        self.ss_tot = np.sum((sample[y_var].to_numpy() - sample[y_var].mean()) ** 2)
+
+    def solve(self, regressors):
+        """
+        由 Gram 子块求解一个设定
+
+        Parameters:
+        -----------
+        regressors : list
+            解释变量 (第一个为 did)
+
+        Returns:
+        --------
+        dict : 系数、聚类标准误、p值、R2 (均对应第一个解释变量)
+        """
+        s = [self.position[var] for var in regressors]
+        XtX = self.gram[np.ix_(s, s)]
+        Xty = self.gram[s, 0]
+        beta = np.linalg.solve(XtX, Xty)
+        XtX_inv = np.linalg.inv(XtX)
+
+        # 各城市得分 X_g'e_g
+        scores = self.cluster_gram[:, s, 0] - self.cluster_gram[:, s][:, :, s] @ beta
+        meat = scores.T @ scores
+
+        n, G = self.n_obs, self.n_clusters
+        k = len(s) + self.n_fe
+        correction = (G / (G - 1)) * ((n - 1) / (n - k))
+        vcov = correction * XtX_inv @ meat @ XtX_inv
+        se = np.sqrt(vcov[0, 0])
+        t_stat = beta[0] / se
+        ss_res = self.gram[0, 0] - beta @ Xty
+
+        return {
+            'coefficient': beta[0],
+            'std_error': se,
+            't_stat': t_stat,
+            # 聚类稳健推断的自由度为聚类数 - 1 (与 twfe_regression 一致)
+            'p_value': 2 * (1 - stats.t.cdf(abs(t_stat), G - 1)),
+            'r2': 1 - ss_res / self.ss_tot,
+            'n_obs': n,
+        }
+
+
+def run_spec_curve(df, outcomes=OUTCOMES, samples=SAMPLES, slots=CONTROL_SLOTS,
+                   treatment='did'):
+    """
+    估计全部设定
+
+    Returns:
+    --------
+    pd.DataFrame : 每个设定一行 (按DID系数升序, 含排名)
+    """
+    candidates = [var for variants in slots.values() for var in variants]
+    combos = enumerate_controls(slots)
+    rows = []
+    for (outcome_label, y_var), (sample_label, rule) in itertools.product(
+            outcomes.items(), samples.items()):
+        if y_var not in df.columns:
+            print(f'[WARNING] 被解释变量 {y_var} 不存在, 跳过')
+            continue
+        universe = SpecUniverse(select_sample(df, rule), y_var, treatment, candidates)
+        print(f'[INFO] {outcome_label} × {sample_label}: 共同样本 {universe.n_obs} 观测, '
+              f'{len(combos)} 个设定')
+        for controls in combos:
+            res = universe.solve([treatment] + list(controls))
+            row = {'被解释变量': outcome_label, '样本': sample_label,
+                   '控制变量': ', '.join(controls) if controls else '(无)',
+                   '控制变量数': len(controls)}
+            for slot, variants in slots.items():
+                chosen = [var for var in controls if var in variants]
+                row[slot] = chosen[0] if chosen else ''
+            row.update({'DID系数': res['coefficient'], '聚类标准误': res['std_error'],
+                        't值': res['t_stat'], 'p值': res['p_value'],
+                        'R2': res['r2'], '样本量': res['n_obs']})
+            rows.append(row)
+
+    result = pd.DataFrame(rows).sort_values('DID系数').reset_index(drop=True)
+    result.insert(0, '排名', np.arange(1, len(result) + 1))
+    return result
+
+
+def plot_spec_curve(result, slots=CONTROL_SLOTS, output_file='specification_curve.png'):
+    """
+    绘制设定曲线 (上: 排序后的系数及95%置信区间; 下: 设定指示面板)
+    """
+    x = result['排名'].to_numpy()
+    coef = result['DID系数'].to_numpy()
+    ci = 1.96 * result['聚类标准误'].to_numpy()
+    significant = result['p值'].to_numpy() < 0.05
+
+    # 指示面板各行: 被解释变量、样本、各控制变量
+    indicator_rows = [('被解释变量', label) for label in result['被解释变量'].unique()]
+    indicator_rows += [('样本', label) for label in result['样本'].unique()]
+    indicator_rows += [(slot, var) for slot, variants in slots.items() for var in variants]
+
+    fig, (ax_top, ax_bottom) = plt.subplots(
+        2, 1, figsize=(14, 10), sharex=True,
+        gridspec_kw={'height_ratios': [2, max(len(indicator_rows) / 6, 1.5)]})
+
+    colors = np.where(significant, '#c0392b', '#7f8c8d')
+    ax_top.vlines(x, coef - ci, coef + ci, colors=colors, alpha=0.3, linewidth=1)
+    ax_top.scatter(x, coef, c=colors, s=8, zorder=3)
+    ax_top.axhline(0, color='black', linestyle='--', linewidth=1)
+    ax_top.axhline(np.median(coef), color='#2980b9', linestyle=':', linewidth=1.5,
+                   label=f'中位数 = {np.median(coef):.4f}')
+    ax_top.set_ylabel('DID系数 (95%置信区间)', fontsize=12, fontweight='bold')
+    ax_top.set_title(f'设定曲线: {len(result)} 个设定 '
+                     f'(p<0.05 占比 {significant.mean() * 100:.1f}%)',
+                     fontsize=14, fontweight='bold')
+    ax_top.legend(loc='upper left', fontsize=10)
+    ax_top.grid(True, alpha=0.3)
+
+    for i, (column, label) in enumerate(indicator_rows):
+        active = (result[column] == label).to_numpy()
+        ax_bottom.scatter(x[active], np.full(active.sum(), i), c=colors[active],
+                          marker='|', s=40)
+    ax_bottom.set_yticks(range(len(indicator_rows)))
+    ax_bottom.set_yticklabels([f'{column}: {label}' for column, label in indicator_rows],
+                              fontsize=9)
+    ax_bottom.invert_yaxis()
+    ax_bottom.set_xlabel('设定排名 (按DID系数升序)', fontsize=12, fontweight='bold')
+    ax_bottom.grid(True, axis='y', alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    plt.close()
+    print(f'[OK] 设定曲线已保存: {output_file}')
+
+
+def main():
+    """
+    主函数: 全部设定的设定曲线分析
+    """
+    print('[OK] === 设定曲线分析 ===')
+    df = load_panel(ROBUSTNESS_PLAN)
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    result = run_spec_curve(df)
+    print(f'\n[INFO] 设定总数: {len(result)}')
+    print(f'[INFO] DID系数中位数: {result["DID系数"].median():.4f}')
+    print(f'[INFO] DID系数范围: [{result["DID系数"].min():.4f}, {result["DID系数"].max():.4f}]')
+    print(f'[INFO] p<0.05 的设定占比: {(result["p值"] < 0.05).mean() * 100:.1f}%')
+
+    summary = result.groupby(['被解释变量', '样本'])['DID系数'].describe()
+    with pd.ExcelWriter('设定曲线结果.xlsx', engine='openpyxl') as writer:
+        result.to_excel(writer, sheet_name='全部设定', index=False)
+        summary.to_excel(writer, sheet_name='分组汇总')
+    print('[OK] 设定曲线结果已保存: 设定曲线结果.xlsx')
+
+    plot_spec_curve(result)
+    return result
+
+
+if __name__ == '__main__':
+    result = main()
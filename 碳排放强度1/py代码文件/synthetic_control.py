@@ -0,0 +1,410 @@
+"""
+合成控制法 (SC) 与合成双重差分 (SDID): 逐个试点城市的反事实路径
+
+对每个试点城市 (批次 g, 政策前时期 t < g), 从未试点城市为供体池:
+- SC (Abadie et al. 2010): min ||y_pre - Y0_pre·ω||², ω ≥ 0, Σω = 1
+- SDID (Arkhangelsky et al. 2021): 单元权重在政策前时期去均值 (含截距) 并加岭惩罚
+  ζ²·T_pre·||ω||², ζ = (T_post)^{1/4}·σ̂ (σ̂: 供体政策前一阶差分的标准差);
+  时间权重 λ 由供体的政策后均值对政策前各期回归得到 (每个批次一组, 岭惩罚
+  ζ_λ²·N_co·||λ||², ζ_λ = 1e-6·σ̂, 同原文)
+  τ̂ = (ȳ_post - λ'y_pre) - ω'(Ȳ0_post - Y0_pre·λ)
+
+计算方式:
+- 每个批次只构造一次供体 Gram 矩阵 G = Y0_pre'Y0_pre (以及 SDID 的去均值+岭版本与其最大特征值),
+  处理城市与安慰剂 (每个供体轮流作为处理城市, 权重中屏蔽自身) 的全部 QP 共用同一个 G
+- SC 权重: Wolfe 最小范数点算法 (只用 G 的元素, 活动集不超过 T_pre + 1 个供体, 精确解)
+- SDID 权重: 以 SC 解为热启动, 作为矩阵的列用加速投影梯度
+  (FISTA + 自适应重启 + 带屏蔽的单纯形投影) 批量求解
+- (批次, 列块) 任务在进程池中并行
+
+推断 (placebo-in-space): SC 用 政策后/政策前 RMSPE 比值在安慰剂中的排名
+(政策前 RMSPE 以 σ̂ 为下限, 避免短政策前期的精确拟合使比值发散);
+SDID 用安慰剂 τ̂ 的分布 (标准误 = 安慰剂 τ̂ 的标准差, Arkhangelsky et al. 算法4)。
+
+Created: 2026-10-19
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+
+# ============================================================================
+# 单纯形约束二次规划 (批量)
+# ============================================================================
+def project_simplex(V, mask):
+    """
+    按列投影到单纯形, mask 为 False 的位置固定为0
+
+    Parameters:
+    -----------
+    V : np.ndarray
+        (J, m)
+    mask : np.ndarray
+        (J, m) 布尔矩阵, 允许非零的位置
+    """
+    J, m = V.shape
+    U = np.where(mask, V, -np.inf)
+    S = -np.sort(-U, axis=0)
+    finite = np.isfinite(S)
+    css = np.cumsum(np.where(finite, S, 0.0), axis=0)
+    k = np.arange(1, J + 1)[:, None]
+    rho = ((S - (css - 1) / k > 0) & finite).sum(axis=0)
+    theta = (css[rho - 1, np.arange(m)] - 1) / rho
+    return np.where(mask, np.maximum(V - theta, 0.0), 0.0)
+
+
+def solve_simplex_qp(A, B, mask, init=None, lipschitz=None, max_iter=20000, tol=1e-10):
+    """
+    批量求解 min 0.5·ω'Aω - b'ω, ω ∈ 单纯形 (A 各列共用)
+
+    Parameters:
+    -----------
+    A : np.ndarray
+        (J, J) 半正定矩阵 (供体 Gram 矩阵 + 岭惩罚)
+    B : np.ndarray
+        (J, m) 每列一个问题的线性项
+    mask : np.ndarray
+        (J, m) 允许的供体
+    init : np.ndarray, optional
+        热启动解
+    lipschitz : float, optional
+        A 的最大特征值 (预先计算后复用)
+
+    Returns:
+    --------
+    np.ndarray : (J, m) 权重
+    """
+    if lipschitz is None:
+        lipschitz = np.linalg.eigvalsh(A)[-1]
+    step = 1.0 / max(lipschitz, 1e-12)
+    if init is None:
+        init = mask / mask.sum(axis=0, keepdims=True)
+    W = project_simplex(init, mask)
+    Z, t = W.copy(), np.ones(W.shape[1])
+    active = np.arange(W.shape[1])
+    for _ in range(max_iter):
+        Za, Wa, Ba, Ma = Z[:, active], W[:, active], B[:, active], mask[:, active]
+        W_new = project_simplex(Za - step * (A @ Za - Ba), Ma)
+        # Frank-Wolfe 对偶间隙 g'ω - min_j g_j 是目标函数次优性的上界
+        grad = A @ W_new - Ba
+        gap = np.einsum('ij,ij->j', grad, W_new) - np.where(Ma, grad, np.inf).min(axis=0)
+        delta = W_new - Wa
+        # 自适应重启 (O'Donoghue & Candès): 动量方向与下降方向相反的列重置 t
+        ta = np.where(np.einsum('ij,ij->j', Za - W_new, delta) > 0, 1.0, t[active])
+        t_new = (1 + np.sqrt(1 + 4 * ta * ta)) / 2
+        W[:, active] = W_new
+        Z[:, active] = W_new + ((ta - 1) / t_new) * delta
+        t[active] = t_new
+        active = active[gap >= tol * lipschitz]
+        if active.size == 0:
+            break
+    return W
+
+
+def min_norm_point(A, b, c, allowed, tol=1e-12, max_iter=1000):
+    """
+    Wolfe 最小范数点算法: min ||y - Y0·ω||², ω ∈ 单纯形 (精确有限步收敛)
+
+    只使用内积: 供体相对目标的 Gram 矩阵 K = A - b1' - 1b' + c,
+    A = Y0'Y0 为批次内共用的供体 Gram 矩阵, b = Y0'y, c = y'y。
+    政策前期数远小于供体数时, 解的支撑集最多 T_pre + 1 个供体, 活动集很小。
+
+    Parameters:
+    -----------
+    A : np.ndarray
+        (J, J) 供体 Gram 矩阵
+    b : np.ndarray
+        (J,)
+    c : float
+    allowed : np.ndarray
+        (J,) 布尔向量, 允许的供体
+
+    Returns:
+    --------
+    np.ndarray : (J,) 权重
+    """
+    K = A - b[:, None] - b[None, :] + c
+    scale = max(np.abs(np.diag(K)).max(), 1e-300)
+    diag = np.where(allowed, np.diag(K), np.inf)
+    S, lam = [int(np.argmin(diag))], np.ones(1)
+    for _ in range(max_iter):
+        g = K[:, S] @ lam                                 # 当前点与各供体的内积
+        j = int(np.argmin(np.where(allowed, g, np.inf)))
+        if lam @ g[S] - g[j] <= tol * scale or j in S:
+            break
+        S.append(j)
+        lam = np.append(lam, 0.0)
+        while True:
+            # 当前活动集仿射包上的最小范数点
+            m = len(S)
+            M = np.zeros((m + 1, m + 1))
+            M[:m, :m] = K[np.ix_(S, S)]
+            M[:m, m] = M[m, :m] = 1.0
+            rhs = np.zeros(m + 1)
+            rhs[m] = 1.0
+            alpha = np.linalg.lstsq(M, rhs, rcond=None)[0][:m]
+            if np.all(alpha > tol):
+                lam = alpha
+                break
+            # 沿 lam → alpha 走到单纯形边界并剔除权重为0的供体
+            neg = alpha <= tol
+            theta = np.min(lam[neg] / (lam[neg] - alpha[neg]))
+            lam = lam + theta * (alpha - lam)
+            keep = lam > tol
+            S = [s for s, k in zip(S, keep) if k]
+            lam = lam[keep] / lam[keep].sum()
+    w = np.zeros(len(b))
+    w[S] = lam
+    return w
+
+
+# ============================================================================
+# 单个批次
+# ============================================================================
+def _solve_cohort(task):
+    """
+    一个批次的一块列: SC 与 SDID 单元权重
+
+    Returns:
+    --------
+    tuple : (列标签, SC 权重, SDID 权重)
+    """
+    factors, targets, masks, labels = task
+    w_sc = np.column_stack([min_norm_point(factors['A_sc'], targets['b_sc'][:, i],
+                                           targets['c_sc'][i], masks[:, i])
+                            for i in range(masks.shape[1])])
+    w_sdid = solve_simplex_qp(factors['A_sdid'], targets['b_sdid'], masks, init=w_sc,
+                              lipschitz=factors['L_sdid'])
+    return labels, w_sc, w_sdid
+
+
+class SyntheticControl:
+    """
+    全部试点城市的合成控制 / 合成DID 与安慰剂检验
+    """
+
+    def __init__(self, df, y_var='ln_carbon_intensity', entity_var='city_name',
+                 time_var='year', cohort_var='pilot_year'):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据 (只使用结果变量完整的城市)
+        y_var : str
+            结果变量
+        """
+        Y = df.pivot_table(index=entity_var, columns=time_var, values=y_var, aggfunc='first')
+        Y = Y[Y.notna().all(axis=1)]
+        cohort = df.drop_duplicates(entity_var).set_index(entity_var)[cohort_var].reindex(Y.index)
+        self.y_var = y_var
+        self.Y = Y
+        self.years = Y.columns.to_numpy()
+        self.cohort = cohort
+        self.donors = Y.index[cohort.isna()]
+        self.treated = Y.index[cohort.notna()]
+        self.Y0 = Y.loc[self.donors].to_numpy(dtype=np.float64)
+        self.results = None
+
+    def _cohort_problem(self, g):
+        """批次 g 的供体矩阵分解、时间权重与全部 QP 的线性项"""
+        pre = self.years < g
+        post = ~pre
+        T_pre, T_post = pre.sum(), post.sum()
+        # Σω = 1 时从供体与目标中同时减去各期的供体均值不改变 QP 的解,
+        # 去掉共同水平方向以减小 Gram 矩阵元素的量级 (数值更稳定)
+        level = self.Y0[:, pre].mean(axis=0)
+        Y0_pre = self.Y0[:, pre].T - level[:, None]      # (T_pre, J)
+        Y0c_pre = Y0_pre - Y0_pre.mean(axis=0)
+
+        sigma = np.diff(self.Y0[:, pre], axis=1).std(ddof=1) if T_pre > 1 else \
+            self.Y0[:, pre].std(ddof=1)
+        zeta = T_post ** 0.25 * sigma
+        A_sc = Y0_pre.T @ Y0_pre
+        A_sdid = Y0c_pre.T @ Y0c_pre + zeta ** 2 * T_pre * np.eye(len(self.donors))
+        factors = {'A_sc': A_sc,
+                   'A_sdid': A_sdid, 'L_sdid': np.linalg.eigvalsh(A_sdid)[-1]}
+
+        # 时间权重: 供体政策后均值 ≈ λ0 + Y0_pre·λ
+        X = self.Y0[:, pre] - self.Y0[:, pre].mean(axis=0)
+        target = self.Y0[:, post].mean(axis=1)
+        target = target - target.mean()
+        zeta_time = 1e-6 * sigma
+        A_time = X.T @ X + zeta_time ** 2 * len(self.donors) * np.eye(T_pre)
+        lam = solve_simplex_qp(A_time, (X.T @ target)[:, None], np.ones((T_pre, 1), bool))[:, 0]
+
+        # 列: 本批次处理城市 + 每个供体作为安慰剂
+        treated = self.treated[self.cohort[self.treated] == g]
+        Y_tr = self.Y.loc[treated].to_numpy(dtype=np.float64)
+        columns = np.vstack([Y_tr, self.Y0])
+        y_pre = columns[:, pre].T - level[:, None]
+        b_sc = Y0_pre.T @ y_pre
+        c_sc = (y_pre ** 2).sum(axis=0)
+        b_sdid = Y0c_pre.T @ (y_pre - y_pre.mean(axis=0))
+        J = len(self.donors)
+        masks = np.ones((J, len(columns)), dtype=bool)
+        masks[np.arange(J), len(treated) + np.arange(J)] = False
+        labels = [('处理', c) for c in treated] + [('安慰剂', c) for c in self.donors]
+        return {'pre': pre, 'post': post, 'lambda': lam, 'sigma': sigma, 'factors': factors,
+                'columns': columns, 'b_sc': b_sc, 'c_sc': c_sc, 'b_sdid': b_sdid, 'masks': masks,
+                'labels': labels}
+
+    def fit(self, n_jobs=None, chunk_size=64):
+        """
+        求解全部批次的处理城市与安慰剂
+
+        Returns:
+        --------
+        pd.DataFrame : 每个试点城市一行 (SC/SDID 效应与安慰剂 p 值)
+        """
+        start = time.perf_counter()
+        problems, tasks = {}, []
+        for g in sorted(self.cohort[self.treated].unique()):
+            prob = self._cohort_problem(g)
+            problems[g] = prob
+            m = len(prob['labels'])
+            for s in range(0, m, chunk_size):
+                cols = slice(s, s + chunk_size)
+                targets = {key: prob[key][..., cols] for key in ('b_sc', 'c_sc', 'b_sdid')}
+                tasks.append((g, (prob['factors'], targets, prob['masks'][:, cols],
+                                  prob['labels'][cols])))
+
+        if n_jobs == 1:
+            outputs = [_solve_cohort(task) for _, task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                outputs = list(pool.map(_solve_cohort, [task for _, task in tasks]))
+
+        for g in problems:
+            parts = [out for (gg, _), out in zip(tasks, outputs) if gg == g]
+            problems[g]['w_sc'] = np.hstack([p[1] for p in parts])
+            problems[g]['w_sdid'] = np.hstack([p[2] for p in parts])
+        n_qp = sum(len(p['labels']) for p in problems.values())
+        print(f'[OK] 求解完成: {n_qp} 组供体权重 × 2 (SC/SDID), '
+              f'耗时 {time.perf_counter() - start:.1f}s')
+
+        self.problems = problems
+        self.results = self._summarize()
+        return self.results
+
+    def _estimates(self, prob):
+        """全部列的 SC 缺口路径、RMSPE 比值与 SDID τ̂"""
+        Y_cols = prob['columns']
+        synthetic = prob['w_sc'].T @ self.Y0
+        gaps = Y_cols - synthetic
+        pre, post = prob['pre'], prob['post']
+        rmspe_pre = np.sqrt((gaps[:, pre] ** 2).mean(axis=1))
+        rmspe_post = np.sqrt((gaps[:, post] ** 2).mean(axis=1))
+
+        lam = prob['lambda']
+        contrast = Y_cols[:, post].mean(axis=1) - Y_cols[:, pre] @ lam
+        donor_contrast = self.Y0[:, post].mean(axis=1) - self.Y0[:, pre] @ lam
+        tau_sdid = contrast - prob['w_sdid'].T @ donor_contrast
+        return gaps, rmspe_pre, rmspe_post, tau_sdid
+
+    def _summarize(self):
+        rows, gap_frames = [], []
+        for g, prob in self.problems.items():
+            gaps, rmspe_pre, rmspe_post, tau = self._estimates(prob)
+            kinds = np.array([k for k, _ in prob['labels']])
+            names = [c for _, c in prob['labels']]
+            placebo = kinds == '安慰剂'
+            # 政策前期很短时许多城市被精确拟合, 政策前 RMSPE 以逐年噪声 σ̂ 为下限
+            ratio = rmspe_post / np.maximum(rmspe_pre, prob['sigma'])
+            att_sc = gaps[:, prob['post']].mean(axis=1)
+            prob['gaps'] = gaps
+
+            for i in np.flatnonzero(~placebo):
+                top = np.argsort(prob['w_sc'][:, i])[::-1][:3]
+                rows.append({
+                    '城市': names[i], '批次': int(g),
+                    'SC_ATT': att_sc[i], 'SC_政策前RMSPE': rmspe_pre[i],
+                    'SC_RMSPE比值': ratio[i],
+                    'SC_安慰剂p值': (1 + np.sum(ratio[placebo] >= ratio[i])) / (1 + placebo.sum()),
+                    'SDID_ATT': tau[i],
+                    'SDID_安慰剂标准误': tau[placebo].std(ddof=1),
+                    'SDID_安慰剂p值': (1 + np.sum(np.abs(tau[placebo]) >= abs(tau[i])))
+                    / (1 + placebo.sum()),
+                    '主要供体': ', '.join(f'{self.donors[j]}({prob["w_sc"][j, i]:.2f})'
+                                      for j in top if prob['w_sc'][j, i] > 0.005),
+                })
+            gap_frames.append(pd.DataFrame(gaps[~placebo], columns=self.years,
+                                           index=pd.Index(np.array(names)[~placebo], name='城市'))
+                              .assign(批次=int(g)))
+        self.gaps = pd.concat(gap_frames)
+        return pd.DataFrame(rows)
+
+    def cohort_summary(self):
+        """按批次汇总: 城市平均效应与显著城市个数"""
+        res = self.results
+        return res.groupby('批次').agg(
+            城市数=('城市', 'size'), SC平均效应=('SC_ATT', 'mean'),
+            SDID平均效应=('SDID_ATT', 'mean'),
+            SC显著城市数=('SC_安慰剂p值', lambda p: int((p < 0.1).sum())),
+            SDID显著城市数=('SDID_安慰剂p值', lambda p: int((p < 0.1).sum()))).reset_index()
+
+    def plot_cohort(self, g=2010, output_file='合成控制_第一批试点.png', ncols=7):
+        """某一批次各城市的 SC 缺口路径与安慰剂 5%-95% 区间"""
+        prob = self.problems[g]
+        kinds = np.array([k for k, _ in prob['labels']])
+        names = np.array([c for _, c in prob['labels']])
+        placebo_gaps = prob['gaps'][kinds == '安慰剂']
+        band = np.percentile(placebo_gaps, [5, 95], axis=0)
+        treated = np.flatnonzero(kinds == '处理')
+
+        nrows = int(np.ceil(len(treated) / ncols))
+        fig, axes = plt.subplots(nrows, ncols, figsize=(2.6 * ncols, 2.1 * nrows),
+                                 sharex=True, sharey=True, squeeze=False)
+        for ax, i in zip(axes.ravel(), treated):
+            ax.fill_between(self.years, band[0], band[1], color='gray', alpha=0.3, linewidth=0)
+            ax.plot(self.years, prob['gaps'][i], color='#d7191c', linewidth=1.2)
+            ax.axhline(0, color='black', linewidth=0.6)
+            ax.axvline(g - 0.5, color='black', linestyle='--', linewidth=0.6)
+            ax.set_title(names[i], fontsize=8)
+            ax.tick_params(labelsize=6)
+        for ax in axes.ravel()[len(treated):]:
+            ax.axis('off')
+        fig.suptitle(f'{g}年试点城市: 实际值 - 合成控制 (灰色: 安慰剂5%-95%)',
+                     fontsize=12, fontweight='bold')
+        plt.tight_layout(rect=(0, 0, 1, 0.97))
+        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.close()
+        print(f'[OK] 合成控制图已保存: {output_file}')
+
+    def save(self, output_file='合成控制与合成DID结果.xlsx'):
+        """保存城市层面结果、批次汇总、缺口路径"""
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            self.results.to_excel(writer, sheet_name='城市结果', index=False)
+            self.cohort_summary().to_excel(writer, sheet_name='批次汇总', index=False)
+            self.gaps.to_excel(writer, sheet_name='SC缺口路径')
+        print(f'[OK] 合成控制结果已保存: {output_file}')
+
+
+def main(n_jobs=None):
+    """
+    主函数: 全部试点城市的 SC / SDID
+    """
+    print('[OK] === 合成控制与合成DID ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    model = SyntheticControl(df)
+    print(f'[INFO] 结果变量完整的城市: 处理 {len(model.treated)}, 供体 {len(model.donors)}')
+    model.fit(n_jobs=n_jobs)
+    print('\n[INFO] 批次汇总:')
+    print(model.cohort_summary().to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+    model.save()
+    model.plot_cohort(2010)
+    return model
+
+
+if __name__ == '__main__':
+    model = main()
@@ -0,0 +1,419 @@
+"""
+Hansen 面板门槛回归: 人口密度的集聚效应与拥挤效应
+
+模型 (以单门槛为例):
+    ln_carbon_intensity_it = μ_i + λ_t + β1·x_it·1(q_it ≤ γ) + β2·x_it·1(q_it > γ) + 控制变量 + ε_it
+门槛变量 q 与区制变量 x 默认均为 ln_pop_density。
+
+计算方式:
+1. 样本按门槛变量排序后做一次城市组内变换 (年份效应以虚拟变量进入, 允许非平衡面板),
+   变换后的数据在整个网格搜索与自助法中复用
+2. 每个候选门槛 γ 的残差平方和由累积和增量得到, 无需重新回归:
+       SSR(γ) = SSR0 - (z'e0)^2 / (z'Wz - z'X̃ (X̃'X̃)^{-1} X̃'z),   z = x·1(q ≤ γ)
+   其中 z'e0、z'X̃ 是排序后的累积和, z'Wz 由组内累积和逐项更新 —— 全部候选门槛一次向量化计算
+3. 多门槛按 Hansen (1999) 顺序估计, 并对先前门槛做重新搜索 (refinement)
+4. 门槛个数的似然比 (F) 检验使用城市层面 wild bootstrap (Rademacher 权重, 固定设计):
+   设计矩阵不变, 一批自助样本作为矩阵的列同时计算; 自助样本中零假设下的门槛重新估计;
+   各批次在进程池中并行
+5. 门槛值置信区间由 LR(γ) ≤ -2ln(1-√(1-α)) 反推
+
+Created: 2026-10-19
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from panel_regression import twfe_regression
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+DEFAULT_CONTROLS = ['did', 'ln_pgdp', 'tertiary_share', 'ln_fdi', 'ln_road_area']
+
+
+def lr_critical_value(alpha=0.05):
+    """门槛值置信区间的 LR 临界值 (Hansen 2000)"""
+    return -2 * np.log(1 - np.sqrt(1 - alpha))
+
+
+class PanelThresholdModel:
+    """
+    固定效应面板门槛模型
+    """
+
+    def __init__(self, df, y_var='ln_carbon_intensity', threshold_var='ln_pop_density',
+                 regime_var='ln_pop_density', controls=None, entity_var='city_name',
+                 time_var='year', trim=0.05):
+        """
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            面板数据
+        y_var : str
+            被解释变量
+        threshold_var : str
+            门槛变量 q
+        regime_var : str
+            系数随区制变化的变量 x
+        controls : list, optional
+            控制变量 (系数不随区制变化)
+        trim : float
+            每个区制的最小样本比例
+        """
+        controls = DEFAULT_CONTROLS if controls is None else list(controls)
+        self.y_var = y_var
+        self.threshold_var = threshold_var
+        self.regime_var = regime_var
+        self.controls = [c for c in controls if c != regime_var]
+        self.trim = trim
+
+        columns = list(dict.fromkeys([y_var, threshold_var, regime_var] + self.controls))
+        sample = df.dropna(subset=columns)
+        sample = sample.iloc[np.argsort(sample[threshold_var].to_numpy(), kind='stable')]
+        self.sample = sample.reset_index(drop=True)
+
+        self.q = self.sample[threshold_var].to_numpy(dtype=np.float64)
+        self.x = self.sample[regime_var].to_numpy(dtype=np.float64)
+        self.entity = pd.Categorical(self.sample[entity_var]).codes.astype(np.int64)
+        self.time = pd.Categorical(self.sample[time_var]).codes.astype(np.int64)
+        self.n = len(self.sample)
+        self.n_entities = self.entity.max() + 1
+        self.entity_counts = np.bincount(self.entity, minlength=self.n_entities)
+
+        # 组内变换后的被解释变量与基础设计矩阵 (区制变量 + 控制变量 + 年份虚拟变量)
+        n_periods = self.time.max() + 1
+        year_dummies = (self.time[:, None] == np.arange(1, n_periods)[None, :]).astype(float)
+        X = np.column_stack([self.x, self.sample[self.controls].to_numpy(dtype=np.float64),
+                             year_dummies])
+        self.Xw = self._within(X)
+        self.yw = self._within(self.sample[y_var].to_numpy(dtype=np.float64))
+
+        # z'Wz 的累积 (组内累积和逐项更新)
+        prior = pd.Series(self.x).groupby(self.entity).cumsum().to_numpy() - self.x
+        t_i = self.entity_counts[self.entity]
+        delta = self.x ** 2 - (2 * prior * self.x + self.x ** 2) / t_i
+        self.zwz = np.cumsum(delta)
+
+        # 候选位置: 相同门槛值的最后一个观测 + 两端修剪
+        self.tie_end = np.r_[self.q[1:] != self.q[:-1], True]
+        self.min_regime = int(np.ceil(trim * self.n))
+        positions = np.arange(self.n)
+        self.candidates = positions[self.tie_end & (positions >= self.min_regime - 1)
+                                    & (positions < self.n - self.min_regime)]
+
+        self._grid_cache = {}
+        self.results = None
+        self.tests = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_grid_cache'] = {}
+        return state
+
+    # ------------------------------------------------------------------
+    # 基础运算
+    # ------------------------------------------------------------------
+    def _within(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        squeeze = values.ndim == 1
+        V = values.reshape(self.n, -1)
+        sums = np.zeros((self.n_entities, V.shape[1]))
+        np.add.at(sums, self.entity, V)
+        out = V - (sums / self.entity_counts[:, None])[self.entity]
+        return out[:, 0] if squeeze else out
+
+    def _z(self, position):
+        """z = x·1(q ≤ q_sorted[position]) 的组内变换"""
+        return self._within(np.where(np.arange(self.n) <= position, self.x, 0.0))
+
+    def _grid(self, base):
+        """
+        给定已有门槛 (排序位置) 时全部候选门槛的分母项 (只依赖设计矩阵, 缓存复用)
+        """
+        if base in self._grid_cache:
+            return self._grid_cache[base]
+        Xb = np.column_stack([self.Xw] + [self._z(p) for p in base]) if base else self.Xw
+        A = np.linalg.inv(Xb.T @ Xb)
+        b = np.cumsum(self.x[:, None] * Xb, axis=0)[self.candidates]
+        denom = self.zwz[self.candidates] - np.einsum('jp,pq,jq->j', b, A, b)
+
+        valid = denom > 1e-10 * np.abs(self.zwz[self.candidates]).max()
+        for p in base:
+            valid &= np.abs(self.candidates - p) >= self.min_regime
+        # dof: 加入新门槛后模型的残差自由度 (已扣除城市固定效应、Xb 与新门槛项)
+        grid = {'Xb': Xb, 'A': A, 'positions': self.candidates[valid], 'denom': denom[valid],
+                'dof': self.n - self.n_entities - Xb.shape[1] - 1}
+        self._grid_cache[base] = grid
+        return grid
+
+    def _search(self, base, Y):
+        """
+        给定已有门槛, 对 Y 的每一列搜索下一个门槛
+
+        Returns:
+        --------
+        positions : 最优门槛位置 (B,)
+        ssr_alt : 加入门槛后的残差平方和 (B,)
+        ssr_base : 已有门槛模型的残差平方和 (B,)
+        ssr_curve : 全部候选门槛的残差平方和 (m, B)
+        grid : 网格信息
+        """
+        grid = self._grid(base)
+        if len(grid['positions']) == 0:
+            raise ValueError('没有满足修剪条件的候选门槛')
+        E = Y - grid['Xb'] @ (grid['A'] @ (grid['Xb'].T @ Y))
+        ssr_base = np.einsum('ij,ij->j', E, E)
+        a = np.cumsum(self.x[:, None] * E, axis=0)[grid['positions']]
+        ssr_curve = ssr_base[None, :] - a ** 2 / grid['denom'][:, None]
+        best = np.argmin(ssr_curve, axis=0)
+        return (grid['positions'][best], ssr_curve[best, np.arange(Y.shape[1])], ssr_base,
+                ssr_curve, grid)
+
+    # ------------------------------------------------------------------
+    # 估计
+    # ------------------------------------------------------------------
+    def fit(self, max_thresholds=3, refine=True, alpha=0.05):
+        """
+        顺序估计 1 ~ max_thresholds 个门槛
+
+        Returns:
+        --------
+        list of dict : 每个门槛个数的门槛值、SSR、F统计量、置信区间
+        """
+        Y = self.yw[:, None]
+        thresholds = []
+        self.results = []
+        critical = lr_critical_value(alpha)
+        for k in range(1, max_thresholds + 1):
+            pos, ssr_alt, ssr_base, curve, grid = self._search(tuple(sorted(thresholds)), Y)
+            new = int(pos[0])
+            if refine and thresholds:
+                # Hansen refinement: 给定其余门槛重新搜索先前的门槛
+                refined = []
+                for i in range(len(thresholds)):
+                    others = tuple(sorted([t for j, t in enumerate(thresholds) if j != i] + [new]))
+                    refined.append(int(self._search(others, Y)[0][0]))
+                thresholds = refined
+            thresholds.append(new)
+
+            sigma2 = ssr_alt[0] / grid['dof']
+            lr = (curve[:, 0] - ssr_alt[0]) / sigma2
+            inside = grid['positions'][lr <= critical]
+            self.results.append({
+                '门槛个数': k,
+                '门槛位置': sorted(thresholds),
+                '门槛值': sorted(self.q[t] for t in thresholds),
+                '新门槛值': self.q[new],
+                '置信区间下限': self.q[inside].min(),
+                '置信区间上限': self.q[inside].max(),
+                'SSR(原模型)': ssr_base[0],
+                'SSR(加入门槛)': ssr_alt[0],
+                'F统计量': (ssr_base[0] - ssr_alt[0]) / sigma2,
+                'LR曲线': pd.DataFrame({'门槛值': self.q[grid['positions']], 'LR': lr}),
+            })
+            print(f'[OK] 第{k}个门槛: γ={self.q[new]:.4f} '
+                  f'(95%CI [{self.q[inside].min():.4f}, {self.q[inside].max():.4f}]), '
+                  f'F={self.results[-1]["F统计量"]:.3f}')
+        return self.results
+
+    def _null_fit(self, k):
+        """k 个门槛模型 (零假设) 的拟合值与残差 (组内变换空间)"""
+        base = tuple(self.results[k - 1]['门槛位置']) if k > 0 else ()
+        grid = self._grid(base)
+        beta = grid['A'] @ (grid['Xb'].T @ self.yw)
+        fitted = grid['Xb'] @ beta
+        return fitted, self.yw - fitted
+
+    def _bootstrap_chunk(self, k, seed, n_boot):
+        """
+        k 门槛 vs k+1 门槛检验的一批自助样本 (各列同时计算)
+
+        Returns:
+        --------
+        np.ndarray : 自助 F 统计量 (n_boot,)
+        """
+        rng = np.random.default_rng(seed)
+        fitted, resid = self._null_fit(k)
+        weights = rng.choice([-1.0, 1.0], size=(self.n_entities, n_boot))
+        Y = fitted[:, None] + resid[:, None] * weights[self.entity]
+
+        # 零假设模型的门槛在每个自助样本中重新顺序估计 (按相同门槛组合分组批量计算)
+        bases = [()] * n_boot
+        for _ in range(k):
+            new = np.empty(n_boot, dtype=np.int64)
+            for base, cols in self._group(bases):
+                new[cols] = self._search(base, Y[:, cols])[0]
+            bases = [tuple(sorted(b + (int(p),))) for b, p in zip(bases, new)]
+
+        F = np.empty(n_boot)
+        for base, cols in self._group(bases):
+            _, ssr_alt, ssr_base, _, grid = self._search(base, Y[:, cols])
+            F[cols] = (ssr_base - ssr_alt) / (ssr_alt / grid['dof'])
+        return F
+
+    @staticmethod
+    def _group(bases):
+        groups = {}
+        for i, base in enumerate(bases):
+            groups.setdefault(base, []).append(i)
+        return [(base, np.array(cols)) for base, cols in groups.items()]
+
+    def bootstrap_test(self, n_boot=300, n_jobs=None, chunk_size=50, seed=2026):
+        """
+        门槛个数的自助法 F 检验 (H0: k 个门槛 vs H1: k+1 个门槛)
+
+        Parameters:
+        -----------
+        n_boot : int
+            自助次数
+        n_jobs : int, optional
+            进程数 (默认 CPU 核数); 1 表示串行
+
+        Returns:
+        --------
+        pd.DataFrame : 检验、F统计量、自助p值、10%/5%/1% 临界值
+        """
+        if self.results is None:
+            raise ValueError('请先调用 fit()')
+        tasks = []
+        for k in range(len(self.results)):
+            for start in range(0, n_boot, chunk_size):
+                tasks.append((k, seed + 1000 * k + start, min(chunk_size, n_boot - start)))
+
+        start = time.perf_counter()
+        if n_jobs == 1:
+            chunks = [self._bootstrap_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(self,)) as pool:
+                chunks = list(pool.map(_bootstrap_task, tasks))
+        print(f'[OK] 自助法完成: {len(self.results)} 个检验 × {n_boot} 次, '
+              f'耗时 {time.perf_counter() - start:.1f}s')
+
+        rows = []
+        for k, res in enumerate(self.results):
+            F_boot = np.concatenate([c for (kk, _, _), c in zip(tasks, chunks) if kk == k])
+            rows.append({
+                '检验': f'{k}个门槛 vs {k + 1}个门槛',
+                'F统计量': res['F统计量'],
+                '自助p值': float(np.mean(F_boot >= res['F统计量'])),
+                '10%临界值': np.quantile(F_boot, 0.90),
+                '5%临界值': np.quantile(F_boot, 0.95),
+                '1%临界值': np.quantile(F_boot, 0.99),
+                '自助次数': len(F_boot),
+            })
+        self.tests = pd.DataFrame(rows)
+        return self.tests
+
+    def regime_regression(self, n_thresholds):
+        """
+        给定门槛个数, 估计分区制系数 (城市+年份固定效应, 城市聚类标准误)
+
+        Returns:
+        --------
+        pd.DataFrame : 变量、系数、聚类标准误、t值、p值
+        """
+        gammas = self.results[n_thresholds - 1]['门槛值']
+        edges = [-np.inf] + list(gammas) + [np.inf]
+        regimes, names = [], []
+        for r in range(len(edges) - 1):
+            mask = (self.q > edges[r]) & (self.q <= edges[r + 1])
+            regimes.append(np.where(mask, self.x, 0.0))
+            low = '' if r == 0 else f'{edges[r]:.3f}<'
+            high = '' if r == len(edges) - 2 else f'≤{edges[r + 1]:.3f}'
+            names.append(f'{self.regime_var} [{low}q{high}]')
+        X = np.column_stack(regimes + [self.sample[self.controls].to_numpy(dtype=np.float64)])
+        res = twfe_regression(self.sample[self.y_var].to_numpy(dtype=np.float64), X,
+                              self.entity, self.time, cluster_codes=self.entity,
+                              var_names=names + self.controls)
+        return pd.DataFrame({
+            '变量': res['var_names'],
+            '系数': res['coefficients'],
+            '聚类标准误': res['std_errors'],
+            't值': res['t_stats'],
+            'p值': res['p_values'],
+        })
+
+    def plot_lr(self, output_file='门槛回归_LR曲线.png', alpha=0.05):
+        """各门槛的 LR 曲线"""
+        fig, axes = plt.subplots(1, len(self.results), figsize=(6 * len(self.results), 5),
+                                 squeeze=False)
+        for ax, res in zip(axes[0], self.results):
+            curve = res['LR曲线']
+            ax.plot(curve['门槛值'], curve['LR'], color='#2c3e50', linewidth=1.2)
+            ax.axhline(lr_critical_value(alpha), color='red', linestyle='--', linewidth=1,
+                       label=f'{1 - alpha:.0%} 临界值')
+            ax.set_title(f'第{res["门槛个数"]}个门槛: γ = {res["新门槛值"]:.4f}',
+                         fontsize=12, fontweight='bold')
+            ax.set_xlabel(f'门槛变量 {self.threshold_var}')
+            ax.set_ylabel('LR 统计量')
+            ax.legend(fontsize=9)
+            ax.grid(True, alpha=0.3)
+        plt.tight_layout()
+        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.close()
+        print(f'[OK] LR曲线已保存: {output_file}')
+
+    def save_results(self, output_file='门槛回归结果.xlsx'):
+        """保存门槛估计、门槛检验与分区制系数"""
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            estimates = pd.DataFrame([{k: (', '.join(f'{g:.4f}' for g in v) if k == '门槛值' else v)
+                                       for k, v in res.items()
+                                       if k not in ('LR曲线', '门槛位置')}
+                                      for res in self.results])
+            estimates.to_excel(writer, sheet_name='门槛估计', index=False)
+            if self.tests is not None:
+                self.tests.to_excel(writer, sheet_name='门槛效应检验', index=False)
+            for k in range(1, len(self.results) + 1):
+                self.regime_regression(k).to_excel(writer, sheet_name=f'{k}门槛模型系数',
+                                                   index=False)
+        print(f'[OK] 门槛回归结果已保存: {output_file}')
+
+
+_MODEL = {}
+
+
+def _init_worker(model):
+    _MODEL['model'] = model
+
+
+def _bootstrap_task(task):
+    return _MODEL['model']._bootstrap_chunk(*task)
+
+
+def main(n_boot=300, n_jobs=None):
+    """
+    主函数: 人口密度门槛效应
+    """
+    print('[OK] === 面板门槛回归: 人口密度 ===')
+    df = pd.read_excel('总数据集_2007-2023_最终回归版.xlsx')
+    print(f'[OK] 数据集加载成功: {df.shape[0]} 观测 × {df.shape[1]} 变量')
+
+    model = PanelThresholdModel(df)
+    print(f'[INFO] 样本: {model.n} 观测, {model.n_entities} 个城市, '
+          f'候选门槛 {len(model.candidates)} 个 (修剪 {model.trim:.0%})')
+
+    model.fit(max_thresholds=3)
+    tests = model.bootstrap_test(n_boot=n_boot, n_jobs=n_jobs)
+    print('\n[INFO] 门槛效应检验:')
+    print(tests.to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+
+    significant = tests.index[tests['自助p值'] < 0.1]
+    n_thresholds = int(significant.max()) + 1 if len(significant) else 1
+    print(f'\n[INFO] {n_thresholds}门槛模型分区制系数:')
+    print(model.regime_regression(n_thresholds).to_string(index=False,
+                                                          float_format=lambda x: f'{x:.4f}'))
+
+    model.save_results()
+    model.plot_lr()
+    return model
+
+
+if __name__ == '__main__':
+    model = main()
@@ -11,6 +11,8 @@ Created: 2025-01-06
 import pandas as pd
 import numpy as np
 
+from panel_winsorize import Winsorizer
+
 # Load regression-ready dataset
 print('[OK] 加载回归准备版数据集...')
 df = pd.read_excel('总数据集_2007-2023_回归准备版.xlsx')
@@ -89,69 +91,18 @@ print(f'[INFO] 排除的变量数量: {len(excluded_vars)}')
 # ============================================================================
 print('\n[INFO] === 步骤3: 开始1%和99%分位数双侧缩尾 ===')
 
-# 记录缩尾前后的统计信息
-winsorize_summary = []
+# 所有变量的分位数在一次 np.nanquantile 调用中计算, 报告与缩尾同时生成
+winsorizer = Winsorizer(continuous_vars, lower=0.01, upper=0.99)
+df = winsorizer.fit_transform(df)
 
-for var in continuous_vars:
-    if var not in df.columns:
-        print(f'[WARNING] 变量 {var} 不存在，跳过')
-        continue
-
-    # 跳过全为缺失的变量
-    if df[var].isna().all():
-        print(f'[WARNING] 变量 {var} 全部缺失，跳过')
-        continue
-
-    # 记录原始统计
-    original_mean = df[var].mean()
-    original_std = df[var].std()
-    original_min = df[var].min()
-    original_max = df[var].max()
-    original_obs = df[var].notna().sum()
-
-    # 计算1%和99%分位数
-    lower_bound = df[var].quantile(0.01)
-    upper_bound = df[var].quantile(0.99)
-
-    # 进行缩尾处理
-    df[var] = df[var].clip(lower=lower_bound, upper=upper_bound)
-
-    # 记录缩尾后统计
-    winsorized_mean = df[var].mean()
-    winsorized_std = df[var].std()
-    winsorized_min = df[var].min()
-    winsorized_max = df[var].max()
-
-    # 记录变化
-    mean_change_pct = ((winsorized_mean - original_mean) / original_mean) * 100
-    clipped_lower = (df[var] <= lower_bound).sum()
-    clipped_upper = (df[var] >= upper_bound).sum()
-    total_clipped = clipped_lower + clipped_upper
-
-    winsorize_summary.append({
-        '变量': var,
-        '原始最小值': original_min,
-        '1%分位': lower_bound,
-        '原始均值': original_mean,
-        '99%分位': upper_bound,
-        '原始最大值': original_max,
-        '缩尾后最小值': winsorized_min,
-        '缩尾后均值': winsorized_mean,
-        '缩尾后最大值': winsorized_max,
-        '均值变化(%)': mean_change_pct,
-        '下尾缩尾数': clipped_lower,
-        '上尾缩尾数': clipped_upper,
-        '总缩尾数': total_clipped,
-        '缩尾比例(%)': (total_clipped / original_obs) * 100
-    })
-
-    print(f'[OK] {var}:')
-    print(f'      原始范围: [{original_min:.2f}, {original_max:.2f}]')
-    print(f'      缩尾范围: [{lower_bound:.2f}, {upper_bound:.2f}]')
-    print(f'      缩尾数量: 下尾{clipped_lower}, 上尾{clipped_upper}, 总计{total_clipped} ({(total_clipped/original_obs)*100:.2f}%)')
+for _, row in winsorizer.summary.iterrows():
+    print(f'[OK] {row["变量"]}:')
+    print(f'      原始范围: [{row["原始最小值"]:.2f}, {row["原始最大值"]:.2f}]')
+    print(f'      缩尾范围: [{row["1%分位"]:.2f}, {row["99%分位"]:.2f}]')
+    print(f'      缩尾数量: 下尾{row["下尾缩尾数"]}, 上尾{row["上尾缩尾数"]}, 总计{row["总缩尾数"]} ({row["缩尾比例(%)"]:.2f}%)')
 
 # 创建缩尾摘要表
-winsorize_df = pd.DataFrame(winsorize_summary)
+winsorize_df = winsorizer.summary
 
 print('\n[INFO] === 缩尾处理摘要 ===')
 print(f'处理变量总数: {len(continuous_vars)}')
@@ -207,20 +158,9 @@ print(f'    - 新增变量: ln_carbon_intensity')
 # ============================================================================
 print('\n[OK] 生成缩尾效果报告...')
 
-# 保存缩尾摘要表
+# 保存缩尾摘要表（含缩尾前原值明细，便于审计）
 winsorize_summary_file = '缩尾处理报告.xlsx'
-with pd.ExcelWriter(winsorize_summary_file, engine='openpyxl') as writer:
-    # 缩尾摘要表
-    winsorize_df.to_excel(writer, sheet_name='缩尾摘要', index=False)
-
-    # 原始vs缩尾对比
-    comparison_df = winsorize_df[['变量', '原始均值', '缩尾后均值', '均值变化(%)',
-                                   '原始最小值', '缩尾后最小值',
-                                   '原始最大值', '缩尾后最大值',
-                                   '总缩尾数', '缩尾比例(%)']]
-    comparison_df.to_excel(writer, sheet_name='缩尾前后对比', index=False)
-
-print(f'[OK] 缩尾效果报告已保存: {winsorize_summary_file}')
+winsorizer.save_report(winsorize_summary_file)
 
 print(f'\n[OK] === 处理完成 ===')
 print(f'    1. [OK] 碳排放强度已取对数: ln_carbon_intensity')